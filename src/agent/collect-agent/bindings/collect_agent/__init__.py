@@ -10,6 +10,8 @@ from ._collect_agent import (
         register_collect,
         send_log,
         send_stat,
+        send_stat_async,
+        send_stats_batch,
         store_files,
         reload_stat,
         remove_stat,
@@ -46,6 +48,37 @@ def use_configuration(filepath):
         remove_stat()
 
 
+class StatisticsBatch:
+    """Accumulate statistics to send them to rstats using as few messages as possible"""
+
+    def __init__(self, size=500, stored_files=False):
+        self.size = size
+        self.stored_files = stored_files
+        self.records = []
+
+    def send_stat(self, timestamp, suffix=None, metadatas=None, **statistics):
+        self.records.append((timestamp, statistics, suffix, metadatas))
+        if len(self.records) >= self.size:
+            return self.flush()
+
+    def flush(self):
+        records, self.records = self.records, []
+        if records:
+            return send_stats_batch(records, self.stored_files)
+
+
+@contextlib.contextmanager
+def batch(size=500):
+    """Context manager gathering statistics to forward them to rstats
+    in batches, either when `size` of them are waiting or on exit.
+    """
+    statistics = StatisticsBatch(size)
+    try:
+        yield statistics
+    finally:
+        statistics.flush()
+
+
 @contextlib.contextmanager
 def replace_all_signals(handler):
     def replace_signal(signum):
@@ -258,24 +258,22 @@ PyDoc_STRVAR(doc_send_log,
     "Send a log message to the collector.");
 
 
-static PyObject *
-collect_agent_send_stat(PyObject *self, PyObject *args, PyObject *kwargs)
+static bool
+parse_send_stat_arguments(
+        PyObject *args, PyObject *kwargs,
+        long long& timestamp, std::string& suffix,
+        json::JSON& statistics, json::JSON& metadata)
 {
-    long long timestamp = 0;
-    std::string suffix;
-
     if (!extract_statistics(args, timestamp, suffix, kwargs))
-        return nullptr;
+        return false;
 
-    json::JSON metadata;
-    json::JSON statistics = json::Object();
     if (kwargs) {
         PyObject *key, *value;
         Py_ssize_t pos = 0;
         while (PyDict_Next(kwargs, &pos, &key, &value)) {
             const char * c_key = PyUnicode_AsUTF8(key);
             if (c_key == nullptr)
-                return nullptr;
+                return false;
 
             if (std::strcmp(c_key, "metadatas") == 0) {
                 try {
@@ -283,7 +281,7 @@ collect_agent_send_stat(PyObject *self, PyObject *args, PyObject *kwargs)
                 } catch (std::bad_function_call& e) {
                     if (!PyErr_Occurred())
                         PyErr_SetString(PyExc_ValueError, "Incompatible type found in metadata dictionary");
-                    return nullptr;
+                    return false;
                 }
             } else {
                 try {
@@ -291,11 +289,25 @@ collect_agent_send_stat(PyObject *self, PyObject *args, PyObject *kwargs)
                 } catch (std::bad_function_call& e) {
                     if (!PyErr_Occurred())
                         PyErr_SetString(PyExc_ValueError, "Incompatible type found in statistics dictionary");
-                    return nullptr;
+                    return false;
                 }
             }
         }
     }
+    return true;
+}
+
+
+static PyObject *
+collect_agent_send_stat(PyObject *self, PyObject *args, PyObject *kwargs)
+{
+    long long timestamp = 0;
+    std::string suffix;
+    json::JSON metadata;
+    json::JSON statistics = json::Object();
+
+    if (!parse_send_stat_arguments(args, kwargs, timestamp, suffix, statistics, metadata))
+        return nullptr;
 
     std::string result;
     Py_BEGIN_ALLOW_THREADS
@@ -308,6 +320,140 @@ PyDoc_STRVAR(doc_send_stat,
     "Send a statistic message to the collector.");
 
 
+static PyObject *
+collect_agent_send_stat_async(PyObject *self, PyObject *args, PyObject *kwargs)
+{
+    long long timestamp = 0;
+    std::string suffix;
+    json::JSON metadata;
+    json::JSON statistics = json::Object();
+
+    if (!parse_send_stat_arguments(args, kwargs, timestamp, suffix, statistics, metadata))
+        return nullptr;
+
+    bool success = true;
+    Py_BEGIN_ALLOW_THREADS
+    success = collect_agent::send_stat_async(timestamp, statistics, metadata, suffix);
+    Py_END_ALLOW_THREADS
+    return Py_BuildValue("O", success ? Py_True : Py_False);
+}
+PyDoc_STRVAR(doc_send_stat_async,
+    "send_stat_async(timestamp, suffix=None, **statistics)\n\n"
+    "Send a statistic message to the collector without waiting\n"
+    "for rstats to process it. Return whether the message could\n"
+    "be sent; processing errors are counted by rstats and can be\n"
+    "retrieved using reload_stat().");
+
+
+static bool
+parse_statistics_record(PyObject *item, json::JSON& record)
+{
+    PyObject *sequence = PySequence_Fast(item, "Statistics records should be (timestamp, statistics[, suffix[, metadatas]]) tuples");
+    if (sequence == nullptr)
+        return false;
+
+    Py_ssize_t length = PySequence_Fast_GET_SIZE(sequence);
+    if (length < 2 || length > 4) {
+        PyErr_SetString(PyExc_ValueError, "Statistics records should be (timestamp, statistics[, suffix[, metadatas]]) tuples");
+        Py_DECREF(sequence);
+        return false;
+    }
+
+    PyObject **items = PySequence_Fast_ITEMS(sequence);
+    long long timestamp = PyLong_AsLongLong(items[0]);
+    if (PyErr_Occurred()) {
+        Py_DECREF(sequence);
+        return false;
+    }
+    record["timestamp"] = timestamp;
+
+    if (!PyDict_Check(items[1])) {
+        PyErr_SetString(PyExc_TypeError, "Statistics should be provided as a dictionary");
+        Py_DECREF(sequence);
+        return false;
+    }
+
+    try {
+        record["statistics"] = parse_json(items[1]);
+        if (length > 3 && items[3] != Py_None) {
+            record["metadatas"] = parse_json(items[3]);
+        }
+    } catch (std::bad_function_call& e) {
+        if (!PyErr_Occurred())
+            PyErr_SetString(PyExc_ValueError, "Incompatible type found in statistics record");
+        Py_DECREF(sequence);
+        return false;
+    }
+
+    if (length > 2 && items[2] != Py_None) {
+        PyObject *suffix = PyObject_Str(items[2]);
+        if (suffix == nullptr) {
+            Py_DECREF(sequence);
+            return false;
+        }
+        const char * c_suffix = PyUnicode_AsUTF8(suffix);
+        if (c_suffix == nullptr) {
+            Py_DECREF(suffix);
+            Py_DECREF(sequence);
+            return false;
+        }
+        record["suffix"] = c_suffix;
+        Py_DECREF(suffix);
+    }
+
+    Py_DECREF(sequence);
+    return true;
+}
+
+
+static PyObject *
+collect_agent_send_stats_batch(PyObject *self, PyObject *args, PyObject *kwargs)
+{
+    PyObject *python_records = nullptr;
+    int is_files = false;
+
+    static const char *argument_names[] = {"records", "stored_files", nullptr};
+    if (!PyArg_ParseTupleAndKeywords(
+            args, kwargs, "O|p", const_cast<char**>(argument_names),
+            &python_records, &is_files))
+        return nullptr;
+
+    PyObject *iterator = PyObject_GetIter(python_records);
+    if (iterator == nullptr)
+        return nullptr;
+
+    PyObject *item;
+    unsigned index = 0;
+    json::JSON records = json::Array();
+    while ((item = PyIter_Next(iterator))) {
+        json::JSON record = json::Object();
+        bool success = parse_statistics_record(item, record);
+        Py_DECREF(item);
+        if (!success) {
+            Py_DECREF(iterator);
+            return nullptr;
+        }
+        records[index++] = record;
+    }
+
+    Py_DECREF(iterator);
+    if (PyErr_Occurred())
+        return nullptr;
+
+    std::string result;
+    Py_BEGIN_ALLOW_THREADS
+    result = collect_agent::send_stats(records, is_files);
+    Py_END_ALLOW_THREADS
+    return Py_BuildValue("s", result.c_str());
+}
+PyDoc_STRVAR(doc_send_stats_batch,
+    "send_stats_batch(records, stored_files=False)\n\n"
+    "Send several statistics messages to the collector at once.\n\n"
+    "records is an iterable of (timestamp, statistics, suffix, metadatas)\n"
+    "tuples where statistics and metadatas are dictionaries. suffix\n"
+    "and metadatas are optional and can be omitted or set to None.");
+
+
 static PyObject *
 collect_agent_store_files(PyObject *self, PyObject *args, PyObject *kwargs)
 {
@@ -400,7 +546,9 @@ collect_agent_reload_stat(PyObject *self, PyObject *unused)
 }
 PyDoc_STRVAR(doc_reload_stat,
     "reload_stat()\n\n"
-    "Reload the configuration for the current job.");
+    "Reload the configuration for the current job. The response\n"
+    "contains the amount of statistics sent using send_stat_async\n"
+    "that rstats failed to process.");
 
 
 static PyObject *
@@ -520,6 +668,18 @@ static PyMethodDef CollectAgentMethods[] = {
         METH_VARARGS | METH_KEYWORDS,
         doc_send_stat
     },
+    {
+        "send_stat_async",
+        (PyCFunction)collect_agent_send_stat_async,
+        METH_VARARGS | METH_KEYWORDS,
+        doc_send_stat_async
+    },
+    {
+        "send_stats_batch",
+        (PyCFunction)collect_agent_send_stats_batch,
+        METH_VARARGS | METH_KEYWORDS,
+        doc_send_stats_batch
+    },
     {
         "store_files",
         (PyCFunction)collect_agent_store_files,
@@ -38,8 +38,8 @@ from setuptools import setup, Extension
 
 
 MAJOR_VERSION = '2'
-MINOR_VERSION = '2'
-DEBUG_VERSION = '2'
+MINOR_VERSION = '3'
+DEBUG_VERSION = '0'
 
 
 collect_agent = Extension(
@@ -31,6 +31,9 @@
 #include <string>
 #include <fstream>
 #include <cstring>
+#include <mutex>
+#include <memory>
+#include <array>
 #include <errno.h>
 #if defined(_WIN32)
 #include <direct.h>
@@ -46,6 +49,12 @@ unsigned int owner_scenario_instance_id = 0;
 std::string agent_name("");
 std::string job_name;
 
+/*
+ * Maximal size of statistics records packed into a single
+ * message, leaving some room for the rest of the command.
+ */
+const std::size_t MAX_BATCH_SIZE = 15 * 1024;
+
 
 namespace collect_agent {
 
@@ -123,13 +132,57 @@ bool make_path(const std::string& path){
 }
 
 
-/*
- * Helper class to manage timeouts on sockets
- */
 using asio::ip::udp;
 using std::placeholders::_1;
 using std::placeholders::_2;
 
+/*
+ * Helper function to run an asynchronous operation on a socket
+ * with a deadline; return whether or not it timed out.
+ */
+template <typename Socket>
+bool run_for(
+    asio::io_context& context,
+    Socket& socket,
+    std::chrono::steady_clock::duration duration) {
+  // Restart the io_context, as it may have been left in the "stopped" state
+  // by a previous operation.
+  context.restart();
+
+  // Block until the asynchronous operation has completed, or timed out. If
+  // the pending asynchronous operation is a composed operation, the deadline
+  // applies to the entire operation, rather than individual operations on
+  // the socket.
+  context.run_for(duration);
+
+  // If the asynchronous operation completed successfully then the io_context
+  // would have been stopped due to running out of work. If it was not
+  // stopped, then the io_context::run_for call must have timed out.
+  if (!context.stopped()) {
+    // Cancel the outstanding asynchronous operation.
+    socket.cancel();
+    // Run the io_context again until the operation completes.
+    context.run();
+    return true;
+  }
+  return false;
+}
+
+
+/*
+ * Completion handler storing the outcome of an asynchronous operation
+ */
+void store_result(
+    const std::error_code& error, std::size_t length,
+    std::error_code* out_error, std::size_t* out_length) {
+  *out_error = error;
+  *out_length = length;
+}
+
+
+/*
+ * Helper class to manage timeouts on sockets
+ */
 class RStatsClient {
   asio::io_context context;
   udp::socket socket;
@@ -145,7 +198,7 @@ public:
       std::chrono::steady_clock::duration timeout,
       std::error_code& error) {
     std::size_t length = 0;
-    socket.async_receive(buffer, std::bind(&RStatsClient::handler, _1, _2, &error, &length));
+    socket.async_receive(buffer, std::bind(store_result, _1, _2, &error, &length));
 
     run(timeout);
     return length;
@@ -157,7 +210,7 @@ public:
       std::chrono::steady_clock::duration timeout,
       std::error_code& error) {
     std::size_t length = 0;
-    socket.async_send_to(buffer, endpoint, std::bind(&RStatsClient::handler, _1, _2, &error, &length));
+    socket.async_send_to(buffer, endpoint, std::bind(store_result, _1, _2, &error, &length));
 
     run(timeout);
     return length;
@@ -172,47 +225,155 @@ public:
 
 private:
   void run(std::chrono::steady_clock::duration duration) {
-    // Restart the io_context, as it may have been left in the "stopped" state
-    // by a previous operation.
-    context.restart();
-    timeout = false;
-
-    // Block until the asynchronous operation has completed, or timed out. If
-    // the pending asynchronous operation is a composed operation, the deadline
-    // applies to the entire operation, rather than individual operations on
-    // the socket.
-    context.run_for(duration);
-
-    // If the asynchronous operation completed successfully then the io_context
-    // would have been stopped due to running out of work. If it was not
-    // stopped, then the io_context::run_for call must have timed out.
-    if (!context.stopped()) {
-      // Cancel the outstanding asynchronous operation.
-      socket.cancel();
-      timeout = true;
-      // Run the io_context again until the operation completes.
-      context.run();
+    timeout = run_for(context, socket, duration);
+  }
+};
+
+#if defined(ASIO_HAS_LOCAL_SOCKETS)
+using asio::local::stream_protocol;
+
+/*
+ * Helper class to exchange length-prefixed messages with the
+ * local RStats relay over a persistent unix socket
+ */
+class RStatsLocalClient {
+  asio::io_context context;
+  stream_protocol::socket socket;
+  bool timeout;
+
+public:
+  RStatsLocalClient(const std::string& path): socket(context), timeout(false) {
+    socket.connect(stream_protocol::endpoint(path));
+  }
+
+  void send(
+      const std::string& message,
+      std::chrono::steady_clock::duration timeout,
+      std::error_code& error) {
+    unsigned char header[4];
+    write_header(header, message.size());
+
+    std::array<asio::const_buffer, 2> buffers = {{
+      asio::buffer(header),
+      asio::buffer(message),
+    }};
+    std::size_t length = 0;
+    asio::async_write(socket, buffers, std::bind(store_result, _1, _2, &error, &length));
+
+    run(timeout);
+  }
+
+  std::string receive(
+      std::chrono::steady_clock::duration timeout,
+      std::error_code& error) {
+    unsigned char header[4];
+    std::size_t length = 0;
+    asio::async_read(socket, asio::buffer(header), std::bind(store_result, _1, _2, &error, &length));
+
+    run(timeout);
+    if (error || timed_out()) {
+      return std::string();
     }
+
+    std::string message(read_header(header), '\0');
+    asio::async_read(socket, asio::buffer(&message[0], message.size()), std::bind(store_result, _1, _2, &error, &length));
+
+    run(timeout);
+    return message;
   }
 
-  static void handler(
-      const std::error_code& error, std::size_t length,
-      std::error_code* out_error, std::size_t* out_length) {
-    *out_error = error;
-    *out_length = length;
+  inline bool timed_out() { return timeout; }
+
+private:
+  void run(std::chrono::steady_clock::duration duration) {
+    timeout = run_for(context, socket, duration);
+  }
+
+  static void write_header(unsigned char* header, std::size_t size) {
+    header[0] = (size >> 24) & 0xFF;
+    header[1] = (size >> 16) & 0xFF;
+    header[2] = (size >> 8) & 0xFF;
+    header[3] = size & 0xFF;
+  }
+
+  static std::size_t read_header(const unsigned char* header) {
+    return (std::size_t(header[0]) << 24) | (std::size_t(header[1]) << 16) | (std::size_t(header[2]) << 8) | std::size_t(header[3]);
   }
 };
 
+
+/*
+ * Helper function to send a message to the local RStats relay
+ * through its unix socket, if the RSTATS_SOCKET environment
+ * variable tells where to find it. Return false if the message
+ * could not be delivered this way so the caller can fallback
+ * to UDP.
+ */
+bool rstats_local_messager(const std::string& message, bool acknowledge, std::string& response) {
+  const char *env = std::getenv("RSTATS_SOCKET");
+  static const std::string path = env ? env : "";
+  static std::mutex mutex;
+  static std::unique_ptr<RStatsLocalClient> rstats;
+
+  if (path.empty()) {
+    return false;
+  }
+
+  std::lock_guard<std::mutex> lock(mutex);
+  // Try twice in case RStats restarted since our last message
+  for (int attempt = 0; attempt < 2; ++attempt) {
+    if (!rstats) {
+      try {
+        rstats.reset(new RStatsLocalClient(path));
+      } catch (std::exception&) {
+        return false;
+      }
+    }
+
+    std::error_code error;
+    rstats->send(message, std::chrono::seconds(10), error);
+    if (error || rstats->timed_out()) {
+      rstats.reset();
+      continue;
+    }
+
+    if (acknowledge) {
+      response = rstats->receive(std::chrono::seconds(30), error);
+      if (error || rstats->timed_out()) {
+        // The request may have been processed; do not send it again
+        rstats.reset();
+        send_log(LOG_ERR, "Error: Connexion to rstats was closed, could not get an answer");
+        throw asio::system_error(error ? error : asio::error::timed_out);
+      }
+    }
+    return true;
+  }
+
+  return false;
+}
+#else
+bool rstats_local_messager(const std::string&, bool, std::string&) {
+  return false;
+}
+#endif
+
+
 /*
  * Helper function to send a message to the local RStats relay.
  */
 std::string rstats_messager(const json::JSON& message) {
+  const std::string request = message.serialize();
+  std::string response;
+  if (rstats_local_messager(request, true, response)) {
+    return response;
+  }
+
   std::error_code error;
   RStatsClient rstats;
   static udp::endpoint endpoint = rstats.resolve("", "1111");
 
   // Connect to the RStats service and send our message
-  rstats.send_to(asio::buffer(message.serialize()), endpoint, std::chrono::seconds(10), error);
+  rstats.send_to(asio::buffer(request), endpoint, std::chrono::seconds(10), error);
   if (error || rstats.timed_out()) {
     send_log(LOG_ERR, "Error: Connexion to rstats refused, maybe rstats service isn't started");
     throw asio::system_error(error);
@@ -230,6 +391,34 @@ std::string rstats_messager(const json::JSON& message) {
 }
 
 
+/*
+ * Helper function to send a message to the local RStats relay
+ * without waiting for its response. RStats is told not to answer
+ * and will account for errors on its side instead.
+ */
+void rstats_notifier(json::JSON message) {
+  message["acknowledge"] = false;
+
+  const std::string request = message.serialize();
+  std::string response;
+  if (rstats_local_messager(request, false, response)) {
+    return;
+  }
+
+  static std::mutex mutex;
+  static RStatsClient rstats;
+  static udp::endpoint endpoint = rstats.resolve("", "1111");
+  std::lock_guard<std::mutex> lock(mutex);
+
+  std::error_code error;
+  rstats.send_to(asio::buffer(request), endpoint, std::chrono::seconds(10), error);
+  if (error || rstats.timed_out()) {
+    send_log(LOG_ERR, "Error: Connexion to rstats refused, maybe rstats service isn't started");
+    throw asio::system_error(error);
+  }
+}
+
+
 /*
  * Create the message to register and configure a new job;
  * send it to the RStats service and propagate its response.
@@ -416,16 +605,14 @@ std::string send_stat(
 
 
 /*
- * Create the message to generate a new statistic, with provided metadatas;
- * send it to the RStats service and propagate its response.
+ * Create the message to generate a new statistic, with provided metadatas.
  */
-std::string send_stat(
+json::JSON build_stat_command(
     long long timestamp,
     const json::JSON& stats,
     const json::JSON& metadatas,
     const std::string& suffix,
     bool is_files) {
-  // Format the message
   json::JSON command = {
     "command_id", 2,
     "command_parameters", {
@@ -439,6 +626,21 @@ std::string send_stat(
   if (suffix != "") {
     command["command_parameters"]["suffix"] = suffix;
   }
+  return command;
+}
+
+
+/*
+ * Create the message to generate a new statistic, with provided metadatas;
+ * send it to the RStats service and propagate its response.
+ */
+std::string send_stat(
+    long long timestamp,
+    const json::JSON& stats,
+    const json::JSON& metadatas,
+    const std::string& suffix,
+    bool is_files) {
+  json::JSON command = build_stat_command(timestamp, stats, metadatas, suffix, is_files);
 
   // Send the message and propagate RStats response
   try {
@@ -452,6 +654,90 @@ std::string send_stat(
 }
 
 
+/*
+ * Create the message to generate a new statistic, with provided metadatas;
+ * send it to the RStats service without waiting for its response.
+ */
+bool send_stat_async(
+    long long timestamp,
+    const json::JSON& stats,
+    const json::JSON& metadatas,
+    const std::string& suffix,
+    bool is_files) {
+  json::JSON command = build_stat_command(timestamp, stats, metadatas, suffix, is_files);
+
+  try {
+    rstats_notifier(command);
+  } catch (std::exception& e) {
+    send_log(LOG_ERR, "KO Failed to send statistic to rstats: %s", e.what());
+    return false;
+  }
+  return true;
+}
+
+
+/*
+ * Send a single message generating several statistics at once
+ * to the RStats service and propagate its response.
+ */
+std::string send_stats_message(const json::JSON& records, bool is_files) {
+  json::JSON command = {
+    "command_id", 8,
+    "command_parameters", {
+      "connection_id", rstats_connection_id,
+      "statistics", records,
+      "stored_files", is_files,
+    }
+  };
+
+  try {
+    return rstats_messager(command);
+  } catch (std::exception& e) {
+    std::string msg = "KO Failed to send statistics to rstats: ";
+    msg += e.what();
+    send_log(LOG_ERR, "%s", msg.c_str());
+    return msg;
+  }
+}
+
+
+/*
+ * Create the messages to generate several statistics at once;
+ * send them to the RStats service and propagate its response.
+ * Records are spread over as few messages as possible while
+ * keeping each of them under the size RStats can receive.
+ */
+std::string send_stats(const json::JSON& records, bool is_files) {
+  json::JSON batch = json::Array();
+  std::size_t batch_size = 0;
+  int count = records.length();
+
+  for (int i = 0; i < count; ++i) {
+    const json::JSON& record = records.at(i);
+    std::size_t record_size = record.serialize().size() + 1;
+    if (batch.length() > 0 && batch_size + record_size > MAX_BATCH_SIZE) {
+      std::string result = send_stats_message(batch, is_files);
+      if (result.compare(0, 2, "OK") != 0) {
+        return result;
+      }
+      batch = json::Array();
+      batch_size = 0;
+    }
+    batch.append(record);
+    batch_size += record_size;
+  }
+
+  if (batch.length() > 0) {
+    std::string result = send_stats_message(batch, is_files);
+    if (result.compare(0, 2, "OK") != 0) {
+      return result;
+    }
+  }
+
+  return "OK " + std::to_string(count < 0 ? 0 : count);
+}
+
+
 /*
  * Helper function that mimics `send_stat` functionality with
  * statistics values already formatted as JSON dump.
@@ -155,6 +155,30 @@ namespace collect_agent {
       const std::string& suffix="",
       bool is_files=false);
 
+  /*
+   * Send a new statistic containing several attributes
+   * for the given job, overriding metadatas stored in
+   * rstats, without waiting for rstats to acknowledge it.
+   * Errors are accounted for by rstats and can be
+   * retrieved using reload_stat.
+   */
+  DLL_PUBLIC bool send_stat_async(
+      long long timestamp,
+      const json::JSON& stats,
+      const json::JSON& metadatas,
+      const std::string& suffix="",
+      bool is_files=false);
+
+  /*
+   * Send several statistics at once for the given job.
+   * records is an array of objects containing the
+   * "timestamp" and "statistics" keys and optionally
+   * the "suffix" and "metadatas" keys.
+   */
+  DLL_PUBLIC std::string send_stats(
+      const json::JSON& records,
+      bool is_files=false);
+
   /*
    * Store a single file in a defined local path 
    */
@@ -181,7 +205,9 @@ namespace collect_agent {
       ...);
 
   /*
-   * Reload the configuration for a given job
+   * Reload the configuration for a given job and
+   * retrieve the amount of statistics sent using
+   * send_stat_async that rstats failed to process.
    */
   DLL_PUBLIC std::string reload_stat();
 
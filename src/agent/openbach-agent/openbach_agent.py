@@ -40,17 +40,30 @@ import os
 import sys
 import time
 import json
+import zlib
 import shlex
+import errno
+import queue
+import heapq
 import struct
 import signal
 import random
+import socket
+import ctypes
+import marshal
+import hashlib
 import platform
 import threading
 import traceback
+import selectors
+import itertools
+import ctypes.util
 import socketserver
 from pathlib import Path
-from datetime import datetime
 from subprocess import DEVNULL
+from concurrent import futures
+from functools import lru_cache
+from datetime import datetime, timedelta
 from contextlib import suppress, contextmanager
 
 import yaml
@@ -60,6 +73,10 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.jobstores.base import JobLookupError, ConflictingIdError
 from apscheduler.triggers.interval import IntervalTrigger
 from apscheduler.executors.pool import ThreadPoolExecutor
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 import collect_agent
 
@@ -71,6 +88,8 @@ try:
     INSTANCES_FOLDER = Path('/opt/openbach/agent/job_instances/')
     COLLECTOR_CONFIG_FILE = Path('/opt/openbach/agent/collector.yml')
     RSTATS_CONFIG_FILE = Path('/opt/openbach/agent/rstats/rstats.yml')
+    AGENT_NAME_FILE = Path('/opt/openbach/agent/agent_name')
+    HOSTNAME_FILE = Path('/etc/hostname')
 except ImportError:
     # If we failed assume we’re on windows
     import syslog_viveris as syslog
@@ -79,6 +98,8 @@ except ImportError:
     INSTANCES_FOLDER = Path(r'C:\openbach\instances')
     COLLECTOR_CONFIG_FILE = Path(r'C:\openbach\collector.yml')
     RSTATS_CONFIG_FILE = Path(r'C:\openbach\rstats\rstats.yml')
+    AGENT_NAME_FILE = Path(r'C:\openbach\agent_name')
+    HOSTNAME_FILE = AGENT_NAME_FILE
 
 
 def signal_term_handler(signal, frame):
@@ -93,6 +114,40 @@ def signal_term_handler(signal, frame):
 
 
 REQUEST_MAX_SIZE = 1_000_000
+# Close connections from the controller that stay idle that long
+CONNECTION_IDLE_TIMEOUT = 5 * 60
+# Run at most that many tagged requests of a connection concurrently
+CONNECTION_WORKERS = 8
+# Check for terminated job instances that often when they
+# cannot be watched through a process file descriptor
+REAPER_POLL_INTERVAL = 0.5
+# Leave that much time to job instances to terminate
+# before killing them when they are stopped
+STOP_GRACE_PERIOD = 1
+CGROUP_ROOT = Path('/sys/fs/cgroup')
+# Statistics about the resources used by job instances are
+# sent alongside the job's own ones, with this prefix
+RESOURCES_STATISTICS_PREFIX = 'openbach_agent_'
+RESOURCES_RSTATS_TIMEOUT = 1
+# Time-critical job instances are handed over to the start
+# dispatcher that long before their date. It waits for new orders
+# until PRECISE_START_SLEEP before the date, then uses an absolute
+# timer until PRECISE_START_SPIN before it and busy-waits for the
+# remaining time
+PRECISE_START_ADVANCE = 1
+PRECISE_START_SLEEP = 0.02
+PRECISE_START_SPIN = 0.001
+TIMER_ABSTIME = 1
+# Flush the state journal to disk at most that often and rewrite it
+# when it holds that many more records than pending orders
+JOURNAL_SYNC_INTERVAL = 1
+JOURNAL_COMPACTION_THRESHOLD = 1000
+# Bump whenever the layout of parsed jobs configurations changes
+# so cached entries from older Agents are parsed again
+JOBS_CACHE_VERSION = 1
+# Drop job instances lifecycle events when that many are
+# waiting to be sent to the subscribed connections
+JOB_EVENTS_QUEUE_SIZE = 1000
 
 
 class JobManager:
@@ -100,6 +155,7 @@ class JobManager:
     __shared_state = {
             'scheduler': None,
             'jobs': {},
+            'dispatching': set(),
             '_last_instance_id': random.randint(500000, 1000000),
             '_mutex': threading.RLock(),
     }
@@ -175,12 +231,14 @@ class JobManager:
                 raise BadRequest('No job {} is installed'.format(name))
             yield from job['instances'].items()
 
-    def add_instance(self, name, instance_id, arguments, date, interval):
+    def add_instance(self, name, instance_id, arguments, date, interval, scenario_id=0, owner_id=0):
         with self._mutex:
             self.jobs[name]['instances'][instance_id] = {
                     'args': arguments,
                     'date': date,
                     'interval': interval,
+                    'scenario_id': scenario_id,
+                    'owner_id': owner_id,
             }
 
     def pop_instance(self, name, instance_id):
@@ -189,6 +247,8 @@ class JobManager:
             instance = self.jobs[name]['instances'][instance_id]
             del instance['pid']
             del instance['return_code']
+            instance.pop('start_date', None)
+            instance.pop('cgroup', None)
             return instance_infos
 
     def get_instance(self, name, instance_id):
@@ -197,9 +257,35 @@ class JobManager:
             infos.update(self.jobs[name]['instances'][instance_id])
             return infos
 
-    def set_instance_started(self, name, instance_id, pid):
+    def is_instance_running(self, name, instance_id):
+        with self._mutex:
+            try:
+                instance = self.jobs[name]['instances'][instance_id]
+            except KeyError:
+                return False
+            return 'pid' in instance and instance['return_code'] is None
+
+    def is_instance_active(self, name, instance_id):
+        """Tell whether a job instance is running or waiting to be launched"""
+        with self._mutex:
+            return (
+                    self.is_instance_running(name, instance_id)
+                    or (name, instance_id) in self.dispatching
+                    or self.scheduler.get_job('{}_{}'.format(name, instance_id)) is not None)
+
+    def set_instance_dispatching(self, name, instance_id, dispatching=True):
+        """Mark a job instance as waiting in the StartDispatcher"""
+        with self._mutex:
+            if dispatching:
+                self.dispatching.add((name, instance_id))
+            else:
+                self.dispatching.discard((name, instance_id))
+
+    def set_instance_started(self, name, instance_id, pid, cgroup=None):
         with self._mutex:
-            self.jobs[name]['instances'][instance_id].update(pid=pid, return_code=None)
+            self.jobs[name]['instances'][instance_id].update(
+                    pid=pid, return_code=None, cgroup=cgroup,
+                    start_date=int(time.time() * 1000))
 
     def set_instance_status(self, name, instance_id, pid, return_code):
         if return_code is None:
@@ -214,6 +300,54 @@ class JobManager:
             if 'pid' in instance:
                 instance['return_code'] = return_code
 
+    def running_instances(self):
+        """List the name, instance id and informations of
+        every job instance whose process is running.
+        """
+        with self._mutex:
+            return [
+                    (name, instance_id, dict(instance))
+                    for name, job in self.jobs.items()
+                    for instance_id, instance in job['instances'].items()
+                    if 'pid' in instance and instance['return_code'] is None
+            ]
+
+    def get_instance_status(self, name, instance_id):
+        """Compute the status of a job instance along with the
+        informations about its process, if it was launched.
+        """
+        with self._mutex:
+            job = self.scheduler.get_job('{}_{}'.format(name, instance_id))
+            status = {'pid': None, 'return_code': None, 'start_date': None}
+            try:
+                infos = self.get_instance(name, instance_id)
+            except KeyError:
+                assert job is None
+                status['status'] = 'Not Scheduled'
+                return status
+
+            try:
+                pid = infos['pid']
+                return_code = infos['return_code']
+            except KeyError:
+                scheduled = job is not None or (name, instance_id) in self.dispatching
+                status['status'] = 'Scheduled' if scheduled else 'Stopped'
+                return status
+
+            status.update(pid=pid, return_code=return_code, start_date=infos.get('start_date'))
+            if return_code:
+                status['status'] = 'Error'
+            elif return_code is None:
+                assert psutil.pid_exists(pid)
+                status['status'] = 'Running'
+            elif job:
+                assert return_code == 0
+                assert isinstance(job.trigger, IntervalTrigger)
+                status['status'] = 'Running'
+            else:
+                status['status'] = 'Not Running'
+            return status
+
     @property
     def new_instance_id(self):
         with self._mutex:
@@ -222,6 +356,522 @@ class JobManager:
         return instance_id
 
 
+class ChildReaper:
+    """Watch the processes of the job instances from a single
+    thread and record their return code when they terminate.
+
+    Processes are watched through their pidfd when the platform
+    supports it and polled at regular intervals otherwise.
+    """
+    __shared_state = {
+            'processes': {},
+            'selector': None,
+            '_wakeup': None,
+            '_mutex': threading.Lock(),
+    }
+
+    def __init__(self):
+        # Apply the Borg pattern
+        self.__dict__ = self.__class__.__shared_state
+        with self._mutex:
+            if self.selector is None:
+                self.selector = selectors.DefaultSelector()
+                self._wakeup = socket.socketpair()
+                self._wakeup[0].setblocking(False)
+                self.selector.register(self._wakeup[0], selectors.EVENT_READ)
+                threading.Thread(target=self._reap, daemon=True).start()
+
+    def watch(self, process, name, instance_id):
+        try:
+            pidfd = os.pidfd_open(process.pid)
+        except (AttributeError, OSError):
+            pidfd = None
+
+        with self._mutex:
+            self.processes[process.pid] = (process, name, instance_id, pidfd)
+            if pidfd is not None:
+                self.selector.register(pidfd, selectors.EVENT_READ, process.pid)
+        # Make sure the reaper accounts for the new process
+        with suppress(OSError):
+            self._wakeup[1].send(b'\0')
+
+    def _reap(self):
+        while True:
+            with self._mutex:
+                polled = [pid for pid, (*_, pidfd) in self.processes.items() if pidfd is None]
+            timeout = REAPER_POLL_INTERVAL if polled else None
+
+            for key, _ in self.selector.select(timeout):
+                if key.data is None:
+                    with suppress(OSError):
+                        key.fileobj.recv(4096)
+                else:
+                    polled.append(key.data)
+
+            for pid in polled:
+                try:
+                    self._poll(pid)
+                except Exception:
+                    syslog.syslog(syslog.LOG_ERR, traceback.format_exc())
+
+    def _poll(self, pid):
+        with self._mutex:
+            try:
+                process, name, instance_id, pidfd = self.processes[pid]
+            except KeyError:
+                return
+
+        # Let the process object reap its child so it
+        # does not try to do it later on its own
+        return_code = process.poll()
+        if return_code is None:
+            return
+
+        with self._mutex:
+            del self.processes[pid]
+            if pidfd is not None:
+                self.selector.unregister(pidfd)
+                os.close(pidfd)
+
+        JobManager().set_instance_status(name, instance_id, pid, return_code)
+        JobEvents().publish('failed' if return_code else 'finished', name, instance_id)
+
+        cgroup = job_instance_cgroup(name, instance_id)
+        if cgroup is not None:
+            with suppress(OSError):
+                # Fails if the job left processes behind, they
+                # will be cleaned up when the instance is stopped
+                cgroup.rmdir()
+
+
+class ResourcesMonitor:
+    """Periodically sample the resources used by the running job
+    instances and send them to rstats on behalf of each instance.
+
+    Other statistics the Agent gathers about job instances are
+    sent through the same connections. These are opened by the
+    Agent alongside, not in place of, the jobs' own connections.
+    """
+    __shared_state = {
+            'connections': {},
+            'address': None,
+            'socket': None,
+            'agent_name': None,
+            '_mutex': threading.Lock(),
+    }
+
+    def __init__(self):
+        # Apply the Borg pattern
+        self.__dict__ = self.__class__.__shared_state
+        with self._mutex:
+            if self.socket is None:
+                self.address = ('127.0.0.1', read_rstats_port())
+                self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                self.socket.connect(self.address)
+                self.agent_name = read_agent_name()
+
+    def _rstats(self, command_id, acknowledge=True, **parameters):
+        message = json.dumps({
+                'command_id': command_id,
+                'command_parameters': parameters,
+                'acknowledge': acknowledge,
+        }).encode()
+        if not acknowledge:
+            self.socket.send(message)
+            return
+
+        # A dedicated socket per request so a late answer to
+        # a previous one can not be mistaken for this one's
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(RESOURCES_RSTATS_TIMEOUT)
+            sock.connect(self.address)
+            sock.send(message)
+            response = sock.recv(2048).rstrip(b'\0').decode()
+        if not response.startswith('OK'):
+            raise RequestWarning(response)
+        return response[3:]
+
+    def _connection(self, name, instance_id, infos):
+        with suppress(KeyError):
+            return self.connections[name, instance_id]
+
+        connection_id = int(self._rstats(
+                1, confpath=str(JOBS_FOLDER / name / '{}_rstats_filter.conf'.format(name)),
+                job_name=name, job_instance_id=instance_id,
+                scenario_instance_id=infos['scenario_id'],
+                owner_scenario_instance_id=infos['owner_id'],
+                agent_name=self.agent_name, owner='agent'))
+        self.connections[name, instance_id] = connection_id
+        return connection_id
+
+    def _send(self, name, instance_id, infos, statistics, timestamp):
+        try:
+            connection_id = self._connection(name, instance_id, infos)
+            self._rstats(
+                    2, False, connection_id=connection_id,
+                    timestamp=timestamp, statistics=statistics)
+        except (OSError, ValueError, RequestWarning) as e:
+            syslog.syslog(syslog.LOG_WARNING, 'Cannot send statistics to rstats: {}'.format(e))
+
+    def send(self, name, instance_id, infos, statistics, timestamp=None):
+        if timestamp is None:
+            timestamp = int(time.time() * 1000)
+        with self._mutex:
+            self._send(name, instance_id, infos, statistics, timestamp)
+
+    def sample(self):
+        with self._mutex:
+            running = set()
+            for name, instance_id, infos in JobManager().running_instances():
+                running.add((name, instance_id))
+                statistics = sample_resources(infos['pid'], infos.get('cgroup'))
+                if statistics:
+                    self._send(name, instance_id, infos, statistics, int(time.time() * 1000))
+
+            for instance in set(self.connections) - running:
+                connection_id = self.connections.pop(instance)
+                with suppress(OSError):
+                    self._rstats(4, False, connection_id=connection_id)
+
+    def forget(self):
+        """Drop cached connections, e.g. after rstats restarted"""
+        with self._mutex:
+            self.connections.clear()
+
+
+class StartDispatcher:
+    """Launch time-critical job instances as close as possible
+    to their requested date.
+
+    A single thread sleeps until shortly before the earliest
+    date and busy-waits for the remaining time, instead of
+    relying on the scheduler wake-up and thread pool dispatch.
+    Instances are reported as scheduled by the JobManager until
+    the dispatcher launches them.
+    """
+    __shared_state = {
+            'pending': [],
+            'thread': None,
+            '_counter': itertools.count(),
+            '_condition': threading.Condition(),
+    }
+
+    def __init__(self):
+        # Apply the Borg pattern
+        self.__dict__ = self.__class__.__shared_state
+        with self._condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def submit(self, date, job_name, instance_id, *arguments):
+        """Launch the given job instance at date, expressed
+        in seconds since the epoch.
+        """
+        with self._condition:
+            heapq.heappush(self.pending, (date, next(self._counter), job_name, instance_id, arguments))
+            self._condition.notify()
+
+    def cancel(self, job_name, instance_id):
+        with self._condition:
+            pending = [entry for entry in self.pending if entry[2:4] != (job_name, instance_id)]
+            if len(pending) != len(self.pending):
+                heapq.heapify(pending)
+                self.pending = pending
+                self._condition.notify()
+
+    def _next(self):
+        with self._condition:
+            while True:
+                if not self.pending:
+                    self._condition.wait()
+                    continue
+                remaining = self.pending[0][0] - time.time() - PRECISE_START_SLEEP
+                if remaining <= 0:
+                    return heapq.heappop(self.pending)
+                self._condition.wait(remaining)
+
+    def _run(self):
+        while True:
+            date, _, job_name, instance_id, arguments = self._next()
+            sleep_until(date - PRECISE_START_SPIN)
+            while time.time() < date:
+                pass
+            try:
+                launch_job(job_name, instance_id, *arguments, requested_date=date, dispatched=True)
+            except Exception as e:
+                syslog.syslog(
+                        syslog.LOG_ERR,
+                        'Cannot launch instance {} with id {}: {}'
+                        .format(job_name, instance_id, e))
+            finally:
+                JobManager().set_instance_dispatching(job_name, instance_id, False)
+
+
+class StateJournal:
+    """Append-only journal of the orders to start or stop job
+    instances at a latter date, used to recover them when the
+    Agent restarts.
+
+    Each record is a line holding a CRC32 and a JSON object so
+    a record torn by a crash is detected and ignored on replay.
+    The journal is rewritten atomically when it grows too large
+    compared to the amount of orders still pending.
+    """
+    __shared_state = {
+            'entries': None,
+            'stream': None,
+            'records': 0,
+            '_sync_timer': None,
+            '_mutex': threading.Lock(),
+    }
+
+    def __init__(self):
+        # Apply the Borg pattern
+        self.__dict__ = self.__class__.__shared_state
+        with self._mutex:
+            if self.entries is None:
+                self.entries = {}
+                INSTANCES_FOLDER.mkdir(parents=True, exist_ok=True)
+                self._replay()
+                self._compact()
+
+    @property
+    def path(self):
+        return INSTANCES_FOLDER / 'journal'
+
+    def _replay(self):
+        try:
+            stream = self.path.open('rb')
+        except FileNotFoundError:
+            return
+
+        with stream:
+            for line in stream:
+                try:
+                    checksum, record = line.rstrip(b'\n').split(b' ', 1)
+                    if not line.endswith(b'\n') or int(checksum, 16) != zlib.crc32(record):
+                        raise ValueError('Corrupted record')
+                    record = json.loads(record.decode())
+                except ValueError:
+                    # Torn write during a crash, nothing valid can follow
+                    syslog.syslog(syslog.LOG_WARNING, 'Ignoring the end of the state journal after a corrupted record')
+                    break
+                self._apply(record)
+
+    def _apply(self, record):
+        key = (record['name'], record['instance_id'], record['kind'])
+        content = record.get('content')
+        if content is None:
+            self.entries.pop(key, None)
+        else:
+            self.entries[key] = content
+
+    @staticmethod
+    def _encode(record):
+        record = json.dumps(record, separators=(',', ':')).encode()
+        return b'%08x %s\n' % (zlib.crc32(record), record)
+
+    def _compact(self):
+        temporary = self.path.with_suffix('.part')
+        with temporary.open('wb') as stream:
+            stream.writelines(
+                    self._encode({'name': name, 'instance_id': instance_id, 'kind': kind, 'content': content})
+                    for (name, instance_id, kind), content in self.entries.items())
+            stream.flush()
+            os.fsync(stream.fileno())
+        os.replace(temporary, self.path)
+
+        if self.stream is not None:
+            self.stream.close()
+        self.stream = self.path.open('ab', buffering=0)
+        self.records = len(self.entries)
+
+    def _append(self, name, instance_id, kind, content):
+        record = {'name': name, 'instance_id': instance_id, 'kind': kind, 'content': content}
+        with self._mutex:
+            self._apply(record)
+            # A single unbuffered write per record: complete
+            # as soon as the Agent process returns from it
+            self.stream.write(self._encode(record))
+            self.records += 1
+            if self.records > 2 * len(self.entries) + JOURNAL_COMPACTION_THRESHOLD:
+                self._compact()
+            elif self._sync_timer is None:
+                self._sync_timer = threading.Timer(JOURNAL_SYNC_INTERVAL, self.sync)
+                self._sync_timer.daemon = True
+                self._sync_timer.start()
+
+    def sync(self):
+        with self._mutex:
+            self._sync_timer = None
+            with suppress(OSError, ValueError):
+                os.fsync(self.stream.fileno())
+
+    def record(self, kind, **content):
+        self._append(content['name'], content['instance_id'], kind, content)
+
+    def discard(self, name, instance_id, kind):
+        with self._mutex:
+            if (name, instance_id, kind) not in self.entries:
+                return
+        self._append(name, instance_id, kind, None)
+
+    def pending(self):
+        with self._mutex:
+            return list(self.entries.items())
+
+
+class JobConfigurations:
+    """Registry of the parsed jobs configuration files.
+
+    Parsed configurations are cached in a binary file alongside
+    the jobs so they survive Agent restarts. A file is only read
+    again when its modification time or size changed, and only
+    parsed again when its content hash changed as well.
+    """
+    __shared_state = {
+            'entries': None,
+            '_dirty': False,
+            '_mutex': threading.Lock(),
+    }
+
+    def __init__(self):
+        # Apply the Borg pattern
+        self.__dict__ = self.__class__.__shared_state
+        with self._mutex:
+            if self.entries is None:
+                self.entries = self._load()
+
+    @property
+    def path(self):
+        return JOBS_FOLDER / 'configurations.cache'
+
+    def _load(self):
+        try:
+            with self.path.open('rb') as stream:
+                cache_version, entries = marshal.load(stream)
+        except FileNotFoundError:
+            return {}
+        except (OSError, EOFError, ValueError, TypeError):
+            syslog.syslog(syslog.LOG_WARNING, 'Ignoring corrupted jobs configuration cache')
+            return {}
+
+        if cache_version != JOBS_CACHE_VERSION or not isinstance(entries, dict):
+            return {}
+        return entries
+
+    def get(self, job_name):
+        filename = JOBS_FOLDER / '{}.yml'.format(job_name)
+        try:
+            stat = filename.stat()
+        except FileNotFoundError:
+            raise BadRequest('Conf file {} does not exist'.format(filename.name))
+
+        with self._mutex:
+            entry = self.entries.get(job_name)
+        if entry is not None and entry['mtime'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            return dict(entry['configuration'])
+
+        try:
+            content = filename.read_bytes()
+        except FileNotFoundError:
+            raise BadRequest('Conf file {} does not exist'.format(filename.name))
+        digest = hashlib.sha256(content).digest()
+        if entry is not None and entry['hash'] == digest:
+            configuration = entry['configuration']
+        else:
+            configuration = parse_job_configuration(job_name, content)
+
+        with self._mutex:
+            self.entries[job_name] = {
+                    'mtime': stat.st_mtime_ns,
+                    'size': stat.st_size,
+                    'hash': digest,
+                    'configuration': configuration,
+            }
+            self._dirty = True
+        return dict(configuration)
+
+    def prune(self, job_names):
+        """Forget about cached jobs that are not in job_names"""
+        with self._mutex:
+            for job_name in set(self.entries).difference(job_names):
+                del self.entries[job_name]
+                self._dirty = True
+
+    def save(self):
+        with self._mutex:
+            if not self._dirty:
+                return
+            temporary = self.path.with_suffix('.part')
+            try:
+                with temporary.open('wb') as stream:
+                    marshal.dump((JOBS_CACHE_VERSION, self.entries), stream)
+                os.replace(temporary, self.path)
+            except OSError as error:
+                syslog.syslog(syslog.LOG_WARNING, 'Cannot save jobs configuration cache: {}'.format(error))
+            else:
+                self._dirty = False
+
+
+class JobEvents:
+    """Publish job instances lifecycle events to the
+    connections that asked to be notified of them.
+
+    Events are sent from a dedicated thread so a slow
+    connection never holds up the thread publishing them;
+    they are dropped if too many are waiting to be sent.
+    """
+    __shared_state = {
+            'subscribers': {},
+            'pending': None,
+            '_mutex': threading.Lock(),
+    }
+
+    def __init__(self):
+        # Apply the Borg pattern
+        self.__dict__ = self.__class__.__shared_state
+        with self._mutex:
+            if self.pending is None:
+                self.pending = queue.Queue(JOB_EVENTS_QUEUE_SIZE)
+                threading.Thread(target=self._send, daemon=True).start()
+
+    def subscribe(self, handler, codec='json'):
+        with self._mutex:
+            self.subscribers[handler] = codec
+
+    def unsubscribe(self, handler):
+        with self._mutex:
+            self.subscribers.pop(handler, None)
+
+    def publish(self, event, name, instance_id):
+        with self._mutex:
+            subscribers = list(self.subscribers.items())
+        if not subscribers:
+            return
+
+        try:
+            status = JobManager().get_instance_status(name, instance_id)
+        except (RequestWarning, KeyError, AssertionError):
+            return
+
+        status.update(event=event, name=name, instance_id=instance_id, date=int(time.time() * 1000))
+        try:
+            self.pending.put_nowait((status, subscribers))
+        except queue.Full:
+            syslog.syslog(
+                    syslog.LOG_WARNING,
+                    'Too many pending events, dropping the {} event of '
+                    'instance {} with id {}'.format(event, name, instance_id))
+
+    def _send(self):
+        while True:
+            status, subscribers = self.pending.get()
+            for handler, codec in subscribers:
+                handler.send_event(status, codec)
+
+
 class TruncatedMessageException(Exception):
     """Raised when a received message is not advertised length"""
     def __init__(self, expected_length, length):
@@ -232,6 +882,8 @@ class TruncatedMessageException(Exception):
                 .format(expected_length, length)
         )
         super().__init__(message)
+        self.expected_length = expected_length
+        self.length = length
 
 
 class TooLongMessageException(Exception):
@@ -283,7 +935,10 @@ class AddJobAgent(AgentAction):
         super().__init__(name=name)
 
     def _action(self):
-        JobManager().add_job(self.name)
+        try:
+            JobManager().add_job(self.name)
+        finally:
+            JobConfigurations().save()
 
 
 class DelJobAgent(AgentAction):
@@ -309,41 +964,45 @@ class StatusJobInstanceAgent(AgentAction):
                 self.instance_id = manager._last_instance_id
 
     def _action(self):
-        with JobManager() as manager:
-            job = manager.scheduler.get_job('{}_{}'.format(self.name, self.instance_id))
-            try:
-                infos = manager.get_instance(self.name, self.instance_id)
-            except KeyError:
-                assert job is None
-                return 'Not Scheduled'
-
-            try:
-                pid = infos['pid']
-                return_code = infos['return_code']
-            except KeyError:
-                return 'Stopped' if job is None else 'Scheduled'
+        return JobManager().get_instance_status(self.name, self.instance_id)['status']
 
-            if return_code:
-                return 'Error'
 
-            if return_code is None:
-                assert psutil.pid_exists(pid)
-                return 'Running'
+class StatusJobInstancesAgent(AgentAction):
+    def __init__(self, instances):
+        super().__init__(instances=instances)
 
-            assert return_code == 0
-            if job:
-                assert isinstance(job.trigger, IntervalTrigger)
-                return 'Running'
+    def check_arguments(self):
+        try:
+            self.instances = [
+                    (instance['name'], int(instance['instance_id']))
+                    for instance in self.instances
+            ]
+        except (KeyError, TypeError, ValueError):
+            raise BadRequest(
+                    'Instances should be given as a list of '
+                    'dictionaries with a name and an instance_id')
 
-            return 'Not Running'
+    def _action(self):
+        statuses = []
+        with JobManager() as manager:
+            for name, instance_id in self.instances:
+                try:
+                    status = manager.get_instance_status(name, instance_id)
+                except RequestWarning as e:
+                    status = {'status': 'Error', 'error': e.reason}
+                except Exception:
+                    status = {'status': 'Error', 'error': traceback.format_exc()}
+                status.update(name=name, instance_id=instance_id)
+                statuses.append(status)
+        return statuses
 
 
 class StartJobInstanceAgent(AgentAction):
-    def __init__(self, name, instance_id, scenario_id, owner_id, date, interval, arguments, reschedule=False):
+    def __init__(self, name, instance_id, scenario_id, owner_id, date, interval, arguments, reschedule=False, precise=False):
         super().__init__(
                 name=name, instance_id=instance_id, scenario_id=scenario_id,
                 owner_id=owner_id, date=date, interval=interval,
-                arguments=arguments, reschedule=reschedule)
+                arguments=arguments, reschedule=reschedule, precise=precise)
 
     def _check_instance(self):
         with JobManager() as manager:
@@ -351,9 +1010,12 @@ class StartJobInstanceAgent(AgentAction):
                 self.instance_id = manager.new_instance_id
 
             if manager.has_instance(self.name, self.instance_id):
-                raise BadRequest(
-                        'Instance {} with id {} is already '
-                        'started'.format(self.name, self.instance_id))
+                # Orders replayed from the journal may target
+                # instances that were stopped in the meantime
+                if not self.reschedule or manager.is_instance_active(self.name, self.instance_id):
+                    raise BadRequest(
+                            'Instance {} with id {} is already '
+                            'started'.format(self.name, self.instance_id))
 
     def check_arguments(self):
         self._check_instance()
@@ -405,9 +1067,20 @@ class StartJobInstanceAgent(AgentAction):
                 # Schedule the Job Instance
                 if self.interval is None:
                     date = self._normalized_date()
-                    manager.scheduler.add_job(
-                            launch_job, 'date', run_date=date,
-                            args=arguments, id=scheduler_id)
+                    if self.precise and date is not None:
+                        dispatch_date = date - timedelta(seconds=PRECISE_START_ADVANCE)
+                        if time.time() < dispatch_date.timestamp():
+                            manager.scheduler.add_job(
+                                    StartDispatcher().submit, 'date',
+                                    run_date=dispatch_date,
+                                    args=(date.timestamp(),) + arguments,
+                                    id=scheduler_id)
+                        else:
+                            StartDispatcher().submit(date.timestamp(), *arguments)
+                    else:
+                        manager.scheduler.add_job(
+                                launch_job, 'date', run_date=date,
+                                args=arguments, id=scheduler_id)
                 else:
                     #if infos['persistent']:    This conditions is removed: the user 
                     #                           must take care when playing with intervals
@@ -425,20 +1098,25 @@ class StartJobInstanceAgent(AgentAction):
                         'An instance of the job {} with the id {} is already '
                         'scheduled'.format(self.name, self.instance_id))
 
+            if self.precise and self.interval is None and date is not None:
+                # The dispatcher can not launch it before the lock is released
+                manager.set_instance_dispatching(self.name, self.instance_id)
             manager.add_instance(
                     self.name, self.instance_id,
-                    self.arguments, self.date, self.interval)
+                    self.arguments, self.date, self.interval,
+                    self.scenario_id, self.owner_id)
 
         if date is not None or self.interval:
-            recover_file(
-                    self.name, self.instance_id, 'start',
+            StateJournal().record(
+                    'start',
                     name=self.name,
                     instance_id=self.instance_id,
                     scenario_id=self.scenario_id,
                     owner_id=self.owner_id,
                     date=None if date is None else date.timestamp() * 1000,
                     interval=self.interval,
-                    arguments=self.arguments)
+                    arguments=self.arguments,
+                    precise=self.precise)
 
         return self.instance_id
 
@@ -492,13 +1170,67 @@ class StopJobInstanceAgent(AgentAction):
                         trigger='date', run_date=date)
 
         if date is not None:
-            recover_file(
-                    self.name, self.instance_id, 'stop',
+            StateJournal().record(
+                    'stop',
                     name=self.name,
                     instance_id=self.instance_id,
                     date=date.timestamp() * 1000)
 
 
+class BulkAgentAction(AgentAction):
+    """Apply an action to several job instances in a single request
+    and report the outcome for each of them.
+    """
+    instance_action = None
+
+    def __init__(self, instances):
+        super().__init__(instances=instances)
+
+    def check_arguments(self):
+        try:
+            self.instances = [self.instance_action(**instance) for instance in self.instances]
+        except TypeError:
+            raise BadRequest(
+                    'Instances should be given as a list of '
+                    'dictionaries holding the arguments of {}'
+                    .format(self.instance_action.__name__))
+
+    def _action(self):
+        results = []
+        # Hold the lock for the whole batch so no other
+        # request can interleave with these instances
+        with JobManager():
+            for instance in self.instances:
+                result = self._instance_result(instance)
+                result.update(name=instance.name, instance_id=instance.instance_id)
+                results.append(result)
+        return results
+
+    @staticmethod
+    def _instance_result(instance):
+        try:
+            result = instance.action()
+        except BadRequest as e:
+            syslog.syslog(syslog.LOG_ERR, e.reason)
+            return {'status': 'KO', 'error': e.reason}
+        except RequestWarning as e:
+            syslog.syslog(syslog.LOG_WARNING, e.reason)
+            return {'status': 'OK', 'warning': e.reason}
+        except Exception:
+            error = traceback.format_exc()
+            syslog.syslog(syslog.LOG_ERR, error)
+            return {'status': 'KO', 'error': error}
+        return {'status': 'OK', 'result': result}
+
+
+class StartJobInstancesAgent(BulkAgentAction):
+    instance_action = StartJobInstanceAgent
+
+
+class StopJobInstancesAgent(BulkAgentAction):
+    instance_action = StopJobInstanceAgent
+
+
 class StatusJobsAgent(AgentAction):
     def __init__(self):
         super().__init__()
@@ -513,12 +1245,20 @@ class RestartAgent(AgentAction):
 
     def _action(self):
         with JobManager() as manager:
-            for job_name in manager.job_names:
-                for job_instance_id, _ in manager.get_instances(job_name):
-                    manager.scheduler.add_job(
-                            stop_job, 'date',
-                            args=(job_name, job_instance_id, False),
-                            id='{}_{}_stop'.format(job_name, job_instance_id))
+            stops = [
+                    threading.Thread(
+                        target=stop_job,
+                        args=(job_name, job_instance_id, False),
+                        daemon=True)
+                    for job_name in manager.job_names
+                    for job_instance_id, _ in manager.get_instances(job_name)
+            ]
+
+        # Instances must be stopped before their orders are replayed
+        for stop in stops:
+            stop.start()
+        for stop in stops:
+            stop.join()
 
         if self.reload:
             recover_old_state()
@@ -544,6 +1284,7 @@ class ChangeCollector(AgentAction):
     def _action(self):
         write_yaml(self.collector, COLLECTOR_CONFIG_FILE)
         collect_agent.restart_rstats()
+        ResourcesMonitor().forget()
 
 
 def load_yaml(filename):
@@ -558,22 +1299,112 @@ def write_yaml(content, filename):
         yaml.dump(content, stream, default_flow_style=False, explicit_start=True)
 
 
-def recover_file(job_name, job_instance_id, extension, **content):
-    """Save informations about a job in a specific file in case the Agent restarts"""
-    filename = '{}{}.{}'.format(job_name, job_instance_id, extension)
-    write_yaml(content, INSTANCES_FOLDER / filename)
-    return filename
+@lru_cache(maxsize=None)
+def job_instances_cgroup():
+    """Return the cgroup v2 sub-tree dedicated to job instances
+    or None if the system does not allow to kill a whole cgroup.
+    """
+    if not (CGROUP_ROOT / 'cgroup.controllers').exists():
+        # cgroup v1 or hybrid hierarchy
+        return None
 
+    try:
+        with open('/proc/self/cgroup') as cgroups:
+            for line in cgroups:
+                hierarchy, _, path = line.rstrip('\n').split(':', 2)
+                if hierarchy == '0':
+                    break
+            else:
+                return None
+        cgroup = CGROUP_ROOT.joinpath(path.lstrip('/'), 'job_instances')
+        cgroup.mkdir(exist_ok=True)
+    except (OSError, ValueError):
+        return None
+
+    if not (cgroup / 'cgroup.kill').exists():
+        # Linux older than 5.14
+        return None
+    return cgroup
+
+
+def job_instance_cgroup(job_name, instance_id):
+    cgroup = job_instances_cgroup()
+    if cgroup is not None:
+        return cgroup / '{}_{}'.format(job_name, instance_id)
+
+
+def create_job_instance_cgroup(job_name, instance_id):
+    cgroup = job_instance_cgroup(job_name, instance_id)
+    if cgroup is not None:
+        try:
+            cgroup.mkdir(exist_ok=True)
+        except OSError:
+            return None
+    return cgroup
+
+
+def is_cgroup_populated(cgroup):
+    with suppress(OSError), (cgroup / 'cgroup.events').open() as events:
+        for line in events:
+            key, value = line.split()
+            if key == 'populated':
+                return value != '0'
+    return False
 
-def popen(command, args, **kwargs):
+
+def wait_cgroup_empty(cgroup, timeout):
+    deadline = time.monotonic() + timeout
+    while is_cgroup_populated(cgroup):
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def stop_cgroup(cgroup):
+    """Stop every process of a cgroup at once: ask them to
+    terminate then kill the whole cgroup after a grace period.
+
+    Return whether the processes could be handled through
+    the cgroup at all.
+    """
+    try:
+        pids = (cgroup / 'cgroup.procs').read_text().split()
+    except FileNotFoundError:
+        # Removed when the job instance terminated on its own
+        return True
+    except OSError:
+        return False
+
+    for pid in pids:
+        with suppress(OSError):
+            os.kill(int(pid), signal.SIGTERM)
+
+    try:
+        if not wait_cgroup_empty(cgroup, STOP_GRACE_PERIOD):
+            (cgroup / 'cgroup.kill').write_text('1')
+            wait_cgroup_empty(cgroup, STOP_GRACE_PERIOD)
+        cgroup.rmdir()
+    except OSError:
+        pass
+    return True
+
+
+def popen(command, args, cgroup=None, **kwargs):
     """Start a command with the provided arguments and
     return the associated process.
 
+    If a cgroup is provided, the process moves itself in
+    it before running the command so every process that
+    the command spawns ends up in the same cgroup.
+
     Additional keywords arguments can be passed to the
     Popen constructor to manage the process creation.
     """
 
     kwargs.pop('shell', False)
+    if cgroup is not None:
+        command = ['/bin/sh', '-c', 'echo $$ > "$0"; exec "$@"', str(cgroup / 'cgroup.procs')] + command
     return psutil.Popen(
             command + args,
             stdout=DEVNULL,
@@ -581,10 +1412,57 @@ def popen(command, args, **kwargs):
             **kwargs)
 
 
+class Timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+@lru_cache(maxsize=None)
+def realtime_clock_sleep():
+    """Return the libc function sleeping until an absolute date
+    on the realtime clock, or None if the platform lacks it.
+    """
+    try:
+        clock_nanosleep = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True).clock_nanosleep
+    except (OSError, TypeError, AttributeError):
+        return None
+
+    clock_nanosleep.argtypes = (
+            ctypes.c_int, ctypes.c_int,
+            ctypes.POINTER(Timespec), ctypes.POINTER(Timespec))
+    return clock_nanosleep
+
+
+def sleep_until(date):
+    """Sleep until the given date, expressed in seconds since the
+    epoch, using an absolute timer on the realtime clock when the
+    platform provides one so clock adjustments are accounted for.
+    """
+    clock_nanosleep = realtime_clock_sleep()
+    if clock_nanosleep is None:
+        remaining = date - time.time()
+        if remaining > 0:
+            time.sleep(remaining)
+        return
+
+    seconds = int(date)
+    deadline = Timespec(seconds, int((date - seconds) * 1e9))
+    while clock_nanosleep(time.CLOCK_REALTIME, TIMER_ABSTIME, deadline, None) == errno.EINTR:
+        pass
+
+
 def launch_job(
         job_name, instance_id, scenario_instance_id,
-        owner_scenario_instance_id, command, args):
-    """Launch the Job Instance and wait for its termination"""
+        owner_scenario_instance_id, command, args,
+        requested_date=None, dispatched=False):
+    """Launch the Job Instance and let the ChildReaper
+    watch for its termination.
+
+    If the date the instance was requested to start at is
+    provided, the delay to actually start it is published
+    as a statistic of the instance. Instances coming from
+    the StartDispatcher are only launched if they were not
+    stopped in the meantime.
+    """
     # Add some environement variable for the Job Instance
     environ = os.environ.copy()
     environ.update({
@@ -594,13 +1472,90 @@ def launch_job(
         'OWNER_SCENARIO_INSTANCE_ID': str(owner_scenario_instance_id),
     })
 
+    with JobManager() as manager:
+        if dispatched:
+            if (job_name, instance_id) not in manager.dispatching:
+                # Stopped while waiting for its start date
+                return
+            manager.set_instance_dispatching(job_name, instance_id, False)
+        if manager.is_instance_running(job_name, instance_id):
+            # Periodic instance taking longer than its interval
+            syslog.syslog(
+                    syslog.LOG_WARNING,
+                    'Instance {} with id {} is still running, skipping '
+                    'this execution'.format(job_name, instance_id))
+            return
+        job_config = manager.get_job(job_name)
+
     # Launch the Job Instance
-    job_config = JobManager().get_job(job_name)
-    proc = popen(command, args, env=environ, shell=job_config['sudo'])
-    pid = proc.pid
-    JobManager().set_instance_started(job_name, instance_id, pid)
-    return_code = proc.wait()
-    JobManager().set_instance_status(job_name, instance_id, pid, return_code)
+    cgroup = create_job_instance_cgroup(job_name, instance_id)
+    proc = popen(command, args, cgroup, env=environ, shell=job_config['sudo'])
+    started = time.time()
+    JobManager().set_instance_started(
+            job_name, instance_id, proc.pid,
+            None if cgroup is None else str(cgroup))
+    JobEvents().publish('started', job_name, instance_id)
+    ChildReaper().watch(proc, job_name, instance_id)
+
+    if requested_date is not None:
+        JobManager().scheduler.add_job(
+                publish_start_skew, args=(
+                    job_name, instance_id, scenario_instance_id,
+                    owner_scenario_instance_id, requested_date, started))
+
+
+def publish_start_skew(
+        job_name, instance_id, scenario_instance_id,
+        owner_scenario_instance_id, requested_date, started):
+    """Send the delay between the requested start date of a
+    job instance and its actual start to rstats.
+    """
+    infos = {'scenario_id': scenario_instance_id, 'owner_id': owner_scenario_instance_id}
+    statistics = {RESOURCES_STATISTICS_PREFIX + 'start_skew': (started - requested_date) * 1000}
+    ResourcesMonitor().send(job_name, instance_id, infos, statistics, int(started * 1000))
+
+
+def sample_resources(pid, cgroup=None):
+    """Sum the resources used by the processes of a job instance"""
+    processes = []
+    try:
+        if cgroup is not None:
+            pids = (Path(cgroup) / 'cgroup.procs').read_text().split()
+            processes = [psutil.Process(int(process_id)) for process_id in pids]
+        else:
+            process = psutil.Process(pid)
+            processes = [process] + process.children(recursive=True)
+    except (OSError, psutil.Error):
+        pass
+
+    statistics = dict.fromkeys((
+            'processes', 'threads', 'cpu_user', 'cpu_system', 'memory_rss',
+            'ctx_switches_voluntary', 'ctx_switches_involuntary',
+            'io_read_bytes', 'io_write_bytes'), 0)
+    for process in processes:
+        try:
+            with process.oneshot():
+                cpu = process.cpu_times()
+                switches = process.num_ctx_switches()
+                statistics['threads'] += process.num_threads()
+                statistics['memory_rss'] += process.memory_info().rss
+                with suppress(psutil.AccessDenied, AttributeError):
+                    io = process.io_counters()
+                    statistics['io_read_bytes'] += io.read_bytes
+                    statistics['io_write_bytes'] += io.write_bytes
+        except psutil.Error:
+            continue
+        statistics['processes'] += 1
+        statistics['cpu_user'] += cpu.user
+        statistics['cpu_system'] += cpu.system
+        statistics['ctx_switches_voluntary'] += switches.voluntary
+        statistics['ctx_switches_involuntary'] += switches.involuntary
+
+    if statistics['processes']:
+        return {
+                RESOURCES_STATISTICS_PREFIX + name: value
+                for name, value in statistics.items()
+        }
 
 
 def stop_job(job_name, job_instance_id, remove_recover_file=True):
@@ -610,26 +1565,36 @@ def stop_job(job_name, job_instance_id, remove_recover_file=True):
     with JobManager() as manager:
         try:
             infos = manager.pop_instance(job_name, job_instance_id)
-            args = infos['args']
-            command = infos['command_stop']
         except KeyError:
-            pass  # Job is already stopped
-        else:
+            infos = None  # Job is already stopped
+        with suppress(JobLookupError):
+            manager.scheduler.remove_job('{}_{}'.format(job_name, job_instance_id))
+        StartDispatcher().cancel(job_name, job_instance_id)
+        manager.set_instance_dispatching(job_name, job_instance_id, False)
+
+    # Processes are stopped outside of the lock so
+    # several instances can be stopped concurrently
+    try:
+        if infos is not None:
             stop_job_already_running(job_name, job_instance_id, infos)
+            command = infos['command_stop']
             if command:
-                job_config = manager.get_job(job_name)
-                popen(command, args, shell=job_config['sudo']).wait()
-        finally:
-            with suppress(JobLookupError):
-                manager.scheduler.remove_job('{}_{}'.format(job_name, job_instance_id))
-            if remove_recover_file:
-                with suppress(OSError):
-                    os.remove(recover_file(job_name, job_instance_id, 'start'))
+                popen(command, infos['args'], shell=infos['sudo']).wait()
+    finally:
+        if remove_recover_file:
+            journal = StateJournal()
+            journal.discard(job_name, job_instance_id, 'start')
+            journal.discard(job_name, job_instance_id, 'stop')
 
 
 def stop_job_already_running(job_name, job_instance_id, instance_infos):
     """Stop a running process that should be a child of the Agent"""
 
+    # Kill the whole cgroup of the job instance, if any
+    cgroup = instance_infos.get('cgroup')
+    if cgroup is not None and stop_cgroup(Path(cgroup)):
+        return
+
     # Get the process
     try:
         pid = instance_infos['pid']
@@ -662,9 +1627,16 @@ def stop_job_already_running(job_name, job_instance_id, instance_infos):
 class AgentServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
     """Choose the underlying technology for our sockets servers"""
     allow_reuse_address = True
+    # Connections are kept open between commands, do not wait for them on exit
+    daemon_threads = True
 
 
 class RequestHandler(socketserver.BaseRequestHandler):
+    def setup(self):
+        self.request.settimeout(CONNECTION_IDLE_TIMEOUT)
+        self.lock = threading.Lock()
+        self.workers = futures.ThreadPoolExecutor(CONNECTION_WORKERS)
+
     def _read_all(self, amount):
         if amount > REQUEST_MAX_SIZE:
             raise TooLongMessageException(amount)
@@ -681,60 +1653,107 @@ class RequestHandler(socketserver.BaseRequestHandler):
         return buffer
 
     def finish(self):
+        JobEvents().unsubscribe(self)
+        self.workers.shutdown(wait=False)
         self.request.close()
 
     def handle(self):
-        """Handle message comming from the conductor"""
+        """Handle messages comming from the conductor until
+        it closes the connection or leave it idle for too long.
+        """
+        while True:
+            try:
+                message_length = self._read_all(4)
+            except TruncatedMessageException as e:
+                if e.length:
+                    syslog.syslog(syslog.LOG_WARNING, 'Improper message from {}: {}'.format(self.client_address, e))
+                return
+            except OSError:
+                # Idle timeout or connection reset
+                return
+
+            try:
+                message_length, = struct.unpack('>I', message_length)
+                message = self._read_all(message_length)
+            except (TruncatedMessageException, TooLongMessageException) as e:
+                self.send_response(
+                        'Improper message from {}: '
+                        '{}'.format(self.client_address, e),
+                        syslog.LOG_WARNING)
+                return
+            except OSError:
+                return
+
+            self.handle_message(message)
+
+    def handle_message(self, message):
+        """Parse a message and run the associated action. Messages
+        tagged with a request identifier are executed concurrently
+        and their response is tagged with the same identifier.
+        """
+        try:
+            message, codec = decode_message(message)
+        except (ValueError, yaml.error.YAMLError) as e:
+            self.send_response(
+                    'Error parsing the message as a JSON '
+                    'dictionary: {}'.format(e), syslog.LOG_CRIT)
+            return
+
+        try:
+            request_id = message.pop('request_id', None)
+            accepted_codecs = message.pop('codecs', ())
+            subscribe = message.pop('events', False)
+        except AttributeError:
+            request_id = None
+            accepted_codecs = ()
+            subscribe = False
+
+        reply = {'request_id': request_id, 'codec': codec}
+        if msgpack is not None and 'msgpack' in accepted_codecs:
+            # Let the conductor know it can switch to a binary codec
+            reply['preferred_codec'] = 'msgpack'
+
+        if subscribe:
+            JobEvents().subscribe(self, reply.get('preferred_codec', codec))
+
+        if request_id is None:
+            self.execute(message, **reply)
+        else:
+            self.workers.submit(self.execute, message, **reply)
+
+    def execute(self, message, **reply):
         try:
-            message_length = self._read_all(4)
-            message_length, = struct.unpack('>I', message_length)
-            message = self._read_all(message_length).decode()
-            syslog.syslog(syslog.LOG_INFO, message)
-            message = yaml.safe_load(message)
             action_name = message['command_name']
             arguments = message['command_arguments']
             action = ''.join(map(str.title, action_name.split('_')))
             handler = getattr(sys.modules[__name__], action)(**arguments)
-        except (TruncatedMessageException, TooLongMessageException) as e:
-            self.send_response(
-                    'Improper message from {}: '
-                    '{}'.format(self.client_address, e),
-                    syslog.LOG_WARNING)
-        except yaml.error.YAMLError as e:
-            self.send_response(
-                    'Error parsing the message as a JSON '
-                    'dictionary: {}'.format(e), syslog.LOG_CRIT)
-        except struct.error as e:
-            self.send_response(
-                    'Error converting the message length to '
-                    'an integer: {}'.format(e), syslog.LOG_CRIT)
         except KeyError as e:
             self.send_response(
                     'Missing mandatory argument: {}'.format(e),
-                    syslog.LOG_ERR)
+                    syslog.LOG_ERR, **reply)
         except AttributeError:
             self.send_response(
                     'Unknown action: {}'.format(action_name),
-                    syslog.LOG_CRIT)
+                    syslog.LOG_CRIT, **reply)
         except TypeError as e:
             self.send_response(
                     'Bad parameters: {}'.format(e),
-                    syslog.LOG_CRIT)
+                    syslog.LOG_CRIT, **reply)
         except Exception:
-            self.send_response(traceback.format_exc(), syslog.LOG_ALERT)
+            self.send_response(traceback.format_exc(), syslog.LOG_ALERT, **reply)
         else:
             try:
                 result = handler.action()
             except BadRequest as e:
-                self.send_response(e.reason, syslog.LOG_ERR)
+                self.send_response(e.reason, syslog.LOG_ERR, **reply)
             except RequestWarning as e:
-                self.send_response(e.reason, syslog.LOG_WARNING)
+                self.send_response(e.reason, syslog.LOG_WARNING, **reply)
             except Exception as e:
-                self.send_response(traceback.format_exc(), syslog.LOG_ERR)
+                self.send_response(traceback.format_exc(), syslog.LOG_ERR, **reply)
             else:
-                self.send_response(result)
+                self.send_response(result, **reply)
 
-    def send_response(self, message, severity=None):
+    def send_response(self, message, severity=None, request_id=None, codec='json', preferred_codec=None):
         if severity is None:
             status = 'OK'
             key = 'result'
@@ -747,12 +1766,49 @@ class RequestHandler(socketserver.BaseRequestHandler):
             key = 'error'
             syslog.syslog(severity, message)
 
-        result = json.dumps({
+        response = {
             'status': status,
             key: message,
-        }).encode()
+        }
+        if request_id is not None:
+            response['request_id'] = request_id
+        if preferred_codec is not None:
+            response['codec'] = preferred_codec
+
+        self._send(response, codec)
+
+    def send_event(self, event, codec='json'):
+        self._send({'event': event}, codec)
+
+    def _send(self, message, codec):
+        result = encode_message(message, codec)
         length = struct.pack('>I', len(result))
-        self.request.sendall(length + result)
+        with self.lock, suppress(OSError):
+            self.request.sendall(length + result)
+
+
+def decode_message(payload):
+    """Decode a message from the conductor and return it along
+    with the codec it used: msgpack (if available) and JSON are
+    recognized, YAML is kept for older clients.
+    """
+    if msgpack is not None and payload[:1] and (0x80 <= payload[0] <= 0x8f or payload[0] in (0xde, 0xdf)):
+        message = msgpack.unpackb(payload, raw=False)
+        syslog.syslog(syslog.LOG_INFO, repr(message))
+        return message, 'msgpack'
+
+    message = payload.decode()
+    syslog.syslog(syslog.LOG_INFO, message)
+    try:
+        return json.loads(message), 'json'
+    except ValueError:
+        return yaml.safe_load(message), 'yaml'
+
+
+def encode_message(message, codec='json'):
+    if codec == 'msgpack':
+        return msgpack.packb(message, use_bin_type=True)
+    return json.dumps(message).encode()
 
 
 def list_jobs_in_dir(dirname):
@@ -765,14 +1821,16 @@ def list_jobs_in_dir(dirname):
 
 
 def read_job_configuration(job_name):
+    return JobConfigurations().get(job_name)
+
+
+def parse_job_configuration(job_name, content):
     # Load the configuration
     filename = '{}.yml'.format(job_name)
     try:
-        content = load_yaml(JOBS_FOLDER / filename)
+        content = yaml.safe_load(content)
     except yaml.YAMLError:
         raise BadRequest('Conf file {} not well formed'.format(filename))
-    except FileNotFoundError:
-        raise BadRequest('Conf file {} does not exist'.format(filename))
 
     # Register the configuration
     args = content.get('arguments', {})
@@ -843,12 +1901,16 @@ def populate_installed_jobs():
     """Read configuration files of Installed Jobs and
     store them into the JobManager.
     """
+    jobs = list(list_jobs_in_dir(JOBS_FOLDER))
+    configurations = JobConfigurations()
+    configurations.prune(jobs)
     with JobManager() as manager:
-        for job in list_jobs_in_dir(JOBS_FOLDER):
+        for job in jobs:
             try:
                 manager.add_job(job)
             except RequestWarning as e:
                 syslog.syslog(syslog.LOG_ERR, e.reason)
+    configurations.save()
 
 
 def recover_old_state():
@@ -856,20 +1918,34 @@ def recover_old_state():
     recover from a failure, depending of the current date.
     """
     loaders = {
-            '.start': StartJobInstanceAgent,
-            '.stop': StopJobInstanceAgent,
+            'start': StartJobInstanceAgent,
+            'stop': StopJobInstanceAgent,
     }
 
-    for filepath in INSTANCES_FOLDER.glob('**/*'):
-        try:
-            content = load_yaml(filepath)
-            content['reschedule'] = True
-            handler = loaders[filepath.suffix](**content)
-            handler.action()
-        except Exception:
+    journal = StateJournal()
+    # Import orders saved by older Agents, one YAML file each
+    for kind in loaders:
+        for filepath in INSTANCES_FOLDER.glob('**/*.{}'.format(kind)):
+            with suppress(Exception):
+                content = load_yaml(filepath)
+                journal.record(kind, **content)
             with suppress(OSError):
                 os.remove(filepath)
 
+    for (name, instance_id, kind), content in journal.pending():
+        try:
+            handler = loaders[kind](**dict(content, reschedule=True))
+            handler.action()
+        except (BadRequest, TypeError):
+            # Unknown job, malformed order or date already passed
+            journal.discard(name, instance_id, kind)
+        except Exception as e:
+            # Keep the order so it is replayed on the next restart
+            syslog.syslog(
+                    syslog.LOG_WARNING,
+                    'Cannot recover the {} order of instance {} with '
+                    'id {}: {}'.format(kind, name, instance_id, e))
+
 
 def read_listening_port(default=1112):
     try:
@@ -880,6 +1956,40 @@ def read_listening_port(default=1112):
         return default
 
 
+def read_rstats_port(default=1111):
+    try:
+        content = load_yaml(RSTATS_CONFIG_FILE)
+        return int(content['rstats']['port'])
+    except (KeyError, TypeError, ValueError, FileNotFoundError, yaml.YAMLError):
+        return default
+
+
+def read_resources_interval(default=5):
+    try:
+        content = load_yaml(RSTATS_CONFIG_FILE)
+        return float(content['openbach_agent']['resources_interval'])
+    except (KeyError, TypeError, ValueError, FileNotFoundError, yaml.YAMLError):
+        return default
+
+
+def read_agent_name(default='agent_name_not_found'):
+    for filename in (AGENT_NAME_FILE, HOSTNAME_FILE):
+        with suppress(OSError):
+            with open(filename) as f:
+                name = f.readline().strip()
+            if name:
+                return name
+    return default
+
+
+def read_rstats_socket(default=''):
+    try:
+        content = load_yaml(RSTATS_CONFIG_FILE)
+        return content['rstats']['socket'] or default
+    except (KeyError, TypeError, FileNotFoundError, yaml.YAMLError):
+        return default
+
+
 if __name__ == '__main__':
     syslog.openlog('openbach_agent', syslog.LOG_PID, syslog.LOG_USER)
     signal.signal(signal.SIGTERM, signal_term_handler)
@@ -887,8 +1997,17 @@ if __name__ == '__main__':
 
     populate_installed_jobs()
     recover_old_state()
+    # Let collect-agent, in jobs and in here, talk to rstats through its local socket
+    os.environ['RSTATS_SOCKET'] = read_rstats_socket()
     port = read_listening_port()
     address = ('', port)
 
+    resources_interval = read_resources_interval()
+    if resources_interval > 0:
+        JobManager().scheduler.add_job(
+                ResourcesMonitor().sample, 'interval',
+                seconds=resources_interval,
+                id='resources_monitor')
+
     with AgentServer(address, RequestHandler) as server:
         server.serve_forever()
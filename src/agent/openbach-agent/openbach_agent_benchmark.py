@@ -0,0 +1,153 @@
+#!/opt/openbach/virtualenv/bin/python3
+
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2023 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+
+"""Measure how many messages per second the agent can decode and serve.
+
+Without a host, only measure the decoding of a start_job_instance_agent
+message in each codec; with a host, also send requests to a running
+agent through a single connection.
+"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+import json
+import time
+import socket
+import struct
+import argparse
+
+import yaml
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+ENCODERS = {
+        'json': lambda message: json.dumps(message).encode(),
+        'yaml': lambda message: yaml.safe_dump(message).encode(),
+}
+DECODERS = {
+        'json': lambda payload: json.loads(payload.decode()),
+        'yaml': lambda payload: yaml.safe_load(payload.decode()),
+}
+if msgpack is not None:
+    ENCODERS['msgpack'] = lambda message: msgpack.packb(message, use_bin_type=True)
+    DECODERS['msgpack'] = lambda payload: msgpack.unpackb(payload, raw=False)
+
+
+def start_message(arguments_count):
+    return {
+            'command_name': 'start_job_instance_agent',
+            'command_arguments': {
+                'name': 'fping',
+                'instance_id': 42,
+                'scenario_id': 0,
+                'owner_id': 0,
+                'date': 'now',
+                'interval': None,
+                'arguments': ['argument_{}'.format(i) for i in range(arguments_count)],
+            },
+    }
+
+
+def measure(function, duration):
+    count = 0
+    start = time.perf_counter()
+    while True:
+        function()
+        count += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= duration:
+            return count / elapsed
+
+
+def decoding(arguments_count, duration):
+    message = start_message(arguments_count)
+    for codec, encode in ENCODERS.items():
+        payload = encode(message)
+        decode = DECODERS[codec]
+        rate = measure(lambda: decode(payload), duration)
+        print('Decoding {} bytes of {}: {:.0f} messages/s'.format(len(payload), codec, rate))
+
+
+def receive_all(sock, amount):
+    buffer = bytearray()
+    while len(buffer) < amount:
+        received = sock.recv(amount - len(buffer))
+        if not received:
+            raise ConnectionError('Connection closed by the agent')
+        buffer.extend(received)
+    return bytes(buffer)
+
+
+def serving(host, port, duration):
+    message = {'command_name': 'check_connection', 'command_arguments': {}}
+    for codec, encode in ENCODERS.items():
+        payload = encode(message)
+        frame = struct.pack('>I', len(payload)) + payload
+
+        with socket.create_connection((host, port)) as sock:
+            def communicate():
+                sock.sendall(frame)
+                length, = struct.unpack('>I', receive_all(sock, 4))
+                receive_all(sock, length)
+            rate = measure(communicate, duration)
+        print('Serving check_connection in {}: {:.0f} messages/s'.format(codec, rate))
+
+
+def main(host, port, arguments, duration):
+    decoding(arguments, duration)
+    if host is not None:
+        serving(host, port, duration)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+            '-H', '--host',
+            help='address of a running agent to send requests to')
+    parser.add_argument(
+            '-p', '--port', type=int, default=1112,
+            help='port of the agent')
+    parser.add_argument(
+            '-a', '--arguments', type=int, default=200,
+            help='amount of arguments in the decoded start message')
+    parser.add_argument(
+            '-d', '--duration', type=float, default=2,
+            help='duration of each measure, in seconds')
+
+    args = parser.parse_args()
+    main(**vars(args))
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2023 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+
+
+"""Unit tests of the Control-Agent. Run with `python3 -m unittest tests`"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+import json
+import time
+import struct
+import socket
+import tempfile
+import unittest
+import threading
+from pathlib import Path
+from unittest import mock
+
+import openbach_agent
+
+
+JOB_CONFIGURATION = {
+        'command': ['true'],
+        'command_stop': None,
+        'required': 0,
+        'optional': False,
+        'persistent': False,
+        'sudo': False,
+        'job_version': '1.0',
+}
+
+
+class AgentTestCase(unittest.TestCase):
+    """Run the Agent actions against a temporary instances
+    folder and a single installed job whose launches are
+    recorded instead of executed.
+    """
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.patched = {
+                'INSTANCES_FOLDER': Path(self.folder.name),
+                'popen': self._popen,
+                'publish_start_skew': lambda *args: None,
+        }
+        self.previous = {name: getattr(openbach_agent, name) for name in self.patched}
+        for name, value in self.patched.items():
+            setattr(openbach_agent, name, value)
+
+        self.launched = []
+        self.manager = openbach_agent.JobManager()
+        self.manager.jobs['test'] = dict(JOB_CONFIGURATION, instances={})
+
+    def tearDown(self):
+        self.manager.scheduler.remove_all_jobs()
+        self.manager.jobs.clear()
+        self.manager.dispatching.clear()
+        self.forget_journal()
+        for name, value in self.previous.items():
+            setattr(openbach_agent, name, value)
+        self.folder.cleanup()
+
+    def _popen(self, command, args, cgroup=None, **kwargs):
+        self.launched.append(command + args)
+        return self.previous['popen'](command, args, **kwargs)
+
+    def start(self, instance_id, delay, precise=True):
+        date = (time.time() + delay) * 1000
+        openbach_agent.StartJobInstanceAgent(
+                'test', instance_id, 0, 0, date, None, [],
+                precise=precise).action()
+
+    def forget_journal(self):
+        """Make the next StateJournal read the journal file again"""
+        journal = openbach_agent.StateJournal()
+        with journal._mutex:
+            if journal._sync_timer is not None:
+                journal._sync_timer.cancel()
+                journal._sync_timer = None
+            journal.stream.close()
+            journal.stream = None
+            journal.entries = None
+
+    def restart(self):
+        """Simulate a new Agent process using the same instances folder"""
+        self.manager.scheduler.remove_all_jobs()
+        self.manager.jobs['test']['instances'].clear()
+        self.forget_journal()
+        openbach_agent.recover_old_state()
+
+    def journal_orders(self):
+        return {key for key, _ in openbach_agent.StateJournal().pending()}
+
+
+class TestStartDispatcher(AgentTestCase):
+    def test_launch_at_date(self):
+        self.start(1, 0.2)
+        self.assertEqual(self.manager.get_instance_status('test', 1)['status'], 'Scheduled')
+        time.sleep(0.5)
+        self.assertEqual(self.launched, [['true']])
+
+    def test_stop_while_waiting(self):
+        self.start(1, 1)
+        openbach_agent.stop_job('test', 1)
+        time.sleep(1.3)
+        self.assertEqual(self.launched, [])
+
+    def test_stop_during_final_sleep(self):
+        # The dispatcher already took the instance out of its
+        # queue and is sleeping until its date when it is stopped
+        sleep = openbach_agent.PRECISE_START_SLEEP
+        openbach_agent.PRECISE_START_SLEEP = 2
+        try:
+            self.start(1, 1)
+            time.sleep(0.1)
+            openbach_agent.stop_job('test', 1)
+            time.sleep(1.2)
+        finally:
+            openbach_agent.PRECISE_START_SLEEP = sleep
+        self.assertEqual(self.launched, [])
+
+
+class TestRecovery(AgentTestCase):
+    def test_replay_pending_orders(self):
+        self.start(1, 5, precise=False)
+        openbach_agent.StopJobInstanceAgent('test', 1, (time.time() + 6) * 1000).action()
+        openbach_agent.StateJournal().record(
+                'start', name='missing', instance_id=2, scenario_id=0,
+                owner_id=0, date=(time.time() + 5) * 1000, interval=None,
+                arguments=[], precise=False)
+
+        self.restart()
+        self.assertEqual(self.journal_orders(), {('test', 1, 'start'), ('test', 1, 'stop')})
+        self.assertEqual(self.manager.get_instance_status('test', 1)['status'], 'Scheduled')
+        self.assertIsNotNone(self.manager.scheduler.get_job('test_1_stop'))
+
+    def test_past_orders_are_discarded(self):
+        self.start(1, 0.2, precise=False)
+        time.sleep(0.5)
+        self.restart()
+        self.assertEqual(self.journal_orders(), set())
+
+    def test_failed_replay_keeps_order(self):
+        self.start(1, 5, precise=False)
+        with mock.patch.object(openbach_agent.StartJobInstanceAgent, '_action', side_effect=OSError):
+            self.restart()
+        self.assertEqual(self.journal_orders(), {('test', 1, 'start')})
+
+        self.restart()
+        self.assertEqual(self.manager.get_instance_status('test', 1)['status'], 'Scheduled')
+
+    def test_restart_agent_reschedules_orders(self):
+        self.start(1, 5, precise=False)
+        openbach_agent.RestartAgent().action()
+        self.assertEqual(self.journal_orders(), {('test', 1, 'start')})
+        self.assertEqual(self.manager.get_instance_status('test', 1)['status'], 'Scheduled')
+
+
+class BlockedSubscriber:
+    def __init__(self):
+        self.unblocked = threading.Event()
+        self.events = []
+
+    def send_event(self, event, codec='json'):
+        self.unblocked.wait()
+        self.events.append(event['event'])
+
+
+class TestJobEvents(AgentTestCase):
+    def test_publish_does_not_wait_for_subscribers(self):
+        self.manager.add_instance('test', 1, [], None, None)
+        subscriber = BlockedSubscriber()
+        events = openbach_agent.JobEvents()
+        events.subscribe(subscriber)
+        try:
+            started = time.monotonic()
+            for event in ('started', 'finished'):
+                events.publish(event, 'test', 1)
+            self.assertLess(time.monotonic() - started, 0.5)
+            subscriber.unblocked.set()
+            time.sleep(0.1)
+        finally:
+            events.unsubscribe(subscriber)
+        self.assertEqual(subscriber.events, ['started', 'finished'])
+
+
+class TestRequestHandler(AgentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = openbach_agent.AgentServer(('127.0.0.1', 0), openbach_agent.RequestHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.connection = socket.create_connection(self.server.server_address)
+
+    def tearDown(self):
+        self.connection.close()
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+
+    def send(self, message):
+        payload = json.dumps(message).encode()
+        self.connection.sendall(struct.pack('>I', len(payload)) + payload)
+
+    def receive(self):
+        length, = struct.unpack('>I', self.connection.recv(4, socket.MSG_WAITALL))
+        return json.loads(self.connection.recv(length, socket.MSG_WAITALL).decode())
+
+    def test_tagged_requests_run_concurrently(self):
+        running = []
+        concurrency = []
+        lock = threading.Lock()
+
+        def check(self):
+            with lock:
+                running.append(self)
+                concurrency.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.remove(self)
+
+        count = 3 * openbach_agent.CONNECTION_WORKERS
+        with mock.patch.object(openbach_agent.CheckConnection, '_action', check):
+            for request_id in range(count):
+                self.send({
+                        'command_name': 'check_connection',
+                        'command_arguments': {},
+                        'request_id': request_id,
+                })
+            responses = [self.receive() for _ in range(count)]
+
+        self.assertEqual(sorted(response['request_id'] for response in responses), list(range(count)))
+        self.assertTrue(all(response['status'] == 'OK' for response in responses))
+        self.assertGreater(max(concurrency), 1)
+        self.assertLessEqual(max(concurrency), openbach_agent.CONNECTION_WORKERS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -42,7 +42,13 @@ __credits__ = '''Contributors:
 '''
 
 
+import gzip
+import queue
+import shutil
+import signal
+import asyncio
 import socket
+import struct
 import syslog
 import os.path
 import logging
@@ -51,9 +57,7 @@ import threading
 import traceback
 import contextlib
 import configparser
-import socketserver
-from itertools import groupby
-from time import strftime
+from time import strftime, monotonic
 from datetime import datetime
 from collections import namedtuple
 try:
@@ -62,11 +66,37 @@ except ImportError:
     import json
 
 import yaml
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 
 DEFAULT_LOG_PATH = '/var/openbach_stats/'
 RSTATS_CONFIG_FILE = '/opt/openbach/agent/rstats/rstats.yml'
 COLLECTOR_CONFIG_FILE = '/opt/openbach/agent/collector.yml'
+LOGSTASH_QUEUE_SIZE = 10000
+LOGSTASH_BATCH_SIZE = 100
+LOGSTASH_FLUSH_INTERVAL = 0.05
+LOGSTASH_DROP_REPORT = 1000
+# Keep trying to send queued statistics that long when closing
+LOGSTASH_CLOSE_TIMEOUT = 5
+MAX_DATAGRAM_SIZE = 60000
+RECONNECT_DELAY = 0.1
+MAX_RECONNECT_DELAY = 5
+DEFAULT_LOG_SEVERITY = syslog.LOG_WARNING
+ROUTING_CACHE_SIZE = 256
+LOCAL_STORAGE_MAX_SIZE = 64 * 1024 * 1024
+LOCAL_STORAGE_MAX_AGE = 24 * 60 * 60
+LOCAL_STORAGE_FLUSH_INTERVAL = 1
+LOCAL_STORAGE_INDEX_STEP = 64 * 1024
+# Entries of the index files: latest timestamp found before an offset
+LOCAL_STORAGE_INDEX = struct.Struct('>qQ')
+LOCAL_STORAGE_UNKNOWN_TIME = 2**63 - 1
 
 
 class BadRequest(ValueError):
@@ -76,31 +106,313 @@ class BadRequest(ValueError):
         self.reason = reason
 
 
-class AutoClosingFileHandler(logging.FileHandler):
-    def __init__(self, filename, encoding=None):
-        """
-        Delay appending to the specified file and use it as the stream for logging.
-        """
-        super().__init__(filename, 'a', encoding, True)
+class LocalStorage(namedtuple('LocalStorage', 'encoding compression max_size max_age flush_interval')):
+    """Describe how statistics are stored on the agent"""
+
+    EXTENSIONS = {'json': '.stats', 'msgpack': '.msgpack'}
+    COMPRESSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+
+    @property
+    def extension(self):
+        return self.EXTENSIONS[self.encoding]
+
+    def encode(self, statistics):
+        if self.encoding == 'msgpack':
+            return msgpack.packb(statistics, use_bin_type=True)
+        return json.dumps(statistics).encode() + b'\n'
+
+    def compress(self, filename):
+        """Compress a rotated file next to it, then remove it"""
+        if self.compression is None:
+            return
+
+        compressed = filename + self.COMPRESSIONS[self.compression]
+        partial = compressed + '.part'
+        try:
+            with open(filename, 'rb') as source:
+                if self.compression == 'zstd':
+                    with open(partial, 'wb') as destination:
+                        zstandard.ZstdCompressor().copy_stream(source, destination)
+                else:
+                    with gzip.open(partial, 'wb') as destination:
+                        shutil.copyfileobj(source, destination)
+            shutil.copystat(filename, partial)
+            os.rename(partial, compressed)
+            os.remove(filename)
+        except OSError as e:
+            syslog.syslog(syslog.LOG_WARNING, 'Could not compress {}: {}'.format(filename, e))
+            with contextlib.suppress(OSError):
+                os.remove(partial)
+
+
+class StatisticsFileHandler(logging.Handler):
+    """Store statistics of a job in local files.
+
+    Writes are buffered and only flushed every `flush_interval`
+    seconds; files are rotated once they grow bigger than
+    `max_size` bytes or older than `max_age` seconds and the
+    rotated ones are compressed in the background.
+
+    Each file comes with an index, every LOCAL_STORAGE_INDEX_STEP
+    bytes, of the latest statistic time stored before an offset
+    so readers can skip statistics older than a given date.
+    """
+
+    def __init__(self, directory, job_name, storage):
+        super().__init__()
+        self.directory = directory
+        self.job_name = job_name
+        self.storage = storage
+        self.baseFilename = self._build_filename()
+        self.stream = None
+        self.index = None
+        self.size = self.indexed_at = 0
+        self.latest = LOCAL_STORAGE_UNKNOWN_TIME
+        self.opened_at = self.flushed_at = monotonic()
+
+    def _build_filename(self):
+        filename = '{}_{}{}'.format(self.job_name, strftime('%Y-%m-%dT%H%M%S'), self.storage.extension)
+        return os.path.join(self.directory, filename)
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.stream = open(self.baseFilename, 'ab')
+        self.index = open(self.baseFilename + '.idx', 'ab')
+        self.size = self.indexed_at = self.stream.tell()
+        # Appending to an existing file: we know nothing of its content
+        self.latest = LOCAL_STORAGE_UNKNOWN_TIME if self.size else -LOCAL_STORAGE_UNKNOWN_TIME
+        self.opened_at = self.flushed_at = monotonic()
+
+    def _close(self):
+        self.stream.close()
+        self.index.close()
+        self.stream = self.index = None
+
+    def _update_index(self, statistics):
+        if self.size - self.indexed_at >= LOCAL_STORAGE_INDEX_STEP:
+            self.index.write(LOCAL_STORAGE_INDEX.pack(self.latest, self.size))
+            self.indexed_at = self.size
+
+        with contextlib.suppress(KeyError, TypeError, ValueError):
+            self.latest = max(self.latest, int(statistics['_metadata']['time']))
+
+    def _should_rotate(self, now):
+        max_size = self.storage.max_size
+        max_age = self.storage.max_age
+        return (max_size and self.size >= max_size) or (max_age and now - self.opened_at >= max_age)
+
+    def _rotate(self):
+        filename = self._build_filename()
+        if filename == self.baseFilename:
+            # Do not rotate more than once per second
+            return
+
+        self._close()
+        threading.Thread(
+                target=self.storage.compress,
+                args=(self.baseFilename,),
+                daemon=True).start()
+        self.baseFilename = filename
+        self._open()
 
     def emit(self, record):
-        """
-        Emit a record.
+        try:
+            data = self.storage.encode(record.msg)
+            now = monotonic()
+            if self.stream is None:
+                self._open()
+            elif self._should_rotate(now):
+                self._rotate()
+            self._update_index(record.msg)
+            self.stream.write(data)
+            self.size += len(data)
+            if now - self.flushed_at >= self.storage.flush_interval:
+                self.stream.flush()
+                self.index.flush()
+                self.flushed_at = now
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        with self.lock:
+            if self.stream is not None:
+                self.stream.flush()
+                self.index.flush()
+
+    def close(self):
+        with self.lock:
+            if self.stream is not None:
+                self._close()
+            super().close()
+
+
+class StatisticsSender:
+    """Long-lived connection to the logstash server of the collector.
+
+    Statistics are pushed into a bounded queue and written by a
+    background thread so callers never block on network I/O. When
+    using TCP, a single connection is kept open and re-established
+    with an exponential backoff whenever it fails.
+
+    The background thread groups statistics into batches that are
+    flushed either when `batch_size` records are waiting or when the
+    oldest one has been waiting for `flush_interval` seconds. Each
+    batch is written as a single newline-separated payload. Records
+    that do not fit in the queue are dropped and counted. Closing the
+    sender sends the records still queued, giving up on them after
+    LOGSTASH_CLOSE_TIMEOUT seconds if the collector is unreachable.
+    """
 
-        Uses the delay mechanic of the parent class to open the
-        proper stream before emitting.
+    def __init__(self, address, mode,
+                 batch_size=LOGSTASH_BATCH_SIZE,
+                 flush_interval=LOGSTASH_FLUSH_INTERVAL,
+                 queue_size=LOGSTASH_QUEUE_SIZE):
+        try:
+            self._kind = {
+                    'tcp': socket.SOCK_STREAM,
+                    'udp': socket.SOCK_DGRAM,
+            }[mode]
+        except KeyError:
+            raise BadRequest('Mode not known')
+
+        self._address = address
+        self._batch_size = max(1, int(batch_size))
+        self._flush_interval = max(0, float(flush_interval))
+        self._socket = None
+        self._queue = queue.Queue(max(1, int(queue_size)))
+        self._closed = threading.Event()
+        self._deadline = None
+        self._mutex = threading.Lock()
+        self.dropped = 0
+        self._writer = threading.Thread(target=self._drain, daemon=True)
+        self._writer.start()
 
-        Closes the stream right after.
+    def __call__(self, data):
+        try:
+            self._queue.put_nowait(data)
+        except queue.Full:
+            with self._mutex:
+                self.dropped += 1
+                dropped = self.dropped
+            if dropped % LOGSTASH_DROP_REPORT == 1:
+                syslog.syslog(
+                        syslog.LOG_WARNING,
+                        'Statistics queue toward {} is full, {} statistics '
+                        'dropped so far'.format(self._address, dropped))
+
+    def close(self):
+        self._deadline = monotonic() + LOGSTASH_CLOSE_TIMEOUT
+        with contextlib.suppress(queue.Full):
+            # The writer empties the queue unless it is stuck on an
+            # unreachable collector, in which case it gives up anyway
+            self._queue.put(None, timeout=LOGSTASH_CLOSE_TIMEOUT)
+        self._writer.join(timeout=max(0, self._deadline - monotonic()) + 1)
+        self._closed.set()
+        self._disconnect()
+
+    def _drain(self):
+        running = True
+        while running:
+            running, batch = self._next_batch()
+            for payload in self._payloads(batch):
+                self._send(payload)
+        self._closed.set()
+
+    def _next_batch(self):
+        """Wait for the next batch of statistics to send. Also
+        return whether or not the sender is still running.
         """
-        super().emit(record)
-        stream = self.setStream(None)
-        if stream and hasattr(stream, 'close'):
-            stream.close()
+        data = self._queue.get()
+        if data is None:
+            return False, []
+
+        batch = [data]
+        deadline = monotonic() + self._flush_interval
+        while len(batch) < self._batch_size:
+            timeout = deadline - monotonic()
+            try:
+                if timeout > 0:
+                    data = self._queue.get(timeout=timeout)
+                else:
+                    data = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if data is None:
+                # Closing: the batch gathered so far is still sent
+                return False, batch
+            batch.append(data)
+
+        return True, batch
+
+    def _payloads(self, batch):
+        if self._kind == socket.SOCK_STREAM:
+            if batch:
+                yield ''.join(data + '\n' for data in batch).encode()
+            return
+
+        # Datagrams can't be arbitrarily large, split them as needed
+        payload = bytearray()
+        for data in batch:
+            data = data.encode()
+            if payload and len(payload) + len(data) >= MAX_DATAGRAM_SIZE:
+                yield bytes(payload)
+                payload.clear()
+            if payload:
+                payload += b'\n'
+            payload += data
+        if payload:
+            yield bytes(payload)
+
+    def _send(self, data):
+        delay = RECONNECT_DELAY
+        while not self._closed.is_set():
+            deadline = self._deadline
+            try:
+                if self._socket is None:
+                    self._connect()
+                if self._kind == socket.SOCK_STREAM:
+                    self._socket.sendall(data)
+                else:
+                    self._socket.sendto(data, self._address)
+            except OSError as err:
+                syslog.syslog(
+                        syslog.LOG_ERR,
+                        'Failed to send statistics to {}: {}'
+                        .format(self._address, err))
+                self._disconnect()
+                if deadline is not None:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        syslog.syslog(
+                                syslog.LOG_ERR,
+                                'Closing the connection to {}, statistics '
+                                'not sent are lost'.format(self._address))
+                        return
+                    delay = min(delay, remaining)
+                self._closed.wait(delay)
+                delay = min(2 * delay, MAX_RECONNECT_DELAY)
+            else:
+                return
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_INET, self._kind)
+        if self._kind == socket.SOCK_STREAM:
+            try:
+                sock.connect(self._address)
+            except OSError:
+                sock.close()
+                raise
+        self._socket = sock
+
+    def _disconnect(self):
+        sock, self._socket = self._socket, None
+        if sock is not None:
+            sock.close()
 
 
 @functools.lru_cache(maxsize=1)
 def get_statistics_sender():
-    """Build the function that will route data to the logstash
+    """Build the object that will route data to the logstash
     server based on the provided configuration files.
     """
 
@@ -110,45 +422,68 @@ def get_statistics_sender():
     port = content['stats']['port']
     address = (host, int(port))
 
-    # Build functions to send stats to the configured address
-
-    @contextlib.contextmanager
-    def socket_error_to_bad_request(message):
-        """Helper context manager aimed at reducing boilerplate code"""
-        try:
-            yield
-        except socket.error as err:
-            raise BadRequest(message.format(*err))
+    with open(RSTATS_CONFIG_FILE, encoding='utf-8') as stream:
+        content = yaml.safe_load(stream)
 
-    def send_udp(data):
-        with socket_error_to_bad_request('Failed to create socket'):
-            logstash = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        logstash = content['logstash']
+        mode = logstash['mode']
+    except KeyError:
+        raise BadRequest('Mode not known')
 
-        with logstash:
-            with socket_error_to_bad_request('Error code: {}, Message {}'):
-                logstash.sendto(data.encode(), address)
+    try:
+        return StatisticsSender(
+                address, mode,
+                logstash.get('batch_size', LOGSTASH_BATCH_SIZE),
+                logstash.get('flush_interval', LOGSTASH_FLUSH_INTERVAL),
+                logstash.get('queue_size', LOGSTASH_QUEUE_SIZE))
+    except (TypeError, ValueError):
+        raise BadRequest('Malformed logstash configuration')
+
+
+def close_statistics_sender():
+    """Send the statistics still queued toward the collector
+    and close the connection, if any, to the logstash server.
+    """
+    if get_statistics_sender.cache_info().currsize:
+        get_statistics_sender().close()
+    get_statistics_sender.cache_clear()
 
-    def send_tcp(data):
-        with socket_error_to_bad_request('Failed to create socket'):
-            logstash = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
-        with logstash:
-            with socket_error_to_bad_request('Failed to connect to server'):
-                logstash.connect(address)
-            with socket_error_to_bad_request('Error code: {}, Message {}'):
-                logstash.send(data.encode())
+@functools.lru_cache(maxsize=1)
+def get_local_storage():
+    """Build the description of the statistics storage on
+    the agent based on the provided configuration file.
+    """
 
-    with open(RSTATS_CONFIG_FILE, encoding='utf-8') as stream:
-        content = yaml.safe_load(stream)
+    try:
+        with open(RSTATS_CONFIG_FILE, encoding='utf-8') as stream:
+            content = yaml.safe_load(stream)['local_storage']
+    except (KeyError, TypeError, OSError, yaml.YAMLError):
+        content = {}
+
+    encoding = content.get('encoding', 'json')
+    if encoding not in LocalStorage.EXTENSIONS:
+        raise BadRequest('Unknown local storage encoding: {}'.format(encoding))
+    if encoding == 'msgpack' and msgpack is None:
+        syslog.syslog(syslog.LOG_WARNING, 'msgpack is not installed, storing statistics as JSON')
+        encoding = 'json'
+
+    compression = content.get('compression') or None
+    if compression is not None and compression not in LocalStorage.COMPRESSIONS:
+        raise BadRequest('Unknown local storage compression: {}'.format(compression))
+    if compression == 'zstd' and zstandard is None:
+        syslog.syslog(syslog.LOG_WARNING, 'zstandard is not installed, compressing statistics using gzip')
+        compression = 'gzip'
 
-    # Select the right function to use based on the configured mode
     try:
-        return {
-            'tcp': send_tcp,
-            'udp': send_udp,
-        }[content['logstash']['mode']]
-    except KeyError:
-        raise BadRequest('Mode not known')
+        return LocalStorage(
+                encoding, compression,
+                int(content.get('max_size', LOCAL_STORAGE_MAX_SIZE)),
+                float(content.get('max_age', LOCAL_STORAGE_MAX_AGE)),
+                float(content.get('flush_interval', LOCAL_STORAGE_FLUSH_INTERVAL)))
+    except (TypeError, ValueError):
+        raise BadRequest('Malformed local storage configuration')
 
 
 class Rstats:
@@ -157,6 +492,9 @@ class Rstats:
                  scenario_instance_id=0, owner_scenario_instance_id=0,
                  agent_name='agent_name_not_found', reset_handlers=False):
         self._mutex = threading.Lock()
+        self._routes = {}
+        self._routing_cache = {}
+        self.errors = 0
 
         self.metadata = {
                 'job_name': 'rstats' if job_name is None else job_name,
@@ -174,7 +512,7 @@ class Rstats:
         # Reset the handlers if they store logs for another job
         if not reset_handlers:
             for handler in self._logger.handlers:
-                if not isinstance(handler, logging.FileHandler):
+                if not isinstance(handler, StatisticsFileHandler):
                     continue
                 handler_job = os.path.basename(os.path.dirname(handler.baseFilename))
                 if handler_job != job_name:
@@ -196,6 +534,7 @@ class Rstats:
             try:
                 config.read(self._confpath)
             except configparser.Error:
+                self._compile_rules()
                 return
 
             self._rules.update(
@@ -208,72 +547,115 @@ class Rstats:
                     for name, section in config.items()
                     if section.values()
             )
+            self._compile_rules()
 
         if reset_handlers:
-            for handler in self._logger.handlers:
-                self._logger.removeHandler(handler)
+            self._remove_handlers()
 
         if store_local and any(rule.local for rule in self._rules.values()):
             if not self._logger.hasHandlers():
                 self._logger.setLevel(logging.INFO)
-                filename = '{}_{}.stats'.format(self.metadata['job_name'], strftime("%Y-%m-%dT%H%M%S"))
-                logfile = os.path.join(logpath, self.metadata['job_name'], filename)
-                try:
-                    fhd = AutoClosingFileHandler(logfile)
-                except OSError:
-                    pass
-                else:
-                    fhd.setFormatter(logging.Formatter('{message}', style='{'))
-                    self._logger.addHandler(fhd)
+                job_name = self.metadata['job_name']
+                self._logger.addHandler(StatisticsFileHandler(
+                    os.path.join(logpath, job_name),
+                    job_name, get_local_storage()))
         else:
-            for handler in self._logger.handlers:
-                self._logger.removeHandler(handler)
+            self._remove_handlers()
+
+    def _remove_handlers(self):
+        for handler in list(self._logger.handlers):
+            self._logger.removeHandler(handler)
+            handler.close()
 
-    def send_stat(self, suffix, time, stats, files):
+    def flush(self):
+        """Write statistics buffered for local storage to disk"""
+        for handler in self._logger.handlers:
+            handler.flush()
+
+    def send_stat(self, suffix, time, stats, files, metadatas=None):
         with self._mutex:
-            statistics_metadata = {'time': time, 'is_file': files, **self.metadata}
-            if suffix is not None:
-                statistics_metadata['suffix'] = suffix
-
-            statistics_by_flag = sorted((
-                {statistic_name: value}
-                for statistic_name, value in stats.items()
-            ), key=self._get_flag)
-
-            for flag, statistics_group in groupby(statistics_by_flag, self._get_flag):
-                statistics_metadata['flag'] = flag
-                statistics = {
-                        name: value
-                        for statistic in statistics_group
-                        for name, value in statistic.items()
-                }
-                if flag:
-                    statistics['_metadata'] = statistics_metadata
-                    get_statistics_sender()(json.dumps(statistics))
-
-                # Filter out stats specifically specified local = False or
-                # include only those specified local = True, if default is False
-                use_local = self._rules['default'].local
-                statistics = {
-                        name: value
-                        for name, value in statistics.items()
-                        if (
-                            name not in self._rules or self._rules[name].local
-                            if use_local else
-                            name in self._rules and self._rules[name].local
-                        )
-                }
+            self._send_stat(suffix, time, stats, files, metadatas)
+
+    def send_stats(self, records, files):
+        """Route several statistics at once. Records are tuples
+        of (suffix, time, stats, metadatas) values.
+        """
+        with self._mutex:
+            for suffix, time, stats, metadatas in records:
+                self._send_stat(suffix, time, stats, files, metadatas)
+
+    def _send_stat(self, suffix, time, stats, files, metadatas):
+        statistics_metadata = {'time': time, 'is_file': files, **self.metadata}
+        if metadatas:
+            statistics_metadata.update(metadatas)
+        if suffix is not None:
+            statistics_metadata['suffix'] = suffix
+
+        for flag, names, local_names in self._routing_plan(tuple(stats)):
+            statistics_metadata['flag'] = flag
+            if flag:
+                statistics = {name: stats[name] for name in names}
                 statistics['_metadata'] = statistics_metadata
-                if len(statistics) > 1:
-                    self._logger.info(json.dumps(statistics))
+                get_statistics_sender()(json.dumps(statistics))
 
+            if local_names:
+                statistics = {name: stats[name] for name in local_names}
+                statistics['_metadata'] = statistics_metadata
+                self._logger.info(statistics)
 
-    def _get_flag(self, statistic_holder):
-        statistic_name, = statistic_holder
-        if statistic_name in self._rules:
-            return self._rules[statistic_name].flag
-        else:
-            return self._rules['default'].flag
+    def report_error(self):
+        """Account for a request that failed without the
+        client waiting for an answer.
+        """
+        with self._mutex:
+            self.errors += 1
+
+    def set_default_rule(self, rule):
+        with self._mutex:
+            self._rules['default'] = rule
+            self._compile_rules()
+
+    def _compile_rules(self):
+        """Turn the rules into a lookup table of (flag, local)
+        values for each statistic name. Must be called with the
+        mutex held.
+        """
+        self._routes = {
+                name: (rule.flag, bool(rule.local))
+                for name, rule in self._rules.items()
+        }
+        self._routing_cache.clear()
+
+    def _routing_plan(self, names):
+        """Split the statistic names into groups of the same
+        flag, in increasing flag order, along with the names
+        that should be stored locally in each group.
+
+        Jobs tend to send the same statistics over and over,
+        so plans are cached for each set of names.
+        """
+        try:
+            return self._routing_cache[names]
+        except KeyError:
+            pass
+
+        default = self._routes['default']
+        groups = {}
+        for name in names:
+            flag, local = self._routes.get(name, default)
+            flag_names, local_names = groups.setdefault(flag, ([], []))
+            flag_names.append(name)
+            if local:
+                local_names.append(name)
+
+        plan = tuple(
+                (flag, tuple(flag_names), tuple(local_names))
+                for flag, (flag_names, local_names) in sorted(groups.items())
+        )
+        if len(self._routing_cache) >= ROUTING_CACHE_SIZE:
+            self._routing_cache.clear()
+        self._routing_cache[names] = plan
+        return plan
 
 
 class RstatsRule(namedtuple('RstatsRule', 'name local storage broadcast')):
@@ -316,8 +698,12 @@ class StatsManager:
     def __exit__(self, exc_type, exc_value, exc_traceback):
         self.mutex.release()
 
-    def statistic_lookup(self, instance_id, scenario_id):
+    def statistic_lookup(self, instance_id, scenario_id, owner=None):
         key = (instance_id, scenario_id)
+        if owner:
+            # Connections opened on behalf of a job instance by
+            # someone else do not interfere with the job's own one
+            key += (owner,)
         with self.mutex:
             try:
                 return self.cache[key]
@@ -370,7 +756,7 @@ def _handle_parse_errors(name, expected_type):
 
 
 def create_stat(confpath, job_name, job_instance_id, scenario_instance_id,
-                owner_scenario_instance_id, agent_name, override=False):
+                owner_scenario_instance_id, agent_name, override=False, owner=None):
     # Type conversion
     with _handle_parse_errors('job_instance_id', 'integer'):
         job_instance_id = int(job_instance_id)
@@ -382,7 +768,7 @@ def create_stat(confpath, job_name, job_instance_id, scenario_instance_id,
         override = bool(int(override))
 
     with StatsManager() as manager:
-        statistic_id = manager.statistic_lookup(job_instance_id, scenario_instance_id)
+        statistic_id = manager.statistic_lookup(job_instance_id, scenario_instance_id, owner)
 
         if override or statistic_id not in manager:
             manager[statistic_id] = Rstats(
@@ -398,10 +784,7 @@ def create_stat(confpath, job_name, job_instance_id, scenario_instance_id,
     return statistic_id
 
 
-def send_stat(connection_id, timestamp, statistics, suffix=None, metadatas=None, stored_files=False):
-    # Type conversion
-    with _handle_parse_errors('connection_id', 'integer'):
-        connection_id = int(connection_id)
+def _parse_timestamp(timestamp):
     with _handle_parse_errors('timestamp', 'integer'):
         timestamp = int(timestamp)
     with _handle_parse_errors('timestamp', 'timestamp in milliseconds'):
@@ -409,14 +792,42 @@ def send_stat(connection_id, timestamp, statistics, suffix=None, metadatas=None,
         if date.year == 1970:
             # Most likely a timestamp in seconds, not milliseconds
             raise ValueError
+    return timestamp
+
+
+def send_stat(connection_id, timestamp, statistics, suffix=None, metadatas=None, stored_files=False):
+    # Type conversion
+    with _handle_parse_errors('connection_id', 'integer'):
+        connection_id = int(connection_id)
+    timestamp = _parse_timestamp(timestamp)
+
+    client_connection = StatsManager()[connection_id]
+    client_connection.send_stat(suffix, timestamp, statistics, stored_files, metadatas)
+
+
+def send_stats(connection_id, statistics, stored_files=False):
+    # Type conversion
+    with _handle_parse_errors('connection_id', 'integer'):
+        connection_id = int(connection_id)
+
+    records = []
+    for record in statistics:
+        try:
+            timestamp = record['timestamp']
+            stats = record['statistics']
+        except (KeyError, TypeError) as e:
+            raise BadRequest('Statistics record is missing parameters \'{}\''.format(e))
+        records.append((
+            record.get('suffix'),
+            _parse_timestamp(timestamp),
+            stats,
+            record.get('metadatas'),
+        ))
 
     client_connection = StatsManager()[connection_id]
-    if metadatas:
-        backup = {**client_connection.metadata}
-        client_connection.metadata.update(metadatas)
-    client_connection.send_stat(suffix, timestamp, statistics, stored_files)
-    if metadatas:
-        client_connection.metadata = backup
+    client_connection.send_stats(records, stored_files)
+    return len(records)
+
 
 def reload_stat(connection_id):
     # Type conversion
@@ -425,6 +836,7 @@ def reload_stat(connection_id):
 
     client_connection = StatsManager()[connection_id]
     client_connection.reload_conf()
+    return client_connection.errors
 
 
 def remove_stat(connection_id):
@@ -432,7 +844,9 @@ def remove_stat(connection_id):
     with _handle_parse_errors('connection_id', 'integer'):
         connection_id = int(connection_id)
 
-    del StatsManager()[connection_id]
+    with StatsManager() as manager:
+        manager[connection_id].flush()
+        del manager[connection_id]
 
 
 def reload_stats():
@@ -455,20 +869,23 @@ def change_config(scenario_instance_id, job_instance_id, enable_broadcast, enabl
         id = manager.statistic_lookup(job_instance_id, scenario_instance_id)
         client_connection = manager[id]
         default_rule = RstatsRule('default', RstatsRule.ACCEPT, enable_storage, enable_broadcast)
-        client_connection._rules['default'] = default_rule
+        client_connection.set_default_rule(default_rule)
 
 
 def restart():
     with StatsManager() as manager:
+        for _, client_connection in manager:
+            client_connection.flush()
         manager.reset()
-        get_statistics_sender.cache_clear()
+        close_statistics_sender()
+        get_local_storage.cache_clear()
 
 
 #####################
 # Requests handling #
 #####################
 
-class RstatsRequestHandler(socketserver.BaseRequestHandler):
+class RstatsRequest:
     AVAILABLE_FUNCTIONS = [
             create_stat,
             send_stat,
@@ -477,29 +894,51 @@ class RstatsRequestHandler(socketserver.BaseRequestHandler):
             reload_stats,
             change_config,
             restart,
+            send_stats,
     ]
 
-    def handle(self):
-        data, sock = self.request
+    def __init__(self, log_severity=DEFAULT_LOG_SEVERITY):
+        self.log_severity = log_severity
+        self.acknowledge = True
+        self.connection_id = None
+
+    def log(self, priority, message):
+        """Send a message to syslog, only building it if the
+        configured severity requires it.
+        """
+        if priority <= self.log_severity:
+            syslog.syslog(priority, message() if callable(message) else message)
+
+    def handle(self, data):
         msg = 'KO: Unhandled exception occured'
         try:
             data = data.decode()
-            syslog.syslog(syslog.LOG_INFO, data)
+            self.log(syslog.LOG_INFO, data)
             result = self.execute_request(data)
         except BadRequest as e:
-            syslog.syslog(syslog.LOG_ERR, traceback.format_exc())
+            self.log(syslog.LOG_ERR, traceback.format_exc)
             msg = 'KO: {}'.format(e.reason)
+            self.report_error()
         except Exception as e:
-            syslog.syslog(syslog.LOG_CRIT, traceback.format_exc())
+            self.log(syslog.LOG_CRIT, traceback.format_exc)
             msg = 'KO: An error occured: {}'.format(e)
+            self.report_error()
         else:
             if result is None:
                 msg = 'OK'
             else:
                 msg = 'OK {}'.format(result)
-        finally:
-            syslog.syslog(syslog.LOG_INFO, msg)
-            sock.sendto(msg.encode() + b'\0', self.client_address)
+
+        self.log(syslog.LOG_INFO, msg)
+        return msg
+
+    def report_error(self):
+        """Keep track of errors for clients that don't wait for a response"""
+        if self.acknowledge:
+            return
+
+        with contextlib.suppress(BadRequest, TypeError, ValueError):
+            StatsManager()[int(self.connection_id)].report_error()
 
     def execute_request(self, data):
         try:
@@ -507,12 +946,20 @@ class RstatsRequestHandler(socketserver.BaseRequestHandler):
         except json.JSONDecodeError:
             raise BadRequest('Request is not a valid JSON string')
 
+        try:
+            self.acknowledge = bool(command.get('acknowledge', True))
+        except AttributeError:
+            raise BadRequest('Request is not a JSON object')
+
         try:
             request = command['command_id']
             args = command['command_parameters']
         except KeyError as e:
             raise BadRequest('Request is missing parameters \'{}\''.format(e))
 
+        with contextlib.suppress(AttributeError):
+            self.connection_id = args.get('connection_id')
+
         try:
             # Compensate for collect_agent using 1-based indexing
             function = self.AVAILABLE_FUNCTIONS[request - 1]
@@ -525,15 +972,126 @@ class RstatsRequestHandler(socketserver.BaseRequestHandler):
             raise BadRequest('Arguments mismatch: {}'.format(e))
 
 
-class RstatsServer(socketserver.ThreadingMixIn, socketserver.UDPServer):
-    allow_reuse_address = True
-    max_packet_size = 2**14
+class RstatsProtocol(asyncio.DatagramProtocol):
+    """Handle requests coming from the jobs one after the
+    other in the event loop instead of spawning a thread
+    for each of them.
+    """
 
+    def __init__(self, log_severity=DEFAULT_LOG_SEVERITY):
+        self.log_severity = log_severity
+        self.transport = None
 
-if __name__ == '__main__':
-    syslog.openlog('openbach_rstats', syslog.LOG_PID, syslog.LOG_USER)
-    server = RstatsServer(('', 1111), RstatsRequestHandler)
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        request = RstatsRequest(self.log_severity)
+        msg = request.handle(data)
+        if request.acknowledge:
+            self.transport.sendto(msg.encode() + b'\0', address)
+
+    def error_received(self, exc):
+        syslog.syslog(syslog.LOG_WARNING, 'Error on rstats socket: {}'.format(exc))
+
+
+class RstatsStreamProtocol(asyncio.Protocol):
+    """Handle requests coming from the jobs through the local
+    unix socket. Each message is prefixed by its length so they
+    are not limited to the size of a datagram.
+    """
+
+    HEADER = struct.Struct('>I')
+
+    def __init__(self, log_severity=DEFAULT_LOG_SEVERITY):
+        self.log_severity = log_severity
+        self.transport = None
+        self.buffer = bytearray()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.buffer.extend(data)
+        header_size = self.HEADER.size
+        while len(self.buffer) >= header_size:
+            length, = self.HEADER.unpack_from(self.buffer)
+            end = header_size + length
+            if len(self.buffer) < end:
+                break
+
+            message = bytes(self.buffer[header_size:end])
+            del self.buffer[:end]
+
+            request = RstatsRequest(self.log_severity)
+            msg = request.handle(message).encode()
+            if request.acknowledge:
+                self.transport.write(self.HEADER.pack(len(msg)) + msg)
+
+
+def read_rstats_configuration(port=1111, log_severity=DEFAULT_LOG_SEVERITY, unix_socket=None):
     try:
-        server.serve_forever()
+        with open(RSTATS_CONFIG_FILE, encoding='utf-8') as stream:
+            content = yaml.safe_load(stream)['rstats']
+    except (KeyError, TypeError, OSError, yaml.YAMLError):
+        return port, log_severity, unix_socket
+
+    with contextlib.suppress(KeyError, TypeError, ValueError):
+        port = int(content['port'])
+    with contextlib.suppress(KeyError, TypeError, ValueError):
+        log_severity = int(content['log_severity'])
+    with contextlib.suppress(KeyError, TypeError):
+        unix_socket = content['socket'] or None
+    return port, log_severity, unix_socket
+
+
+async def flush_local_storage(interval=LOCAL_STORAGE_FLUSH_INTERVAL):
+    """Periodically write buffered statistics of idle jobs to disk"""
+    while True:
+        await asyncio.sleep(interval)
+        for _, client_connection in StatsManager():
+            client_connection.flush()
+
+
+async def serve(address, log_severity=DEFAULT_LOG_SEVERITY, unix_socket=None):
+    loop = asyncio.get_running_loop()
+    stop = loop.create_future()
+    loop.add_signal_handler(signal.SIGTERM, stop.set_result, None)
+
+    transport, _ = await loop.create_datagram_endpoint(
+            functools.partial(RstatsProtocol, log_severity),
+            local_addr=address)
+
+    server = None
+    if unix_socket is not None:
+        os.makedirs(os.path.dirname(unix_socket), exist_ok=True)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(unix_socket)
+        server = await loop.create_unix_server(
+                functools.partial(RstatsStreamProtocol, log_severity),
+                unix_socket)
+        # Jobs may run as any user, as they can with the UDP socket
+        os.chmod(unix_socket, 0o666)
+
+    flusher = loop.create_task(flush_local_storage())
+    try:
+        await stop
     finally:
-        server.server_close()
+        flusher.cancel()
+        transport.close()
+        if server is not None:
+            server.close()
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(unix_socket)
+        with StatsManager() as manager:
+            for _, client_connection in manager:
+                client_connection.flush()
+        close_statistics_sender()
+        logging.shutdown()
+
+
+if __name__ == '__main__':
+    syslog.openlog('openbach_rstats', syslog.LOG_PID, syslog.LOG_USER)
+    port, log_severity, unix_socket = read_rstats_configuration()
+    syslog.setlogmask(syslog.LOG_UPTO(log_severity))
+    asyncio.run(serve(('0.0.0.0', port), log_severity, unix_socket))
@@ -0,0 +1,125 @@
+#!/opt/openbach/virtualenv/bin/python3
+
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2023 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+
+"""Measure the amount of statistics per second a running rstats can handle"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+import json
+import time
+import socket
+import argparse
+
+
+RETRIES = 5
+
+
+def communicate(sock, address, command_id, acknowledge=True, **parameters):
+    message = {
+            'command_id': command_id,
+            'command_parameters': parameters,
+    }
+    if not acknowledge:
+        message['acknowledge'] = False
+    sock.sendto(json.dumps(message).encode(), address)
+    if acknowledge:
+        response = sock.recv(2048).rstrip(b'\0').decode()
+        if not response.startswith('OK'):
+            raise RuntimeError(response)
+        return response[3:]
+
+
+def main(host, port, count, fields, asynchronous, timeout):
+    address = (host, port)
+    statistics = {'statistic_{}'.format(i): i for i in range(fields)}
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        connection_id = int(communicate(
+            sock, address, 1, confpath='', job_name='rstats_benchmark',
+            job_instance_id=0, scenario_instance_id=0,
+            owner_scenario_instance_id=0, agent_name='benchmark',
+            override=True))
+
+        errors = int(communicate(sock, address, 3, connection_id=connection_id) or 0)
+        start = time.perf_counter()
+        for _ in range(count):
+            communicate(
+                    sock, address, 2, not asynchronous,
+                    connection_id=connection_id,
+                    timestamp=int(time.time() * 1000),
+                    statistics=statistics)
+        # Fire-and-forget messages are only accounted for once rstats
+        # answers a request sent after all of them
+        for _ in range(RETRIES):
+            try:
+                response = communicate(sock, address, 3, connection_id=connection_id)
+            except socket.timeout:
+                continue
+            else:
+                errors = int(response or 0) - errors
+                break
+        else:
+            raise RuntimeError('rstats did not answer after the last statistic')
+        elapsed = time.perf_counter() - start
+        communicate(sock, address, 4, connection_id=connection_id)
+
+    print('Sent {} statistics of {} fields in {:.3f}s: {:.0f} stats/s ({} errors)'.format(
+        count, fields, elapsed, count / elapsed, errors))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+            '-H', '--host', default='127.0.0.1',
+            help='address of the rstats service')
+    parser.add_argument(
+            '-p', '--port', type=int, default=1111,
+            help='port of the rstats service')
+    parser.add_argument(
+            '-n', '--count', type=int, default=10000,
+            help='amount of statistics to send')
+    parser.add_argument(
+            '-f', '--fields', type=int, default=8,
+            help='amount of fields in each statistic')
+    parser.add_argument(
+            '-a', '--asynchronous', action='store_true',
+            help='do not wait for rstats to acknowledge each statistic')
+    parser.add_argument(
+            '-t', '--timeout', type=float, default=30,
+            help='time to wait for an answer from rstats')
+
+    args = parser.parse_args()
+    main(**vars(args))
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2023 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+
+"""Unit tests of the statistics relay. Run with `python3 -m unittest tests`"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+import time
+import socket
+import tempfile
+import unittest
+import threading
+from pathlib import Path
+
+import rstats
+
+
+class TcpSink:
+    """Collect every line received on a local TCP port"""
+
+    def __init__(self):
+        self.server = socket.create_server(('127.0.0.1', 0))
+        self.address = self.server.getsockname()
+        self.data = bytearray()
+        self.thread = threading.Thread(target=self._receive, daemon=True)
+        self.thread.start()
+
+    def _receive(self):
+        while True:
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                return
+            with connection:
+                while True:
+                    data = connection.recv(65536)
+                    if not data:
+                        break
+                    self.data.extend(data)
+
+    def wait_for_lines(self, expected, timeout=2):
+        deadline = time.monotonic() + timeout
+        while self.data.count(b'\n') < expected and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.data.count(b'\n')
+
+    def close(self):
+        self.server.close()
+
+
+class TestStatisticsSender(unittest.TestCase):
+    def setUp(self):
+        self.sink = TcpSink()
+
+    def tearDown(self):
+        self.sink.close()
+
+    def test_close_sends_queued_statistics(self):
+        sender = rstats.StatisticsSender(
+                self.sink.address, 'tcp',
+                batch_size=7, flush_interval=60)
+        for i in range(1000):
+            sender('{{"value": {}}}'.format(i))
+        sender.close()
+        self.assertEqual(self.sink.wait_for_lines(1000), 1000)
+
+    def test_close_gives_up_on_unreachable_collector(self):
+        closed_port = socket.create_server(('127.0.0.1', 0))
+        address = closed_port.getsockname()
+        closed_port.close()
+
+        timeout = rstats.LOGSTASH_CLOSE_TIMEOUT
+        rstats.LOGSTASH_CLOSE_TIMEOUT = 0.5
+        try:
+            sender = rstats.StatisticsSender(address, 'tcp')
+            sender('{}')
+            sender.close()
+            self.assertFalse(sender._writer.is_alive())
+        finally:
+            rstats.LOGSTASH_CLOSE_TIMEOUT = timeout
+
+
+class TestRestart(unittest.TestCase):
+    def setUp(self):
+        self.sink = TcpSink()
+        self.folder = tempfile.TemporaryDirectory()
+        folder = Path(self.folder.name)
+        collector = folder / 'collector.yml'
+        collector.write_text(
+                'address: {}\nstats:\n  port: {}\n'
+                .format(*self.sink.address))
+        configuration = folder / 'rstats.yml'
+        configuration.write_text(
+                'logstash:\n  mode: tcp\n  batch_size: 50\n  flush_interval: 60\n')
+
+        self.patched = {
+                'COLLECTOR_CONFIG_FILE': str(collector),
+                'RSTATS_CONFIG_FILE': str(configuration),
+                'DEFAULT_LOG_PATH': str(folder / 'stats'),
+        }
+        self.previous = {name: getattr(rstats, name) for name in self.patched}
+        for name, value in self.patched.items():
+            setattr(rstats, name, value)
+        rstats.restart()
+
+    def tearDown(self):
+        rstats.restart()
+        for name, value in self.previous.items():
+            setattr(rstats, name, value)
+        self.sink.close()
+        self.folder.cleanup()
+
+    def test_restart_sends_pending_statistics(self):
+        connection_id = rstats.create_stat('', 'test', 1, 2, 3, 'agent')
+        count = 1234
+        for i in range(count):
+            rstats.send_stat(connection_id, 1600000000000 + i, {'value': i})
+        rstats.restart()
+        self.assertEqual(self.sink.wait_for_lines(count), count)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -125,6 +125,10 @@ STATIC_URL = '/static/'
 STATICFILES_DIRS = []
 STATIC_ROOT = os.path.join(BASE_DIR, 'static_root')
 
+# Amount of workers running the conductor's long actions in each lane
+# of its executor can be changed by defining OPENBACH_EXECUTOR_LANES,
+# e.g. {'job_instances': 32}; lanes left out use the conductor's defaults
+
 
 try:
     from .local_settings import *
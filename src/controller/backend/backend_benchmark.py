@@ -0,0 +1,133 @@
+#!/opt/openbach/virtualenv/bin/python3
+
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2023 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+
+"""Measure the latency of a route of the backend under concurrent load"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+import json
+import time
+import argparse
+import threading
+import statistics
+import http.client
+
+
+def login(host, port, username, password):
+    connection = http.client.HTTPConnection(host, port)
+    body = json.dumps({'login': username, 'password': password})
+    connection.request('POST', '/login/', body, {'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    if response.status != 200:
+        raise RuntimeError('Login failed with status {}'.format(response.status))
+    cookies = response.headers.get_all('Set-Cookie') or []
+    return '; '.join(cookie.split(';', 1)[0] for cookie in cookies)
+
+
+def worker(host, port, route, cookie, count, latencies, errors):
+    connection = http.client.HTTPConnection(host, port)
+    headers = {'Cookie': cookie} if cookie else {}
+    for _ in range(count):
+        start = time.perf_counter()
+        connection.request('GET', route, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+        if response.status != 200:
+            errors.append(response.status)
+    connection.close()
+
+
+def percentile(values, ratio):
+    index = min(len(values) - 1, int(round(ratio * (len(values) - 1))))
+    return values[index]
+
+
+def main(host, port, route, username, password, count, concurrency):
+    cookie = login(host, port, username, password) if username else None
+
+    latencies = []
+    errors = []
+    workers = [
+            threading.Thread(
+                target=worker,
+                args=(host, port, route, cookie, count, latencies, errors))
+            for _ in range(concurrency)
+    ]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print('Sent {} requests to {} in {:.3f}s: {:.0f} req/s ({} errors)'.format(
+        len(latencies), route, elapsed, len(latencies) / elapsed, len(errors)))
+    print('Latency: mean {:.2f}ms, p50 {:.2f}ms, p99 {:.2f}ms, max {:.2f}ms'.format(
+        statistics.mean(latencies) * 1000,
+        percentile(latencies, .5) * 1000,
+        percentile(latencies, .99) * 1000,
+        latencies[-1] * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+            '-H', '--host', default='127.0.0.1',
+            help='address of the backend')
+    parser.add_argument(
+            '-p', '--port', type=int, default=8000,
+            help='port of the backend')
+    parser.add_argument(
+            '-r', '--route', default='/agent/',
+            help='route to GET repeatedly')
+    parser.add_argument(
+            '-u', '--username',
+            help='user to log in as before sending requests')
+    parser.add_argument(
+            '-P', '--password', default='',
+            help='password of the user')
+    parser.add_argument(
+            '-n', '--count', type=int, default=500,
+            help='amount of requests sent by each client')
+    parser.add_argument(
+            '-c', '--concurrency', type=int, default=5,
+            help='amount of concurrent clients')
+
+    args = parser.parse_args()
+    main(**vars(args))
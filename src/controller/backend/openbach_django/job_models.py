@@ -273,7 +273,7 @@ class JobInstance(models.Model):
                 return status
         return self.Status.UNKNOWN
 
-    def set_status(self, status):
+    def set_status(self, status, save=True):
         now = timezone.now()
         if status is not self.get_status():
             self.status = status
@@ -283,7 +283,8 @@ class JobInstance(models.Model):
         elif status not in {self.Status.UNKNOWN, self.Status.AGENT_UNREACHABLE}:
             if self.stop_date is None:
                 self.stop_date = now
-        self.save()
+        if save:
+            self.save()
 
     @property
     def last_status(self):
@@ -44,6 +44,7 @@ urlpatterns = [
     path('login/users/', views.UsersView.as_view(), name='users_view'),
     path('logs/', views.LogsView.as_view(), name='logs_view'),
     path('version/', views.VersionView.as_view(), name='version_view'),
+    path('executor/', views.ExecutorView.as_view(), name='executor_view'),
 
     path('statistic/<int:job_instance_id>/',
         views.StatisticView.as_view(),
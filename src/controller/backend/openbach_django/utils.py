@@ -34,15 +34,18 @@ __credits__ = '''Contributors:
 '''
 
 
-import os
 import enum
 import json
 import shlex
 import socket
+import struct
 import syslog
 import pathlib
-import tempfile
 import ipaddress
+import threading
+
+
+CONDUCTOR_SOCKET = '/opt/openbach/controller/conductor.socket'
 
 
 class BadRequest(Exception):
@@ -59,31 +62,87 @@ class BadRequest(Exception):
         syslog.syslog(severity, self.reason)
 
 
-def send_fifo(message, local_port=1113):
-    """Communicate a message on the given port of the local
-    machine through a socket and a FIFO file.
+class _ConductorConnection(threading.local):
+    """Per-thread connection to the conductor, kept open between requests"""
+    socket = None
+
+    def open(self, socket_name):
+        if self.socket is None:
+            conductor = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                conductor.connect(socket_name)
+            except OSError:
+                conductor.close()
+                raise
+            self.socket = conductor
+            return conductor, True
+        return self.socket, False
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+
+_conductor = _ConductorConnection()
+
 
-    Opens a FIFO and write the message to it, then send to
-    the other end the path to that FIFO. Wait for the other
-    end to write back a result and return it to the caller.
+def _receive_all(sock, amount):
+    buffer = bytearray(amount)
+    view = memoryview(buffer)
+    while amount > 0:
+        received = sock.recv_into(view[-amount:])
+        if not received:
+            break
+        amount -= received
+    return buffer[:len(buffer) - amount]
+
+
+def send_conductor(message, socket_name=CONDUCTOR_SOCKET):
+    """Communicate a message to the conductor through its Unix
+    socket and return its JSON-encoded answer.
+
+    Both the message and the answer are prefixed by their length
+    as a 4 bytes big-endian integer. The connection is kept open
+    and reused by subsequent calls from the same thread; a stale
+    connection (e.g. after a conductor restart) is transparently
+    replaced by a fresh one.
     """
-    with socket.create_connection(('localhost', local_port)) as conductor:
-        with tempfile.NamedTemporaryFile('w') as f:
-            fifoname = f.name
+    message = json.dumps(message).encode()
+    payload = struct.pack('>I', len(message)) + message
+    while True:
         try:
-            os.mkfifo(fifoname)
+            conductor, fresh = _conductor.open(socket_name)
         except OSError as e:
-            raise BadRequest('Can not create FIFO file', 400, {'error': e})
-        os.chmod(fifoname, 0o666)
-        conductor.send(json.dumps({'fifoname': fifoname}).encode())
-        with open(fifoname, 'w') as fifo:
-            fifo.write(json.dumps(message))
-        conductor.recv(16)  # Any response indicates end of processing
-
-    with open(fifoname, 'r') as fifo:
-        msg = fifo.read()
-    os.remove(fifoname)
-    return msg
+            raise BadRequest(
+                    'Can not connect to the conductor',
+                    500, {'error': str(e)})
+
+        try:
+            conductor.sendall(payload)
+            header = _receive_all(conductor, 4)
+            if len(header) == 4:
+                length, = struct.unpack('>I', header)
+                response = _receive_all(conductor, length)
+                if len(response) == length:
+                    return response.decode()
+            elif not header and not fresh:
+                # Conductor closed the connection while it was idle
+                _conductor.close()
+                continue
+            error = 'connection closed before the end of the response'
+        except BrokenPipeError as e:
+            if not fresh:
+                _conductor.close()
+                continue
+            error = str(e)
+        except OSError as e:
+            error = str(e)
+
+        _conductor.close()
+        raise BadRequest(
+                'Can not communicate with the conductor',
+                500, {'error': error})
 
 
 def nullable_json(model):
@@ -55,7 +55,7 @@ from django.db.utils import IntegrityError
 
 import yaml
 
-from .utils import send_fifo, extract_integer, user_to_json, build_storage_path
+from .utils import send_conductor, extract_integer, user_to_json, build_storage_path
 
 
 class GenericView(base.View):
@@ -122,7 +122,7 @@ class GenericView(base.View):
         """Send a command to openbach_conductor"""
         command['_username'] = self.request.user.get_username()
         command['vault_password'] = self.request.session.get('vault_password')
-        response = send_fifo(command)
+        response = send_conductor(command)
         result = json.loads(response)
         returncode = result.pop('returncode')
         return result['response'], returncode
@@ -668,7 +668,8 @@ class JobInstancesView(BaseJobInstanceView):
                 name=job_name, address=agent_ip,
                 arguments=instance_args,
                 date=self.request.JSON.get('date'),
-                interval=self.request.JSON.get('interval'))
+                interval=self.request.JSON.get('interval'),
+                precise=bool(self.request.JSON.get('precise', False)))
 
     def _action_kill(self):
         """stop all the scenario instances and job instances"""
@@ -718,7 +719,8 @@ class JobInstanceView(BaseJobInstanceView):
                 command='restart_job_instance',
                 instance_id=id, arguments=instance_args,
                 date=self.request.JSON.get('date'),
-                interval=self.request.JSON.get('interval'))
+                interval=self.request.JSON.get('interval'),
+                precise=bool(self.request.JSON.get('precise', False)))
 
 
 class ScenariosView(GenericView):
@@ -1134,6 +1136,14 @@ class VersionView(GenericView):
     patch = get
 
 
+class ExecutorView(GenericView):
+    """Manage actions relative to the conductor's actions executor"""
+
+    def get(self, request):
+        """Return the load of each lane of the executor"""
+        return self.conductor_execute(command='status_executor')
+
+
 class Reboot(GenericView):
     """Manage actions to reboot an agent"""
 
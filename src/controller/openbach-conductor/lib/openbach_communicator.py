@@ -35,13 +35,31 @@ __credits__ = '''Contributors:
 
 
 import json
+import time
+import queue
 import struct
 import socket
+import syslog
+import itertools
+import threading
+import traceback
+from contextlib import suppress
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 from . import errors
 
 
 DEFAULT_UNIX_DOMAIN = '/opt/openbach/controller/socket'
+AGENT_TIMEOUT = 2
+# Wait that long for the answer to requests expected to be
+# quick; other requests wait for as long as the agent needs
+AGENT_QUERY_TIMEOUT = 10
+# Agents close connections idle for 5 minutes, drop ours before that
+AGENT_IDLE_TIMEOUT = 4 * 60
 
 
 def receive_all(socket, amount):
@@ -125,21 +143,268 @@ class _BaseSocketCommunicator:
                 .format(self.socket, st))
 
 
-class OpenBachBaton(_BaseSocketCommunicator):
+def encode_message(message, codec='json'):
+    if codec == 'msgpack':
+        return msgpack.packb(message, use_bin_type=True)
+    return json.dumps(message).encode()
+
+
+def decode_message(payload):
+    """Decode a message from an agent, either in msgpack or JSON"""
+    if msgpack is not None and payload[:1] and (0x80 <= payload[0] <= 0x8f or payload[0] in (0xde, 0xdf)):
+        return msgpack.unpackb(payload, raw=False)
+    return json.loads(payload.decode())
+
+
+class ConnectionLost(Exception):
+    """Raised when a request could not be written on a connection
+    to an agent, so it can safely be sent again on a new one.
+    """
+
+
+class AgentConnection:
+    """Long-lived connection to an agent shared by every command sent
+    to it. Requests are tagged with an identifier that the agent
+    sends back with the associated response, so several commands
+    can be in flight on the same socket.
+
+    When on_event is provided, the agent is asked to push job
+    instances lifecycle events on this connection and they are
+    forwarded to on_event(address, event).
+
+    The timeout only bounds establishing the connection, each
+    request tells how long to wait for its own response.
+    """
+
+    def __init__(self, address, timeout=AGENT_TIMEOUT, on_event=None):
+        self.address = address
+        self.on_event = on_event
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.identifiers = itertools.count(1)
+        self.closed = False
+        self.legacy = False
+        self.codec = 'json'
+        self.last_used = time.monotonic()
+
+        try:
+            self.socket = socket.create_connection(address, timeout)
+        except socket.timeout as e:
+            raise errors.UnreachableError(
+                    'Cannot connect socket to its destination {}: {}'
+                    .format(address, e))
+        except OSError as e:
+            raise errors.UnprocessableError(
+                    'Cannot connect socket to its destination {}: {}'
+                    .format(address, e))
+
+        threading.Thread(target=self._read_responses, daemon=True).start()
+
+    @property
+    def usable(self):
+        if self.closed or self.legacy:
+            return False
+        return time.monotonic() - self.last_used < AGENT_IDLE_TIMEOUT
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            pending, self.pending = self.pending, {}
+        with suppress(OSError):
+            self.socket.shutdown(socket.SHUT_RDWR)
+        self.socket.close()
+        for future in pending.values():
+            # These requests may have been processed by the agent,
+            # sending them again could execute them twice
+            future.set_exception(errors.UnreachableError(
+                    'Connection to the agent {} lost before it answered'
+                    .format(self.address)))
+
+    def communicate(self, message, timeout=None):
+        future = Future()
+        with self.lock:
+            if self.closed:
+                raise ConnectionLost()
+            request_id = next(self.identifiers)
+            self.pending[request_id] = future
+            self.last_used = time.monotonic()
+            message = dict(message, request_id=request_id)
+            if self.codec == 'json' and msgpack is not None:
+                message['codecs'] = ['msgpack', 'json']
+            if self.on_event is not None:
+                message['events'] = True
+            payload = encode_message(message, self.codec)
+            try:
+                self.socket.sendall(struct.pack('>I', len(payload)) + payload)
+            except OSError:
+                self.pending.pop(request_id, None)
+                sent = False
+            else:
+                sent = True
+
+        if not sent:
+            self.close()
+            raise ConnectionLost()
+
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            # Forget about this request only, a late response
+            # will be ignored and other requests can still succeed
+            with self.lock:
+                self.pending.pop(request_id, None)
+            raise errors.UnreachableError(
+                    'No response from the agent {} after {} seconds'
+                    .format(self.address, timeout))
+
+    def _receive(self, amount):
+        buffer = bytearray(amount)
+        view = memoryview(buffer)
+        while amount > 0:
+            try:
+                received = self.socket.recv_into(view[-amount:])
+            except socket.timeout:
+                if self.closed:
+                    return None
+                continue
+            except OSError:
+                return None
+            if not received:
+                return None
+            amount -= received
+        return buffer
+
+    def _read_responses(self):
+        while True:
+            header = self._receive(4)
+            if header is None:
+                break
+            length, = struct.unpack('>I', header)
+            payload = self._receive(length)
+            if payload is None:
+                break
+
+            try:
+                response = decode_message(payload)
+                request_id = response.get('request_id')
+            except (ValueError, AttributeError):
+                response = request_id = None
+
+            if request_id is None and response is not None and 'event' in response:
+                if self.on_event is not None:
+                    self.on_event(self.address, response['event'])
+                continue
+
+            with self.lock:
+                if response is not None and response.get('codec') == 'msgpack' and msgpack is not None:
+                    self.codec = 'msgpack'
+                if request_id is None:
+                    # Agents not aware of multiplexing answer a single
+                    # request per connection; open a new one each time
+                    self.legacy = True
+                    request_id = min(self.pending, default=None)
+                future = self.pending.pop(request_id, None)
+            if future is not None:
+                future.set_result((response, payload))
+
+        self.close()
+
+
+class AgentConnections:
+    """Pool of connections to the agents, reused between commands"""
+
+    __state = {
+            'connections': {},
+            'locks': {},
+            'listeners': [],
+            'events': None,
+            '_mutex': threading.Lock(),
+    }
+
+    def __init__(self):
+        """Implement the Borg pattern so any instance share the same state"""
+        self.__dict__ = self.__class__.__state
+
+    def _lock(self, address):
+        with self._mutex:
+            return self.locks.setdefault(address, threading.Lock())
+
+    def get(self, address):
+        with self._lock(address):
+            connection = self.connections.get(address)
+            if connection is None or not connection.usable:
+                if connection is not None:
+                    connection.close()
+                on_event = self._push_event if self.listeners else None
+                connection = AgentConnection(address, on_event=on_event)
+                self.connections[address] = connection
+            return connection
+
+    def add_listener(self, callback):
+        """Register a callable notified, as callback(address, event),
+        of the job instances lifecycle events pushed by the agents.
+        Connections opened from now on subscribe to these events.
+        """
+        with self._mutex:
+            self.listeners.append(callback)
+            if self.events is None:
+                self.events = queue.Queue()
+                threading.Thread(target=self._dispatch_events, daemon=True).start()
+
+    def _push_event(self, address, event):
+        self.events.put((address, event))
+
+    def _dispatch_events(self):
+        # Events are handled one at a time, outside of the connections
+        # reader threads, so a started event is always processed before
+        # the finished event of the same job instance
+        while True:
+            address, event = self.events.get()
+            for listener in list(self.listeners):
+                try:
+                    listener(address, event)
+                except Exception:
+                    syslog.syslog(syslog.LOG_ERR, traceback.format_exc())
+
+    def discard(self, address):
+        with self._lock(address):
+            connection = self.connections.pop(address, None)
+        if connection is not None:
+            connection.close()
+
+    def communicate(self, address, message, timeout=None):
+        connection = self.get(address)
+        try:
+            return connection.communicate(message, timeout)
+        except ConnectionLost:
+            # The request could not be written because the agent
+            # closed an idle connection or restarted, try again
+            # once with a brand new one
+            return self.get(address).communicate(message, timeout)
+
+
+class OpenBachBaton:
     def __init__(self, agent_ip, agent_port=1112):
-        address = (agent_ip, agent_port)
-        super().__init__(address, socket.AF_INET)
+        self._address = (agent_ip, agent_port)
+        # Connect early so unreachable agents are reported right away
+        AgentConnections().get(self._address)
 
-    def communicate(self, json_message):
-        message = json.dumps(json_message)
-        response = super().communicate(message).decode()
+    def refresh(self):
+        """Kept for compatibility, connections are now managed by a pool"""
+        return self
 
+    def communicate(self, json_message, timeout=None):
         try:
-            message = json.loads(response)
-        except json.JSONDecodeError:
+            message, response = AgentConnections().communicate(self._address, json_message, timeout)
+        except ConnectionLost:
+            raise errors.UnreachableError(
+                    'Connection to the agent {} lost while sending a message'
+                    .format(self._address))
+
+        if message is None:
             raise errors.UnprocessableError(
                     'The agent did not send a JSON response',
-                    agent_message=response)
+                    agent_message=response.decode(errors='replace'))
         try:
             status = message['status']
         except KeyError:
@@ -155,7 +420,7 @@ class OpenBachBaton(_BaseSocketCommunicator):
 
         return message.get('result')
 
-    def start_job_instance(self, job_name, job_id, scenario_id, owner_id, arguments, date=None, interval=None):
+    def start_job_instance(self, job_name, job_id, scenario_id, owner_id, arguments, date=None, interval=None, precise=False):
         message = {
                 'command_name': 'start_job_instance_agent',
                 'command_arguments': {
@@ -168,6 +433,9 @@ class OpenBachBaton(_BaseSocketCommunicator):
                     'arguments': arguments,
                 },
         }
+        if precise:
+            # Only sent when needed so older agents still understand the request
+            message['command_arguments']['precise'] = True
         return self.communicate(message)
 
     def stop_job_instance(self, job_name, job_id, date='now'):
@@ -181,7 +449,7 @@ class OpenBachBaton(_BaseSocketCommunicator):
         }
         return self.communicate(message)
 
-    def restart_job_instance(self, job_name, job_id, scenario_id, owner_id, arguments, date=None, interval=None):
+    def restart_job_instance(self, job_name, job_id, scenario_id, owner_id, arguments, date=None, interval=None, precise=False):
         message = {
                 'command_name': 'restart_job_instance_agent',
                 'command_arguments': {
@@ -194,8 +462,76 @@ class OpenBachBaton(_BaseSocketCommunicator):
                     'arguments': arguments,
                 },
         }
+        if precise:
+            # Only sent when needed so older agents still understand the request
+            message['command_arguments']['precise'] = True
         return self.communicate(message)
 
+    def start_job_instances(self, job_instances):
+        """Start several job instances at once.
+
+        job_instances is an iterable of dictionaries holding the
+        arguments of start_job_instance and a result is returned
+        for each of them, in the same order.
+        """
+        return self._bulk_communicate('start_job_instances_agent', [
+                {
+                    'name': instance['job_name'],
+                    'instance_id': instance['job_id'],
+                    'scenario_id': instance['scenario_id'],
+                    'owner_id': instance['owner_id'],
+                    'date': instance.get('date'),
+                    'interval': instance.get('interval'),
+                    'arguments': instance['arguments'],
+                    **({'precise': True} if instance.get('precise') else {}),
+                } for instance in job_instances
+        ], self.start_job_instance)
+
+    def stop_job_instances(self, job_instances):
+        """Stop several job instances at once.
+
+        job_instances is an iterable of (job_name, job_id, date)
+        triplets and a result is returned for each of them, in
+        the same order.
+        """
+        return self._bulk_communicate('stop_job_instances_agent', [
+                {'name': job_name, 'instance_id': job_id, 'date': date}
+                for job_name, job_id, date in job_instances
+        ], self.stop_job_instance)
+
+    def _bulk_communicate(self, command_name, instances, fallback):
+        message = {
+                'command_name': command_name,
+                'command_arguments': {'instances': instances},
+        }
+        try:
+            return self.communicate(message)
+        except errors.UnreachableError:
+            raise
+        except errors.UnprocessableError as e:
+            agent_message = e.error.get('agent_message')
+            if not isinstance(agent_message, dict):
+                raise
+            if not str(agent_message.get('error')).startswith('Unknown action'):
+                raise
+
+        # Older agents only know how to handle a single instance
+        results = []
+        for instance in instances:
+            name = instance.pop('name')
+            instance_id = instance.pop('instance_id')
+            try:
+                result = {'status': 'OK', 'result': fallback(name, instance_id, **instance)}
+            except errors.UnprocessableError as e:
+                agent_message = e.error.get('agent_message')
+                if isinstance(agent_message, dict):
+                    result = {'status': 'KO', 'error': agent_message.get('error')}
+                else:
+                    result = {'status': 'KO', 'error': e.error.get('error')}
+            result.update(name=name, instance_id=instance_id)
+            results.append(result)
+        return results
+
     def status_job_instance(self, job_name, job_id):
         message = {
                 'command_name': 'status_job_instance_agent',
@@ -204,14 +540,47 @@ class OpenBachBaton(_BaseSocketCommunicator):
                     'instance_id': job_id,
                 },
         }
-        return self.communicate(message)
+        return self.communicate(message, AGENT_QUERY_TIMEOUT)
+
+    def status_job_instances(self, job_instances):
+        """Retrieve the status of several job instances at once.
+
+        job_instances is an iterable of (job_name, job_id) pairs
+        and the statuses are returned in the same order.
+        """
+        job_instances = list(job_instances)
+        message = {
+                'command_name': 'status_job_instances_agent',
+                'command_arguments': {
+                    'instances': [
+                        {'name': job_name, 'instance_id': job_id}
+                        for job_name, job_id in job_instances
+                    ],
+                },
+        }
+        try:
+            return self.communicate(message, AGENT_QUERY_TIMEOUT)
+        except errors.UnreachableError:
+            raise
+        except errors.UnprocessableError as e:
+            agent_message = e.error.get('agent_message')
+            if not isinstance(agent_message, dict):
+                raise
+            if not str(agent_message.get('error')).startswith('Unknown action'):
+                raise
+
+        # Older agents only know how to report a single status
+        return [
+                {'status': self.status_job_instance(job_name, job_id)}
+                for job_name, job_id in job_instances
+        ]
 
     def list_jobs(self):
         message = {
                 'command_name': 'status_jobs_agent',
                 'command_arguments': {},
         }
-        return self.communicate(message)
+        return self.communicate(message, AGENT_QUERY_TIMEOUT)
 
     def add_job(self, job_name):
         message = {
@@ -243,7 +612,7 @@ class OpenBachBaton(_BaseSocketCommunicator):
                 'command_name': 'check_connection',
                 'command_arguments': {},
         }
-        return self.communicate(message)
+        return self.communicate(message, AGENT_QUERY_TIMEOUT)
 
     def change_collector(self, address, logs_port, logs_query, stats_port, stats_query, stats_database, stats_precision):
         message = {
@@ -31,8 +31,9 @@ backend are complete and well formed. If they do, appropriate actions
 are then performed to fulfill them and return meaningful result to
 the backend.
 
-Messages are received from and send to the backend by the means of
-a FIFO file so any amount of data can easily be transfered.
+Messages are received from and send to the backend through a Unix
+socket, each of them prefixed by its length so any amount of data can
+easily be transfered.
 """
 
 
@@ -48,6 +49,7 @@ __credits__ = '''Contributors:
 import os
 import re
 import csv
+import heapq
 import shutil
 import syslog
 import tarfile
@@ -57,7 +59,7 @@ import threading
 import itertools
 import traceback
 import configparser
-from time import sleep
+from time import sleep, monotonic
 from pathlib import Path
 from functools import wraps
 from datetime import datetime
@@ -70,6 +72,7 @@ import numpy
 from fuzzywuzzy import fuzz
 from packaging.version import parse as version
 from django import db
+from django.conf import settings
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User, AnonymousUser
@@ -100,6 +103,14 @@ from .openbach_communicator import OpenBachBaton, OpenBachClapperBoard
 
 
 TOPOLOGY_WORKERS = 10
+# Amount of workers running ThreadedActions in each executor lane,
+# lanes are independent so mass installations cannot delay job starts.
+# Each value can be overridden by the OPENBACH_EXECUTOR_LANES setting.
+EXECUTOR_LANES = {
+    'job_instances': 16,
+    'configuration': 8,
+    'installation': 8,
+}
 _SEVERITY_MAPPING = {
     1: 3,   # Error
     2: 4,   # Warning
@@ -259,6 +270,108 @@ class ConductorAction:
                 self.connected_user)
 
 
+class _ExecutorLane:
+    """Set of workers running the tasks submitted to a lane of the
+    executor, by priority then by date.
+    """
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.queue = []
+        self.condition = threading.Condition()
+        self.sequence = itertools.count()
+        self.workers = 0
+        self.idle = 0
+        self.executed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def submit(self, priority, date, function, args):
+        with self.condition:
+            entry = (priority, date, next(self.sequence), monotonic(), function, args)
+            heapq.heappush(self.queue, entry)
+            if self.idle:
+                self.idle -= 1
+                self.condition.notify()
+            elif self.workers < self.size:
+                self.workers += 1
+                worker = threading.Thread(
+                        target=self._work, daemon=True,
+                        name='{}-{}'.format(self.name, self.workers))
+                worker.start()
+
+    def _work(self):
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.idle += 1
+                    self.condition.wait()
+                _, _, _, queued, function, args = heapq.heappop(self.queue)
+                wait = monotonic() - queued
+                self.executed += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+
+            try:
+                function(*args)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                db.connections.close_all()
+
+    def statistics(self):
+        with self.condition:
+            now = monotonic()
+            executed = self.executed
+            return {
+                    'workers': self.size,
+                    'busy_workers': self.workers - self.idle,
+                    'queue_length': len(self.queue),
+                    'oldest_wait': max((now - entry[3] for entry in self.queue), default=0.0),
+                    'executed': executed,
+                    'mean_wait': self.total_wait / executed if executed else 0.0,
+                    'max_wait': self.max_wait,
+            }
+
+
+class ActionsExecutor:
+    """Conductor-wide pool of workers running long actions outside
+    of the threads handling the backend requests.
+
+    Tasks are submitted into named lanes, each having its own amount
+    of workers as configured in the OPENBACH_EXECUTOR_LANES setting,
+    or EXECUTOR_LANES by default. Queued tasks of a lane are run by
+    increasing priority, then in the order of their date.
+    """
+
+    __state = {
+            'lanes': {},
+            '_mutex': threading.Lock(),
+    }
+
+    def __init__(self):
+        """Implement the Borg pattern so any instance share the same state"""
+        self.__dict__ = self.__class__.__state
+
+    def _lane(self, name):
+        with self._mutex:
+            lane = self.lanes.get(name)
+            if lane is None:
+                configured = getattr(settings, 'OPENBACH_EXECUTOR_LANES', {})
+                size = int(configured.get(name, EXECUTOR_LANES[name]))
+                lane = self.lanes[name] = _ExecutorLane(name, size)
+            return lane
+
+    def submit(self, lane, priority, function, *args, date=None):
+        if date is None:
+            date = timezone.now()
+        self._lane(lane).submit(priority, date, function, args)
+
+    def statistics(self):
+        return {name: self._lane(name).statistics() for name in EXECUTOR_LANES}
+
+
 class ThreadedAction(ConductorAction):
     """Specific kind of action that is known to take a long time (usually
     by launching playbooks).
@@ -267,21 +380,38 @@ class ThreadedAction(ConductorAction):
     and set the state of the action in the backend database. Clients are
     responsible to check this state regularly to know when the action
     actually terminates.
+
+    The action is queued in the `executor_lane` of the ActionsExecutor
+    and run once a worker of this lane is available, lower values of
+    `executor_priority` first. Its state stays 202 in the meantime.
     """
 
+    executor_lane = 'configuration'
+    executor_priority = 1
+
     def action(self):
         """Public entry point to execute the required action"""
         real_action = super().action
-        thread = threading.Thread(target=self._threaded_action, args=(real_action,))
-        thread.start()
+        command_result = self._create_command_result()
+        ActionsExecutor().submit(
+                self.executor_lane, self.executor_priority,
+                self._threaded_action, real_action, command_result,
+                date=command_result.date)
         return {}, 202
 
+    def create_command_result(self):
+        """Create the CommandResult of this action, marked as running,
+        for callers submitting it to the executor on their own.
+        """
+        return self._create_command_result()
+
     def _create_command_result(self):
         """Override this in subclasses to create the required CommandResult"""
         raise NotImplementedError
 
-    def _threaded_action(self, real_action):
-        command_result = self._create_command_result()
+    def _threaded_action(self, real_action, command_result=None):
+        if command_result is None:
+            command_result = self._create_command_result()
         try:
             real_action()
         except errors.ConductorError as e:
@@ -1538,6 +1668,8 @@ class InstalledJobAction(ConductorAction):
 class InstallJob(ThreadedAction, InstalledJobAction):
     """Action responsible for installing a Job on an Agent"""
 
+    executor_lane = 'installation'
+
     def __init__(self, address, name, severity=2, local_severity=2, skip_playbook=False, cookie=None):
         super().__init__(address=address, name=name, skip_playbook=skip_playbook,
                          severity=severity, local_severity=local_severity, cookie=cookie)
@@ -1659,6 +1791,8 @@ class InstallJobs(InstalledJobAction):
 class UninstallJob(ThreadedAction, InstalledJobAction):
     """Action responsible for uninstalling a Job on an Agent"""
 
+    executor_lane = 'installation'
+
     def __init__(self, address, name):
         super().__init__(address=address, name=name)
 
@@ -1977,20 +2111,64 @@ class JobInstanceAction(ConductorAction):
                     scenario_id, owner_id,
                     job_instance.arguments,
                     job_instance.start_timestamp,
-                    self.interval)
+                    self.interval,
+                    self.precise)
         except errors.UnreachableError:
             job_instance.delete()
             raise
         else:
             job_instance.set_status(JobInstance.Status.RUNNING)
 
+    @staticmethod
+    def _update_job_instances_status(job_instances):
+        """Retrieve the status of the given JobInstances from their
+        agents and store it. A single request is sent to each agent
+        whatever the amount of JobInstances it is running, and their
+        new statuses are written in a single query.
+        """
+        agents = defaultdict(list)
+        for job_instance in job_instances:
+            agent = job_instance.agent
+            if agent is not None:
+                agents[agent.address, agent.port].append(job_instance)
+
+        for (address, port), instances in agents.items():
+            try:
+                statuses = OpenBachBaton(address, port).status_job_instances(
+                        (job_instance.job_name, job_instance.id)
+                        for job_instance in instances)
+            except errors.UnreachableError:
+                statuses = [{'status': 'Agent Unreachable'}] * len(instances)
+            except errors.UnprocessableError:
+                statuses = [{'status': 'Error'}] * len(instances)
+
+            for job_instance, status in zip(instances, statuses):
+                job_status = job_instance.get_status(status['status'].title())
+                job_instance.set_status(job_status, save=False)
+            JobInstance.objects.bulk_update(instances, ['status', 'update_status', 'stop_date'])
+
+    def _job_instance_status(self, job_instance):
+        status = job_instance.json
+        if self.update and job_instance.agent is None:
+            warning_message = 'The Agent of this JobInstance was uninstalled. Status not updated.'
+            status['warning'] = warning_message
+            warning = errors.ConductorWarning(
+                    warning_message,
+                    job_instance_id=job_instance.id,
+                    job_name=job_instance.job_name)
+            syslog.syslog(syslog.LOG_WARNING, str(warning.json))
+        return status
+
 
 class StartJobInstance(ThreadedAction, JobInstanceAction):
     """Action responsible for launching a Job on an Agent"""
 
-    def __init__(self, address, name, arguments, date=None, interval=None, offset=0):
+    executor_lane = 'job_instances'
+
+    def __init__(self, address, name, arguments, date=None, interval=None, offset=0, precise=False):
         super().__init__(address=address, name=name, arguments=arguments,
-                         date=date, interval=interval, offset=offset)
+                         date=date, interval=interval, offset=offset,
+                         precise=precise)
 
     def _create_command_result(self):
         command_result, _ = JobInstanceCommandResult.objects.get_or_create(job_instance_id=self.instance_id)
@@ -2053,6 +2231,9 @@ class StartJobInstance(ThreadedAction, JobInstanceAction):
 class StopJobInstance(ThreadedAction, JobInstanceAction):
     """Action responsible for stopping a launched Job"""
 
+    executor_lane = 'job_instances'
+    executor_priority = 0
+
     def __init__(self, instance_id=None, date=None, openbach_function_id=None):
         super().__init__(instance_id=instance_id, date=date,
                          openbach_function_id=openbach_function_id)
@@ -2067,41 +2248,82 @@ class StopJobInstance(ThreadedAction, JobInstanceAction):
         return super().action()
 
     def _action(self):
-        job_instance = self.get_job_instance_or_not_found_error()
-        owner = job_instance.started_by
-        self._assert_user_in([owner])
+        error, = self.stop_job_instances([self])
+        if error is not None:
+            raise error
 
-        was_stopped = job_instance.is_stopped
-        instance_id = self.instance_id
-        job_name = job_instance.job_name
+    @staticmethod
+    def stop_job_instances(stop_actions):
+        """Send the stop orders of several StopJobInstance actions
+        using a single request per agent and return the error each
+        of them produced, if any, in the same order.
+        """
+        outcomes = [None] * len(stop_actions)
+        agents = defaultdict(list)
+        for index, stop in enumerate(stop_actions):
+            try:
+                job_instance = stop.get_job_instance_or_not_found_error()
+                stop._assert_user_in([job_instance.started_by])
+            except errors.ConductorError as e:
+                outcomes[index] = e
+                continue
 
-        if self.date is None:
-            date = 'now'
-            stop_date = timezone.now()
-        else:
-            date = self.date
-            tz = timezone.get_current_timezone()
-            stop_date = datetime.fromtimestamp(date / 1000, tz=tz)
+            if stop.date is None:
+                date = 'now'
+                stop_date = timezone.now()
+            else:
+                date = stop.date
+                tz = timezone.get_current_timezone()
+                stop_date = datetime.fromtimestamp(date / 1000, tz=tz)
 
-        agent = job_instance.agent
-        try:
-            baton = OpenBachBaton(agent.address, agent.port)
-        except AttributeError:
-            raise errors.ConductorWarning(
-                    'The Agent associated to this JobInstance was '
-                    'uninstalled. Marking the JobInstance stopped anyway.',
-                    job_instance_id=instance_id, job_name=job_name)
-        else:
-            baton.stop_job_instance(job_name, instance_id, date)
-        finally:
+            was_stopped = job_instance.is_stopped
             job_instance.stop_date = stop_date
-            job_instance.save()
+            agent = job_instance.agent
+            if agent is None:
+                job_instance.save()
+                outcomes[index] = errors.ConductorWarning(
+                        'The Agent associated to this JobInstance was '
+                        'uninstalled. Marking the JobInstance stopped anyway.',
+                        job_instance_id=job_instance.id,
+                        job_name=job_instance.job_name)
+            else:
+                agents[agent.address, agent.port].append((index, job_instance, date, was_stopped))
 
-        if was_stopped:
-            raise errors.ConductorWarning(
-                    'The requested JobInstance was already stopped. '
-                    'Sent a new stop order to the Agent anyway.',
-                    job_instance_id=instance_id, job_name=job_name)
+        for (address, port), instances in agents.items():
+            try:
+                results = OpenBachBaton(address, port).stop_job_instances(
+                        (job_instance.job_name, job_instance.id, date)
+                        for _, job_instance, date, _ in instances)
+            except errors.ConductorError as e:
+                results = [e] * len(instances)
+
+            for (index, job_instance, _, was_stopped), result in zip(instances, results):
+                job_instance.save()
+                if isinstance(result, errors.ConductorError):
+                    outcomes[index] = result
+                elif result.get('status') != 'OK':
+                    outcomes[index] = errors.UnprocessableError(
+                            'The agent did not send a success message',
+                            agent_message=result)
+                elif was_stopped:
+                    outcomes[index] = errors.ConductorWarning(
+                            'The requested JobInstance was already stopped. '
+                            'Sent a new stop order to the Agent anyway.',
+                            job_instance_id=job_instance.id,
+                            job_name=job_instance.job_name)
+
+        return outcomes
+
+    def record_outcome(self, error, command_result=None):
+        """Store the outcome of this action, computed by
+        stop_job_instances, as its command result.
+        """
+        def outcome():
+            if error is not None:
+                raise error
+
+        with suppress(errors.ConductorError):
+            self._threaded_action(outcome, command_result)
 
 
 class StopJobInstances(ConductorAction):
@@ -2113,19 +2335,38 @@ class StopJobInstances(ConductorAction):
 
     @require_connected_user()
     def _action(self):
+        stop_jobs = []
+        command_results = []
         for instance_id in self.instance_ids:
             stop_job = StopJobInstance(instance_id, self.date)
             self.share_user(stop_job)
-            stop_job.action()
+            stop_jobs.append(stop_job)
+            command_results.append(stop_job.create_command_result())
+        ActionsExecutor().submit(
+                StopJobInstance.executor_lane,
+                StopJobInstance.executor_priority,
+                self._stop_job_instances, stop_jobs, command_results,
+                date=min((result.date for result in command_results), default=None))
         return {}, 202
 
+    @staticmethod
+    def _stop_job_instances(stop_jobs, command_results=None):
+        if command_results is None:
+            command_results = [None] * len(stop_jobs)
+        outcomes = StopJobInstance.stop_job_instances(stop_jobs)
+        for stop_job, command_result, error in zip(stop_jobs, command_results, outcomes):
+            stop_job.record_outcome(error, command_result)
+        return outcomes
+
 
 class RestartJobInstance(ThreadedAction, JobInstanceAction):
     """Action responsible for restarting a launched Job"""
 
-    def __init__(self, instance_id, arguments, date=None, interval=None):
+    executor_lane = 'job_instances'
+
+    def __init__(self, instance_id, arguments, date=None, interval=None, precise=False):
         super().__init__(instance_id=instance_id, arguments=arguments,
-                         date=date, interval=interval)
+                         date=date, interval=interval, precise=precise)
 
     def _create_command_result(self):
         command_result, _ = JobInstanceCommandResult.objects.get_or_create(job_instance_id=self.instance_id)
@@ -2167,33 +2408,45 @@ class StatusJobInstance(JobInstanceAction):
     def _action(self):
         job_instance = self.get_job_instance_or_not_found_error()
         owner = job_instance.started_by
-        agent = job_instance.agent
         if not job_instance.is_stopped:
             self._assert_user_in([owner])
 
-        if self.update and agent is not None:
-            try:
-                job_status = OpenBachBaton(agent.address, agent.port).status_job_instance(
-                        job_instance.job_name, self.instance_id)
-            except errors.UnreachableError:
-                job_status = 'Agent Unreachable'
-            except errors.UnprocessableError:
-                job_status = 'Error'
-            finally:
-                job_status = job_instance.get_status(job_status.title())
-                job_instance.set_status(job_status)
+        if self.update:
+            self._update_job_instances_status([job_instance])
 
-        status = job_instance.json
-        if self.update and agent is None:
-            warning_message = 'The Agent of this JobInstance was uninstalled. Status not updated.'
-            status['warning'] = warning_message
-            warning = errors.ConductorWarning(
-                    warning_message,
-                    job_instance_id=self.instance_id,
-                    job_name=job_instance.job_name)
-            syslog.syslog(syslog.LOG_WARNING, str(warning.json))
+        return self._job_instance_status(job_instance), 200
+
+
+class StatusJobInstances(JobInstanceAction):
+    """Action responsible for retrieving the status of several JobInstances"""
+
+    def __init__(self, instance_ids, update=False):
+        super().__init__(instance_ids=instance_ids, update=update)
 
-        return status, 200
+    def _action(self):
+        job_instances = list(self._get_job_instances())
+        if self.update:
+            self._update_job_instances_status(job_instances)
+
+        return {
+                'instances': [
+                    self._job_instance_status(job_instance)
+                    for job_instance in job_instances
+                ],
+        }, 200
+
+    def _get_job_instances(self):
+        """Generate the requested JobInstances, skipping the ones
+        the connected user is not allowed to see.
+        """
+        job_instances = JobInstance.objects.filter(id__in=self.instance_ids).select_related('agent')
+        for job_instance in job_instances.order_by('id'):
+            if not job_instance.is_stopped:
+                try:
+                    self._assert_user_in([job_instance.started_by])
+                except errors.ForbiddenError:
+                    continue
+            yield job_instance
 
 
 class ListJobInstance(JobInstanceAction):
@@ -2208,8 +2461,23 @@ class ListJobInstance(JobInstanceAction):
         agent_infos._check_user_can_use_agent()
         agent = agent_infos.get_agent_or_not_found_error()
 
+        # Retrieve every status in a single request to the agent
+        instances = StatusJobInstances(
+                JobInstance.objects.filter(
+                    agent_name=agent.name,
+                    stop_date__isnull=True,
+                ).values_list('id', flat=True),
+                self.update)
+        self.share_user(instances)
+        statuses = defaultdict(list)
+        for status in instances.action()[0]['instances']:
+            statuses[status['name']].append(status)
+
         jobs = [
-                self._status_instances(installed_job)
+                {
+                    'job_name': installed_job.job.name,
+                    'instances': statuses[installed_job.job.name],
+                }
                 for installed_job in agent.installed_jobs.all()
         ]
         return {
@@ -2217,22 +2485,6 @@ class ListJobInstance(JobInstanceAction):
                 'installed_jobs': jobs,
         }, 200
 
-    def _status_instances(self, installed_job):
-        return {
-                'job_name': installed_job.job.name,
-                'instances': list(self._status_instances_helper(installed_job)),
-        }
-
-    def _status_instances_helper(self, installed_job):
-        for job_instance in JobInstance.objects.filter(
-                job_name=installed_job.job.name,
-                agent_name=installed_job.agent.name,
-                stop_date__isnull=True):
-            with suppress(errors.ConductorError):
-                status = StatusJobInstance(job_instance.id, self.update)
-                self.share_user(status)
-                yield status.action()[0]
-
 
 class ListJobInstances(ConductorAction):
     """Action responsible for listing the JobInstances running on several Agents"""
@@ -3899,6 +4151,16 @@ class DeleteDatabases(CollectorAction):
         return deleted, 200
 
 
+class StatusExecutor(ConductorAction):
+    """Action responsible for retrieving the load of the executor"""
+
+    def __init__(self):
+        super().__init__()
+
+    def _action(self):
+        return ActionsExecutor().statistics(), 200
+
+
 class Reboot(ConductorAction):
     """Reboot on a different kernel"""
 
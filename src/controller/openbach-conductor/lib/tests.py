@@ -0,0 +1,187 @@
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2023 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+
+
+"""Unit tests of the conductor library. Run with `python3 -m unittest lib.tests`"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+import os
+import json
+import time
+import struct
+import socket
+import unittest
+import threading
+
+from . import errors
+from .openbach_communicator import AgentConnection, receive_all
+
+
+class FakeAgent:
+    """Answer requests once a batch of them was received,
+    in reverse order, echoing their arguments.
+    """
+
+    def __init__(self, batch=1):
+        self.batch = batch
+        self.server = socket.create_server(('127.0.0.1', 0))
+        self.address = self.server.getsockname()
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        try:
+            connection, _ = self.server.accept()
+        except OSError:
+            return
+        with connection:
+            while True:
+                requests = []
+                while len(requests) < self.batch:
+                    header = receive_all(connection, 4)
+                    if len(header) < 4:
+                        return
+                    length, = struct.unpack('>I', header)
+                    requests.append(json.loads(receive_all(connection, length).decode()))
+                for request in reversed(requests):
+                    arguments = request['command_arguments']
+                    time.sleep(arguments.get('delay', 0))
+                    response = json.dumps({
+                            'status': 'OK',
+                            'result': arguments,
+                            'request_id': request['request_id'],
+                    }).encode()
+                    connection.sendall(struct.pack('>I', len(response)) + response)
+
+    def close(self):
+        self.server.close()
+
+
+class TestAgentConnection(unittest.TestCase):
+    def communicate_concurrently(self, connection, arguments):
+        results = [None] * len(arguments)
+
+        def communicate(index):
+            message = {'command_name': 'test', 'command_arguments': arguments[index]}
+            try:
+                response, _ = connection.communicate(message)
+            except errors.UnreachableError as e:
+                results[index] = e
+            else:
+                results[index] = response['result']
+
+        threads = [threading.Thread(target=communicate, args=(i,)) for i in range(len(arguments))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_responses_reach_their_requests(self):
+        agent = FakeAgent(batch=10)
+        connection = AgentConnection(agent.address)
+        try:
+            arguments = [{'index': i} for i in range(10)]
+            self.assertEqual(self.communicate_concurrently(connection, arguments), arguments)
+        finally:
+            connection.close()
+            agent.close()
+
+    def test_long_requests_are_not_bounded(self):
+        agent = FakeAgent()
+        connection = AgentConnection(agent.address, timeout=0.5)
+        try:
+            response, _ = connection.communicate(
+                    {'command_name': 'test', 'command_arguments': {'delay': 1}})
+            self.assertEqual(response['result'], {'delay': 1})
+        finally:
+            connection.close()
+            agent.close()
+
+    def test_timeout_only_fails_its_request(self):
+        agent = FakeAgent()
+        connection = AgentConnection(agent.address)
+        try:
+            with self.assertRaises(errors.UnreachableError):
+                connection.communicate(
+                        {'command_name': 'test', 'command_arguments': {'delay': 0.5}},
+                        timeout=0.2)
+
+            # The late response must not be mistaken for this one
+            response, _ = connection.communicate(
+                    {'command_name': 'test', 'command_arguments': {'index': 1}})
+            self.assertEqual(response['result'], {'index': 1})
+        finally:
+            connection.close()
+            agent.close()
+
+
+class TestExecutorLane(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # The conductor needs Django set up, as the director does
+        try:
+            import django
+        except ImportError:
+            raise unittest.SkipTest('Django is not available')
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+        django.setup()
+
+        from .openbach_conductor import _ExecutorLane
+        cls.lane_class = _ExecutorLane
+
+    def test_tasks_run_by_priority_then_date(self):
+        lane = self.lane_class('test', 1)
+        executed = []
+        started = threading.Event()
+        blocked = threading.Event()
+        done = threading.Event()
+
+        def block():
+            started.set()
+            blocked.wait()
+
+        # Keep the only worker busy while the other tasks are queued
+        lane.submit(0, None, block, ())
+        started.wait()
+        tasks = [(1, 3, 'c'), (0, 2, 'b'), (1, 1, 'a'), (0, 1, 'd'), (1, 3, 'e')]
+        for priority, date, name in tasks:
+            lane.submit(priority, date, executed.append, (name,))
+        lane.submit(2, 0, done.set, ())
+        blocked.set()
+
+        self.assertTrue(done.wait(2))
+        self.assertEqual(executed, ['d', 'b', 'a', 'c', 'e'])
+        self.assertEqual(lane.statistics()['queue_length'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
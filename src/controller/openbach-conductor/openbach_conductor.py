@@ -33,8 +33,10 @@ backend are complete and well formed. If they do, appropriate actions
 are then performed to fulfill them and return meaningful result to
 the backend.
 
-Messages are received from and send to the backend by the means of
-a FIFO file so any amount of data can easily be transfered.
+Messages are received from and send to the backend through a Unix
+socket, each of them prefixed by its length so any amount of data can
+easily be transfered. Backend workers keep their connection open and
+send several requests over it.
 """
 
 
@@ -49,7 +51,10 @@ __credits__ = '''Contributors:
 
 import os
 import json
+import struct
 import syslog
+import pathlib
+import threading
 import traceback
 import socketserver
 from contextlib import suppress
@@ -73,11 +78,17 @@ application = get_wsgi_application()
 
 from lib import openbach_conductor
 from lib.utils import OpenbachJSONEncoder
+from openbach_django.utils import CONDUCTOR_SOCKET
 from openbach_django.models import ScenarioInstance, CommandResult, InstalledJobCommandResult
 
 
 syslog.openlog('openbach_conductor', syslog.LOG_PID, syslog.LOG_USER)
 
+# Amount of backend requests processed at the same time, others wait
+# for a slot with their connection open
+MAX_CONCURRENT_REQUESTS = 16
+MAX_PENDING_CONNECTIONS = 64
+
 
 def class_from_name(name):
     """Return the class of this module whose name is given"""
@@ -88,26 +99,38 @@ def class_from_name(name):
     raise AttributeError
 
 
-class ConductorServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+class ConductorServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
     """Choose the underlying technology for our sockets servers"""
-    allow_reuse_address = True
+    daemon_threads = True
+    request_queue_size = MAX_PENDING_CONNECTIONS
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.requests_slots = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
 
-class BackendHandler(socketserver.BaseRequestHandler):
-    def finish(self):
-        """Close the connection after handling a request"""
-        self.request.close()
 
+class BackendHandler(socketserver.StreamRequestHandler):
     def handle(self):
-        """Handle message comming from the backend"""
-
-        fifo_infos = self.request.recv(4096).decode()
-        fifoname = json.loads(fifo_infos)['fifoname']
-        with open(fifoname) as fifo:
-            request = json.loads(fifo.read())
-
+        """Handle messages comming from the backend until
+        it closes the connection.
+        """
+        while True:
+            header = self.rfile.read(4)
+            if len(header) != 4:
+                break
+            length, = struct.unpack('>I', header)
+            message = self.rfile.read(length)
+            if len(message) != length:
+                break
+            with self.server.requests_slots:
+                result = self.process_request(message.decode())
+            answer = json.dumps(result, cls=OpenbachJSONEncoder).encode()
+            self.request.sendall(struct.pack('>I', len(answer)) + answer)
+
+    def process_request(self, message):
+        """Execute a request and build the associated response"""
         try:
-            response, returncode = self.execute_request(request)
+            response, returncode = self.execute_request(json.loads(message))
         except errors.ConductorError as e:
             result = e.json
             is_warning = isinstance(e, errors.ConductorWarning)
@@ -127,10 +150,8 @@ class BackendHandler(socketserver.BaseRequestHandler):
             result = {'response': response, 'returncode': returncode}
             syslog.syslog(syslog.LOG_INFO, '{}'.format(result))
         finally:
-            self.request.sendall(b'Done')
-            with open(fifoname, 'w') as fifo:
-                json.dump(result, fifo, cls=OpenbachJSONEncoder)
             signals.request_finished.send(sender=self.__class__)
+        return result
 
     def execute_request(self, request):
         """Analyze the data received to execute the right action"""
@@ -163,10 +184,15 @@ def clear_jobs_statuses():
     CommandResult.objects.filter(pk__in=InstalledJobCommandResult.objects.filter(status_uninstall__returncode=202).values('status_uninstall')).update(returncode=500, response='{"state":"Controller restarted while uninstalling"}')
 
 
-def main(address='localhost', port=1113):
+def main(socket_name=CONDUCTOR_SOCKET):
+    # Remove old socket file if any
+    socket = pathlib.Path(socket_name)
+    if socket.is_socket():
+        socket.unlink()
+
     clear_jobs_statuses()
 
-    backend_server = ConductorServer((address, port), BackendHandler)
+    backend_server = ConductorServer(socket_name, BackendHandler)
     try:
         backend_server.serve_forever()
     finally:
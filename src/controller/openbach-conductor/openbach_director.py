@@ -33,8 +33,9 @@ backend are complete and well formed. If they do, appropriate actions
 are then performed to fulfill them and return meaningful result to
 the backend.
 
-Messages are received from and send to the backend by the means of
-a FIFO file so any amount of data can easily be transfered.
+Messages are received from and send to the backend through a Unix
+socket, each of them prefixed by its length so any amount of data can
+easily be transfered.
 """
 
 
@@ -50,12 +51,14 @@ import os
 import sys
 import json
 import time
+import queue
 import struct
 import syslog
 import pathlib
 import threading
 import traceback
 import socketserver
+from datetime import timedelta
 from contextlib import suppress
 from collections import defaultdict
 
@@ -78,18 +81,19 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 application = get_wsgi_application()
 
+from django import db
 from django.utils import timezone
 from django.db.models import Q
 from django.core.exceptions import ObjectDoesNotExist
 from openbach_django.models import (
-        ScenarioInstance, JobInstance, OpenbachFunctionInstance,
+        Job, ScenarioInstance, JobInstance, OpenbachFunctionInstance,
         StartJobInstance as StartJobInstanceOpenbachFunction,
         StartScenarioInstance as StartScenarioInstanceOpenbachFunction,
-        FailurePolicy,
+        FailurePolicy, WaitForRunning, WaitForEnded, WaitForLaunched, WaitForFinished,
 )
 
 from lib.utils import OpenbachJSONEncoder
-from lib.openbach_communicator import receive_all, DEFAULT_UNIX_DOMAIN
+from lib.openbach_communicator import receive_all, AgentConnections, DEFAULT_UNIX_DOMAIN
 from lib.openbach_conductor import (
         StatusJobInstance as StatusJobInstanceConductor,
         StartScenarioInstance as StartScenarioInstanceConductor,
@@ -108,26 +112,47 @@ from lib.openbach_conductor import (
 syslog.openlog('openbach_director', syslog.LOG_PID, syslog.LOG_USER)
 
 
-ERRORED_FUNCTIONS_NOT_IGNORED = Q(status=OpenbachFunctionInstance.Status.ERROR, retries_left__isnull=False)
-PLANNED_FUNCTIONS = Q(status=OpenbachFunctionInstance.Status.SCHEDULED)
-FINISHED_FUNCTIONS = Q(status=OpenbachFunctionInstance.Status.FINISHED)
-UNFINISHED_FUNCTIONS = Q(status__in=(
-    OpenbachFunctionInstance.Status.SCHEDULED,
-    OpenbachFunctionInstance.Status.RUNNING,
-))
-
-FAILED_JOBS = Q(stop_date__isnull=False, status__in=(
-    JobInstance.Status.ERROR,
-    JobInstance.Status.AGENT_UNREACHABLE,
-    JobInstance.Status.NOT_SCHEDULED,
-    JobInstance.Status.UNKNOWN,
-))
-IGNORABLE_JOBS = Q(openbach_function_instance__openbach_function__on_failure__policy=FailurePolicy.Policies.IGNORE)
-
-SCENARIOS_STOPPED = Q(status__in=(ScenarioInstance.Status.STOPPED, ScenarioInstance.Status.FINISHED_OK))
-SCENARIOS_ERRORED = Q(status=ScenarioInstance.Status.FINISHED_KO)
-SCENARIOS_UNREACHABLE = Q(status=ScenarioInstance.Status.AGENTS_UNREACHABLE)
-SCENARIOS_ENDED = SCENARIOS_ERRORED | SCENARIOS_STOPPED | SCENARIOS_UNREACHABLE
+UNFINISHED_FUNCTIONS = {
+        OpenbachFunctionInstance.Status.SCHEDULED,
+        OpenbachFunctionInstance.Status.RUNNING,
+}
+FAILED_JOBS = {
+        JobInstance.Status.ERROR,
+        JobInstance.Status.AGENT_UNREACHABLE,
+        JobInstance.Status.NOT_SCHEDULED,
+        JobInstance.Status.UNKNOWN,
+}
+ENDED_SCENARIOS = {
+        ScenarioInstance.Status.STOPPED,
+        ScenarioInstance.Status.FINISHED_OK,
+        ScenarioInstance.Status.FINISHED_KO,
+        ScenarioInstance.Status.AGENTS_UNREACHABLE,
+}
+SCENARIOS_ENDED = Q(status__in=ENDED_SCENARIOS)
+
+WAITING_CONDITIONS = {
+        'running': WaitForRunning,
+        'ended': WaitForEnded,
+        'launched': WaitForLaunched,
+        'finished': WaitForFinished,
+}
+
+# Agents push the JobInstances lifecycle events to the director,
+# polling them is only a fallback for events that went missing.
+# Each agent is polled at its own pace: sooner when some of its
+# JobInstances are expected to end, later when they all belong
+# to persistent or periodic jobs.
+STATUS_POLLING_PERIOD = 10
+STATUS_POLLING_MIN_PERIOD = 1
+STATUS_POLLING_MAX_PERIOD = 60
+# Amount of previous runs of a job used to guess how long it lasts
+EXPECTED_DURATION_SAMPLES = 5
+EVENT_RETRY_DELAY = 0.1
+EVENT_RETRIES = 50
+# Scenarios are scheduled upon events from their Openbach Functions
+# and JobInstances, the database is read back that often in case
+# some of them went missing
+SCENARIO_RESYNC_PERIOD = 10
 
 
 ######################
@@ -141,6 +166,7 @@ class StatusManager:
 
     __state = {
             'job_instances': defaultdict(set),
+            'agents': {},
             'scenarios': {},
             '_mutex': threading.Lock(),
             'scheduler': None,
@@ -154,25 +180,61 @@ class StatusManager:
                 self.scheduler = BackgroundScheduler()
                 self.scheduler.start()
 
-    def _stop_watch(self, job_id):
-        with suppress(JobLookupError):
-            self.scheduler.remove_job('watch_{}'.format(job_id))
+    def watched_job_instances(self, address, port):
+        with self._mutex:
+            return [
+                    (scenario_id, job_id)
+                    for scenario_id, jobs in self.job_instances.items()
+                    for job_id in jobs
+                    if self.agents.get(job_id) == (address, port)
+            ]
+
+    def _watching_scenarios(self, job_id):
+        with self._mutex:
+            return [
+                    scenario_id
+                    for scenario_id, jobs in self.job_instances.items()
+                    if job_id in jobs
+            ]
 
-    def add_job(self, scenario_id, job_id, username):
+    def add_job(self, scenario_id, job_id):
         with self._mutex:
             self.job_instances[scenario_id].add(job_id)
-            self.scheduler.add_job(
-                    status_manager, 'interval', seconds=2,
-                    args=(job_id, scenario_id, username),
-                    id='watch_{}'.format(job_id))
+            agent = self.agents.get(job_id)
+
+        if agent is None:
+            agent = JobInstance.objects.filter(id=job_id).values_list('agent__address', 'agent__port').first()
+            if agent is None or agent[0] is None:
+                # Uninstalled agent, nothing to poll
+                return
+            with self._mutex:
+                self.agents[job_id] = agent
+        self.schedule_watch(*agent, STATUS_POLLING_PERIOD)
 
     def remove_job(self, scenario_id, job_id):
         with self._mutex:
             jobs = self.job_instances[scenario_id]
-            jobs.remove(job_id)
-            self._stop_watch(job_id)
+            jobs.discard(job_id)
             if not jobs:
                 del self.job_instances[scenario_id]
+            if not any(job_id in jobs for jobs in self.job_instances.values()):
+                self.agents.pop(job_id, None)
+
+    def schedule_watch(self, address, port, delay):
+        """Make sure the watched JobInstances of the given
+        agent are checked in at most delay seconds.
+        """
+        watch_id = 'watch_agent_{}_{}'.format(address, port)
+        run_date = timezone.now() + timedelta(seconds=delay)
+        with self._mutex:
+            job = self.scheduler.get_job(watch_id)
+            if job is None:
+                self.scheduler.add_job(
+                        watch_agent, 'date', run_date=run_date,
+                        args=(address, port), id=watch_id)
+            elif job.next_run_time > run_date:
+                with suppress(JobLookupError):
+                    self.scheduler.reschedule_job(watch_id, trigger='date', run_date=run_date)
 
     def add_scenario(self, thread, scenario_id):
         thread.start()
@@ -185,40 +247,175 @@ class StatusManager:
                 thread = self.scenarios.pop(scenario_id)
             thread.stop()
 
+    def notify_scenario(self, scenario_id, event=None):
+        """Let the thread scheduling the given scenario
+        instance know that something changed for it.
+        """
+        with self._mutex:
+            thread = self.scenarios.get(scenario_id)
+        if thread is not None:
+            thread.notify(event)
+
+    def job_event(self, address, event):
+        """Apply a lifecycle event pushed by an agent to the
+        watched JobInstance it is about.
+
+        Events are applied by the scheduler rather than by the
+        thread reading from the agent connection.
+        """
+        if self._watching_scenarios(event['instance_id']):
+            self._schedule_event(address, event, EVENT_RETRIES)
 
-def status_manager(job_instance_id, scenario_instance_id, username):
-    """Check and update the status of a job instance based
-    on the informations returned by its agent.
+    def _schedule_event(self, address, event, retries, delay=0):
+        run_date = timezone.now() + timedelta(seconds=delay)
+        self.scheduler.add_job(
+                self._apply_event, 'date', run_date=run_date,
+                args=(address, event, retries), misfire_grace_time=None)
+
+    def _apply_event(self, address, event, retries):
+        job_instance_id = event['instance_id']
+        try:
+            scenario_ids = self._watching_scenarios(job_instance_id)
+            if not scenario_ids:
+                return
+
+            try:
+                job_instance = JobInstance.objects.select_related(
+                        'agent', 'openbach_function_instance',
+                ).get(id=job_instance_id)
+            except JobInstance.DoesNotExist:
+                return
+
+            agent = job_instance.agent
+            if agent is None or (agent.address, agent.port) != address or job_instance.job_name != event['name']:
+                return
+
+            if job_instance.get_status() is JobInstance.Status.SCHEDULED:
+                # The agent was faster than the Openbach Function
+                # that started the JobInstance, try again later
+                if retries > 0:
+                    self._schedule_event(address, event, retries - 1, EVENT_RETRY_DELAY)
+                return
+
+            job_instance.set_status(job_instance.get_status(event['status'].title()))
+            for scenario_id in scenario_ids:
+                check_job_instance(scenario_id, job_instance)
+        finally:
+            db.connections.close_all()
+
+
+def watch_agent(address, port):
+    """Check and update the status of the watched job instances
+    of an agent based on the informations it returns for all of
+    them at once, then plan the next check depending on how soon
+    they are expected to end.
 
     When jobs finish, remove them from StatusManager watches.
     """
-    job_status_manager = StatusJobInstance(job_instance_id, update=True)
-    job_status_manager.configure_user(username)
+    manager = StatusManager()
+    period = STATUS_POLLING_PERIOD
     try:
-        job_instance = job_status_manager.get_job_instance_or_not_found_error()
-    except errors.ConductorError:
-        StatusManager().remove_job(scenario_instance_id, job_instance_id)
-        return
+        watched = manager.watched_job_instances(address, port)
+        job_instances = JobInstance.objects.filter(
+                id__in=[job_id for _, job_id in watched],
+        ).select_related('agent', 'openbach_function_instance')
+        job_instances = {job_instance.id: job_instance for job_instance in job_instances}
+
+        updated = []
+        for scenario_instance_id, job_instance_id in watched:
+            try:
+                job_instance = job_instances[job_instance_id]
+            except KeyError:
+                manager.remove_job(scenario_instance_id, job_instance_id)
+                continue
 
-    if job_instance.get_status() is JobInstance.Status.SCHEDULED:
-        # Openbach Function did not finish properly yet
-        return
+            if job_instance.get_status() is JobInstance.Status.SCHEDULED:
+                # Openbach Function did not finish properly yet
+                continue
+
+            updated.append((scenario_instance_id, job_instance))
+
+        StatusJobInstanceConductor._update_job_instances_status(
+                {job_instance.id: job_instance for _, job_instance in updated}.values())
+
+        for scenario_instance_id, job_instance in updated:
+            check_job_instance(scenario_instance_id, job_instance)
+
+        still_watched = {job_id for _, job_id in manager.watched_job_instances(address, port)}
+        period = polling_period(
+                job_instance for job_id, job_instance in job_instances.items()
+                if job_id in still_watched)
+    finally:
+        # Keep watching even if this round failed
+        if manager.watched_job_instances(address, port):
+            manager.schedule_watch(address, port, period)
+
+
+def polling_period(job_instances):
+    """Compute how long to wait before checking the
+    status of the given JobInstances again.
+    """
+    job_instances = list(job_instances)
+    persistent_jobs = set(Job.objects.filter(
+            name__in={job_instance.job_name for job_instance in job_instances},
+            persistent=True,
+    ).values_list('name', flat=True))
+
+    now = timezone.now()
+    durations = {}
+    period = STATUS_POLLING_MAX_PERIOD
+    for job_instance in job_instances:
+        job_name = job_instance.job_name
+        if job_instance.periodic or job_name in persistent_jobs:
+            # Running until someone stops it
+            continue
+
+        if job_name not in durations:
+            durations[job_name] = expected_duration(job_name)
+        duration = durations[job_name]
+        if duration is None:
+            period = min(period, STATUS_POLLING_PERIOD)
+            continue
+
+        remaining = (job_instance.start_date + duration - now).total_seconds()
+        if remaining > 0:
+            period = min(period, remaining)
+        else:
+            # Overdue, it can end at any time now
+            period = min(period, STATUS_POLLING_PERIOD)
+
+    return max(period, STATUS_POLLING_MIN_PERIOD)
 
-    try:
-        job_status_manager.action()
-    except errors.ConductorWarning:
-        job_instance.set_status(JobInstance.Status.AGENT_UNREACHABLE)
-    except errors.ConductorError:
-        job_instance.set_status(JobInstance.Status.ERROR)
 
+def expected_duration(job_name):
+    """Guess how long an instance of the given job lasts
+    based on how long its last runs lasted.
+    """
+    runs = JobInstance.objects.filter(
+            job_name=job_name, periodic=False, stop_date__isnull=False,
+    ).order_by('-id').values_list('start_date', 'stop_date')[:EXPECTED_DURATION_SAMPLES]
+    durations = [stop_date - start_date for start_date, stop_date in runs if stop_date > start_date]
+    if durations:
+        return max(durations)
+
+
+def check_job_instance(scenario_instance_id, job_instance):
+    """Stop watching a JobInstance once it is finished or
+    its agent has been unreachable for too long, and let
+    the scenario instance that started it know about it.
+    """
     if job_instance.is_stopped:
-        StatusManager().remove_job(scenario_instance_id, job_instance_id)
+        StatusManager().remove_job(scenario_instance_id, job_instance.id)
     elif job_instance.get_status() is JobInstance.Status.AGENT_UNREACHABLE:
         # TODO: do we need to check if job_instance.openbach_function_instance is not None ?
         if job_instance.last_status > job_instance.openbach_function_instance.status_retry_delay:
             job_instance.stop_date = job_instance.update_status
             job_instance.save()
-            StatusManager().remove_job(scenario_instance_id, job_instance_id)
+            StatusManager().remove_job(scenario_instance_id, job_instance.id)
+
+    StatusManager().notify_scenario(scenario_instance_id, (
+            'job', job_instance.id,
+            job_instance.is_stopped, job_instance.get_status()))
 
 
 #################################
@@ -260,13 +457,16 @@ class StartJobInstance(OpenbachFunctionMixin, StartJobInstanceConductor):
 
         StatusManager().add_job(
                 openbach_function_instance.scenario_instance.id,
-                self.instance_id,
-                self.connected_user.get_username())
+                self.instance_id)
         return super().openbach_function(openbach_function_instance)
 
 
 class StopJobInstance(OpenbachFunctionMixin, StopJobInstanceConductor):
     def openbach_function(self, openbach_function_instance):
+        self.resolve_instance_id(openbach_function_instance)
+        return super().openbach_function(openbach_function_instance)
+
+    def resolve_instance_id(self, openbach_function_instance):
         """Retrieve the job instance id launched by the provided
         openbach function id and store it in the instance for the
         _action to take effect.
@@ -295,23 +495,28 @@ class StopJobInstance(OpenbachFunctionMixin, StopJobInstanceConductor):
                     'not associated to a launched job',
                     openbach_function_id=actual_id,
                     openbach_function_name=openbach_function_to_stop.name)
-        return super().openbach_function(openbach_function_instance)
 
 
 class StopJobInstances(OpenbachFunctionMixin, StopJobInstancesConductor):
     def openbach_function(self, openbach_function_instance):
-        issues = []
-        has_error = False
+        stop_jobs = []
+        failures = []
         for stop_id in self.openbach_function_ids:
+            stop_job = StopJobInstance(date=self.date, openbach_function_id=stop_id)
+            self.share_user(stop_job)
+            stop_job.openbach_function_instance = openbach_function_instance
             try:
-                stop_job = StopJobInstance(date=self.date, openbach_function_id=stop_id)
-                self.share_user(stop_job)
-                stop_job.openbach_function(openbach_function_instance)
-            except errors.ConductorWarning as e:
-                issues.append(e.json)
+                stop_job.resolve_instance_id(openbach_function_instance)
             except errors.ConductorError as e:
-                issues.append(e.json)
-                has_error = True
+                failures.append(e)
+            else:
+                stop_jobs.append(stop_job)
+
+        # Stop orders are grouped in a single request per agent
+        failures.extend(self._stop_job_instances(stop_jobs))
+        failures = [error for error in failures if error is not None]
+        issues = [error.json for error in failures]
+        has_error = any(not isinstance(error, errors.ConductorWarning) for error in failures)
         if has_error:
             raise errors.ConductorError(
                     'Stopping one or more JobInstance produced an error',
@@ -430,9 +635,10 @@ class Reboot(OpenbachFunctionMixin, RebootConductor):
 ##############################
 
 class OpenbachFunctionThread(threading.Thread):
-    def __init__(self, openbach_function_instance):
+    def __init__(self, openbach_function_instance, on_update=None):
         super().__init__()
         self._stopped = threading.Event()
+        self._on_update = on_update
 
         openbach_function = openbach_function_instance.openbach_function
         self._set_action(
@@ -466,6 +672,11 @@ class OpenbachFunctionThread(threading.Thread):
             }
             syslog.syslog(syslog.LOG_ERR, str(log_message))
             self.openbach_function.set_status(OpenbachFunctionInstance.Status.ERROR)
+        finally:
+            if self._on_update is not None:
+                self._on_update((
+                        'function', self.openbach_function.openbach_function_id,
+                        self.openbach_function.get_status()))
 
     def _run(self):
         time.sleep(self.openbach_function.wait_time)
@@ -511,12 +722,169 @@ class OpenbachFunctionThread(threading.Thread):
         self._stopped.set()
 
 
+class ScenarioGraph:
+    """In-memory view of the waiting conditions between the Openbach
+    Functions of a ScenarioInstance and of the state of the instances
+    they spawned.
+
+    The graph is loaded once and then kept up-to-date from the events
+    sent by the Openbach Functions threads and the StatusManager, so
+    scheduling decisions do not need to query the database.
+    """
+
+    def __init__(self, scenario_instance):
+        self.scenario_instance = scenario_instance
+
+        # Latest instance of each Openbach Function, retried ones are replaced
+        self.functions = {}
+        self.status = {}
+        for instance in scenario_instance.openbach_functions_instances.order_by('id'):
+            self.functions[instance.openbach_function_id] = instance
+            self.status[instance.openbach_function_id] = instance.get_status()
+
+        function_ids = list(self.functions)
+        self.waiters = {
+                function_id: {condition: set() for condition in WAITING_CONDITIONS}
+                for function_id in function_ids
+        }
+        for condition, model in WAITING_CONDITIONS.items():
+            waiting = model.objects.filter(
+                    openbach_function_instance__in=function_ids,
+            ).values_list('openbach_function_instance', 'openbach_function_waited')
+            for function_id, waited_id in waiting:
+                self.waiters[function_id][condition].add(waited_id)
+
+        self.ignored_failures = set(FailurePolicy.objects.filter(
+                openbach_function__in=function_ids,
+                policy=FailurePolicy.Policies.IGNORE,
+        ).values_list('openbach_function', flat=True))
+        self.starting_jobs = set(StartJobInstanceOpenbachFunction.objects.filter(
+                id__in=function_ids).values_list('id', flat=True))
+        self.starting_scenarios = set(StartScenarioInstanceOpenbachFunction.objects.filter(
+                id__in=function_ids).values_list('id', flat=True))
+
+        # JobInstance id -> (function id, is stopped, has failed)
+        self.jobs = {}
+        # ScenarioInstance id -> (function id, has ended)
+        self.scenarios = {}
+        self.refresh()
+
+    def refresh(self):
+        """Read back the state of the spawned JobInstances and
+        ScenarioInstances from the database.
+        """
+        jobs = JobInstance.objects.filter(
+                openbach_function_instance__scenario_instance=self.scenario_instance,
+        ).values_list('id', 'openbach_function_instance__openbach_function', 'stop_date', 'status')
+        self.jobs = {
+                job_id: (function_id, stop_date is not None, JobInstance.Status(status) in FAILED_JOBS)
+                for job_id, function_id, stop_date, status in jobs
+        }
+
+        scenarios = ScenarioInstance.objects.filter(
+                openbach_function_instance__scenario_instance=self.scenario_instance,
+        ).values_list('id', 'openbach_function_instance__openbach_function', 'status')
+        self.scenarios = {
+                scenario_id: (function_id, ScenarioInstance.Status(status) in ENDED_SCENARIOS)
+                for scenario_id, function_id, status in scenarios
+        }
+
+    def update_function(self, function_id, status):
+        self.status[function_id] = status
+
+    def update_job(self, job_id, is_stopped, status):
+        """Store the new state of a JobInstance and return
+        whether it was already known to this graph.
+        """
+        try:
+            function_id, _, _ = self.jobs[job_id]
+        except KeyError:
+            return False
+        self.jobs[job_id] = (function_id, is_stopped, status in FAILED_JOBS)
+        return True
+
+    def replace(self, openbach_function_instance):
+        function_id = openbach_function_instance.openbach_function_id
+        self.functions[function_id] = openbach_function_instance
+        self.status[function_id] = openbach_function_instance.get_status()
+
+    def _has_status(self, function_id, statuses):
+        return self.status.get(function_id) in statuses
+
+    def _spawned_running(self, function_ids):
+        return any(
+                not is_stopped for function_id, is_stopped, _ in self.jobs.values()
+                if function_id in function_ids
+        ) or any(
+                not has_ended for function_id, has_ended in self.scenarios.values()
+                if function_id in function_ids
+        )
+
+    def _has_spawned(self, function_id):
+        return any(
+                spawner == function_id for spawner, _, _ in self.jobs.values()
+        ) or any(
+                spawner == function_id for spawner, _ in self.scenarios.values()
+        )
+
+    def _is_ready(self, function_id):
+        waited = self.waiters.get(function_id, {})
+        SCHEDULED = OpenbachFunctionInstance.Status.SCHEDULED
+        FINISHED = OpenbachFunctionInstance.Status.FINISHED
+        if any(self._has_status(f, {SCHEDULED}) for f in waited.get('running', ())):
+            # Wait for running openbach functions are not all started yet
+            return False
+        if any(self._has_status(f, UNFINISHED_FUNCTIONS) for f in waited.get('ended', ())):
+            # Wait for ended openbach functions are not all done yet
+            return False
+        if any(f in self.status and not self._has_status(f, {FINISHED}) for f in waited.get('launched', ())):
+            # Wait for launched openbach functions are not all launched yet
+            return False
+
+        finished = waited.get('finished', set())
+        if not all(self._has_spawned(f) for f in finished):
+            return False
+        return not self._spawned_running(finished)
+
+    def ready_functions(self):
+        return [
+                self.functions[function_id]
+                for function_id, status in self.status.items()
+                if status is OpenbachFunctionInstance.Status.SCHEDULED
+                and self._is_ready(function_id)
+        ]
+
+    def errored_functions(self):
+        return [
+                self.functions[function_id]
+                for function_id, status in self.status.items()
+                if status is OpenbachFunctionInstance.Status.ERROR
+                and self.functions[function_id].retries_left is not None
+        ]
+
+    def has_failed_jobs(self):
+        return any(
+                is_stopped and has_failed
+                for function_id, is_stopped, has_failed in self.jobs.values()
+                if function_id in self.starting_jobs
+                and function_id not in self.ignored_failures
+        )
+
+    def has_unfinished_functions(self):
+        return any(status in UNFINISHED_FUNCTIONS for status in self.status.values())
+
+    def has_instances_running(self):
+        return self._spawned_running(self.starting_jobs | self.starting_scenarios)
+
+
 class ScenarioInstanceStatus(threading.Thread):
     def __init__(self, scenario_instance_id):
         super().__init__()
         self.scenario_instance = ScenarioInstance.objects.get(id=scenario_instance_id)
         self._openbach_functions = []
         self._is_stopped = threading.Event()
+        self._events = queue.Queue()
+        self._graph = None
 
     def run(self):
         try:
@@ -532,18 +900,15 @@ class ScenarioInstanceStatus(threading.Thread):
             }
             syslog.syslog(syslog.LOG_ERR, str(log_message))
             self._terminate_instance()
+        finally:
+            parent = self.scenario_instance.openbach_function_instance
+            if parent is not None:
+                StatusManager().notify_scenario(parent.scenario_instance_id)
 
     def _run(self):
         self.scenario_instance.status = ScenarioInstance.Status.RUNNING
         self.scenario_instance.save()
-
-        openbach_functions_instances = self.scenario_instance.openbach_functions_instances
-        spawned_jobs = OpenbachFunctionInstance.objects.filter(
-                id__in=StartJobInstanceOpenbachFunction.objects.values('instances'),
-                scenario_instance=self.scenario_instance).values('started_job')
-        spawned_scenarios = OpenbachFunctionInstance.objects.filter(
-                id__in=StartScenarioInstanceOpenbachFunction.objects.values('instances'),
-                scenario_instance=self.scenario_instance).values('started_scenario')
+        self._graph = graph = ScenarioGraph(self.scenario_instance)
 
         # Create all openbach functions threads with respect to dependencies
         while True:
@@ -552,12 +917,12 @@ class ScenarioInstanceStatus(threading.Thread):
                 self._join_openbach_functions()
                 return
 
-            if JobInstance.objects.filter(FAILED_JOBS, id__in=spawned_jobs).exclude(IGNORABLE_JOBS).exists():
+            if graph.has_failed_jobs():
                 self._terminate_instance()
                 self._join_openbach_functions()
                 return
 
-            for failed_obf_instance in openbach_functions_instances.filter(ERRORED_FUNCTIONS_NOT_IGNORED):
+            for failed_obf_instance in graph.errored_functions():
                 if failed_obf_instance.retries_left > 0:
                     try:
                         self._launch_openbach_function_instance(failed_obf_instance, True)
@@ -571,64 +936,55 @@ class ScenarioInstanceStatus(threading.Thread):
                 self._join_openbach_functions()
                 return
 
-            for openbach_function_instance in openbach_functions_instances.filter(PLANNED_FUNCTIONS):
-                function = openbach_function_instance.openbach_function
-                if OpenbachFunctionInstance.objects.filter(
-                        openbach_function__id__in=function.running_waiters.values('openbach_function_waited'),
-                        scenario_instance=self.scenario_instance).filter(PLANNED_FUNCTIONS).exists():
-                    # Wait for running openbach functions are not all started yet
-                    continue
-                if OpenbachFunctionInstance.objects.filter(
-                        openbach_function__id__in=function.ended_waiters.values('openbach_function_waited'),
-                        scenario_instance=self.scenario_instance).filter(UNFINISHED_FUNCTIONS).exists():
-                    # Wait for ended openbach functions are not all started yet
-                    continue
-                if OpenbachFunctionInstance.objects.filter(
-                        openbach_function__id__in=function.launched_waiters.values('openbach_function_waited'),
-                        scenario_instance=self.scenario_instance).exclude(FINISHED_FUNCTIONS).exists():
-                    # Wait for launched openbach functions are not all launched yet
-                    continue
-
-                if self._has_waited_instances_finished(function):
-                    self._launch_openbach_function_instance(openbach_function_instance)
-
-            if openbach_functions_instances.filter(UNFINISHED_FUNCTIONS).exists():
-                time.sleep(0.2)
-                continue
+            for openbach_function_instance in graph.ready_functions():
+                self._launch_openbach_function_instance(openbach_function_instance)
 
-            if self._has_instances_running(spawned_jobs, spawned_scenarios):
-                time.sleep(1)
-            else:
+            if not graph.has_unfinished_functions() and not graph.has_instances_running():
                 break
 
+            self._wait_for_events()
+
         self._join_openbach_functions()
         self.scenario_instance.stop(stop_status=ScenarioInstance.Status.FINISHED_OK)
         StatusManager().remove_scenario(self.scenario_instance.id)
 
-    def stop(self):
-        self._is_stopped.set()
+    def _wait_for_events(self):
+        """Block until something happened to this scenario
+        and apply it to the scheduling graph.
+        """
+        try:
+            events = [self._events.get(timeout=SCENARIO_RESYNC_PERIOD)]
+        except queue.Empty:
+            self._graph.refresh()
+            return
 
-    @staticmethod
-    def _has_instances_running(started_jobs, started_scenarios):
-        jobs_not_finished = JobInstance.objects.filter(stop_date__isnull=True, id__in=started_jobs)
-        scenarios_not_finished = ScenarioInstance.objects.filter(~SCENARIOS_ENDED, id__in=started_scenarios)
-        return jobs_not_finished.exists() or scenarios_not_finished.exists()
-
-    def _has_waited_instances_finished(self, function):
-        waited_instances = function.finished_waiters.values('openbach_function_waited')
-        wait_for_finished = OpenbachFunctionInstance.objects.filter(
-                openbach_function__id__in=waited_instances,
-                scenario_instance=self.scenario_instance)
-
-        instances_keywords = ('started_job', 'started_scenario')
-        started_instances = wait_for_finished.values(*instances_keywords).exclude(
-                **{'{}__isnull'.format(k): True for k in instances_keywords})
-        if waited_instances.count() != started_instances.count():
-            return False
+        with suppress(queue.Empty):
+            while True:
+                events.append(self._events.get_nowait())
+
+        refresh = False
+        for event in events:
+            if event is None:
+                # Wake up call, only the database may know what changed
+                refresh = True
+            elif event[0] == 'function':
+                _, function_id, status = event
+                self._graph.update_function(function_id, status)
+                # Openbach Functions may have started, stopped
+                # or restarted JobInstances and ScenarioInstances
+                refresh = True
+            elif event[0] == 'job':
+                _, job_id, is_stopped, status = event
+                refresh = refresh or not self._graph.update_job(job_id, is_stopped, status)
+        if refresh:
+            self._graph.refresh()
+
+    def notify(self, event=None):
+        self._events.put(event)
 
-        return not self._has_instances_running(
-                wait_for_finished.values('started_job'),
-                wait_for_finished.values('started_scenario'))
+    def stop(self):
+        self._is_stopped.set()
+        self.notify()
 
     def _launch_openbach_function_instance(self, openbach_function_instance, use_retry=False):
         if use_retry:
@@ -639,7 +995,8 @@ class ScenarioInstanceStatus(threading.Thread):
                     scenario_instance=openbach_function_instance.scenario_instance,
                     status=OpenbachFunctionInstance.Status.SCHEDULED)
             openbach_function_instance.validate_restart(retries_left)
-        openbach_function_thread = OpenbachFunctionThread(openbach_function_instance)
+        openbach_function_thread = OpenbachFunctionThread(openbach_function_instance, self.notify)
+        self._graph.replace(openbach_function_instance)
         self._openbach_functions.append(openbach_function_thread)
         openbach_function_thread.start()
 
@@ -723,15 +1080,14 @@ def main(socket_name=DEFAULT_UNIX_DOMAIN):
 
     # Restart previous scenarios in case of a crash
     status_manager = StatusManager()
+    AgentConnections().add_listener(status_manager.job_event)
     unfinished_scenarios = ScenarioInstance.objects.exclude(SCENARIOS_ENDED)
     for scenario in unfinished_scenarios:
-        owner = scenario.started_by
-        owner_name = None if owner is None else owner.get_username()
         started_jobs = scenario.openbach_functions_instances.values('started_job')
         for job_instance in JobInstance.objects.filter(id__in=started_jobs):
-            status_manager.add_job(scenario.id, job_instance.id, owner_name)
+            status_manager.add_job(scenario.id, job_instance.id)
         stopper = StopScenarioInstance(scenario.id)
-        stopper.connected_user = owner
+        stopper.connected_user = scenario.started_by
         stopper.action()
 
     # Start listening for orders
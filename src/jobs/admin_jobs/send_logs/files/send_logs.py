@@ -37,13 +37,17 @@ __credits__ = '''Contributors:
 
 
 import os
+import sys
+import time
+import signal
 import socket
 import syslog
 import argparse
+import threading
 from pathlib import Path
 from datetime import datetime
-from functools import partial
 from contextlib import suppress
+from concurrent.futures import ThreadPoolExecutor
 try:
     import simplejson as json
 except ImportError:
@@ -56,7 +60,10 @@ import collect_agent
 
 # Configure logger
 LOGS_DIR = Path('/var/log/openbach/')
+CHECKPOINT_FILE = Path('/opt/openbach/agent/jobs/send_logs/send_logs.checkpoint')
 DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+BATCH_SIZE = 200
+CHECKPOINT_INTERVAL = 5
 
 
 def get_collector_infos(
@@ -71,7 +78,7 @@ def get_collector_infos(
     return config
 
 
-def build_socket_sender():
+def get_logstash_infos():
     try:
         collector = get_collector_infos()
     except yaml.YAMLError:
@@ -98,7 +105,16 @@ def build_socket_sender():
                 'Collector configuration file is malformed')
         raise
 
-    logstash = (address, int(port))
+    return (address, int(port)), sock_type
+
+
+def build_socket_sender(logstash, sock_type):
+    """Create a socket to logstash and a function sending a
+    batch of messages through it.
+
+    Messages are coalesced into a single write on TCP; on UDP
+    logstash expects a single message per datagram.
+    """
     try:
         sock = socket.socket(socket.AF_INET, sock_type)
     except socket.error:
@@ -107,46 +123,173 @@ def build_socket_sender():
 
     if sock_type == socket.SOCK_STREAM:
         sock.connect(logstash)
-        sender = sock.send
+
+        def sender(messages):
+            sock.sendall(b''.join(message + b'\n' for message in messages))
     else:
-        def sender(message):
-            sock.sendto(message, logstash)
+        def sender(messages):
+            for message in messages:
+                sock.sendto(message, logstash)
 
     return sock, sender
 
 
-def send_logs(file_path, send_log):
-    with file_path.open() as log:
-        for line in log:
-            message = (
-                    '<{line[pri]}>{line[timestamp]} '
-                    '{line[hostname]} {line[programname]}'
-                    '[{line[procid]}]: {line[msg]}'
-                    .format(line=json.loads(line))
-            )
-            try:
-                send_log(message.encode())
-            except socket.error as error:
-                collect_agent.send_log(
-                        syslog.LOG_NOTICE,
-                        'Error code: {}, Message {}'.format(*error))
-                raise
+class RateLimiter:
+    """Token bucket shared between workers to limit the
+    amount of messages sent to logstash per second.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.capacity = max(rate, BATCH_SIZE)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount):
+        if not self.rate:
+            return
+
+        with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                time.sleep((amount - self.tokens) / self.rate)
+
+
+class Checkpoint:
+    """Keep track of how far each log file has been sent so an
+    interrupted dump can resume where it left off.
+    """
+
+    def __init__(self, path, origin, jobs):
+        self.path = path
+        self.parameters = {'origin': origin.strftime(DATE_FORMAT), 'jobs': sorted(jobs or [])}
+        self.offsets = {}
+        self.saved = time.monotonic()
+        self.lock = threading.Lock()
+
+        with suppress(OSError, ValueError, TypeError, KeyError):
+            with path.open() as stream:
+                content = json.load(stream)
+            if content['parameters'] == self.parameters:
+                self.offsets = content['offsets']
+
+    def __getitem__(self, file_path):
+        return self.offsets.get(file_path.name, 0)
+
+    def __setitem__(self, file_path, offset):
+        with self.lock:
+            self.offsets[file_path.name] = offset
+            now = time.monotonic()
+            if now - self.saved >= CHECKPOINT_INTERVAL:
+                self.saved = now
+                self._save()
+
+    def _save(self):
+        temporary = self.path.with_suffix('.tmp')
+        with temporary.open('w') as stream:
+            json.dump({'parameters': self.parameters, 'offsets': self.offsets}, stream)
+        os.replace(temporary.as_posix(), self.path.as_posix())
+
+    def save(self):
+        with self.lock:
+            self._save()
+
+    def remove(self):
+        with suppress(FileNotFoundError):
+            self.path.unlink()
+
+
+def format_log(line):
+    return (
+            '<{line[pri]}>{line[timestamp]} '
+            '{line[hostname]} {line[programname]}'
+            '[{line[procid]}]: {line[msg]}'
+            .format(line=json.loads(line))
+    ).encode()
 
 
-def main(origin, jobs=None):
-    sock, send_log = build_socket_sender()
+def send_logs(file_path, logstash, sock_type, rate_limiter, checkpoint, stopped):
+    sock, send_log = build_socket_sender(logstash, sock_type)
+    with sock, file_path.open('rb') as log:
+        log.seek(checkpoint[file_path])
+        messages = []
+        for line in iter(log.readline, b''):
+            with suppress(ValueError, KeyError):
+                messages.append(format_log(line))
+            if len(messages) >= BATCH_SIZE:
+                send_batch(send_log, messages, rate_limiter)
+                checkpoint[file_path] = log.tell()
+                messages = []
+                if stopped.is_set():
+                    return
+        send_batch(send_log, messages, rate_limiter)
+        checkpoint[file_path] = log.tell()
+
+
+def send_batch(send_log, messages, rate_limiter):
+    if not messages:
+        return
+
+    rate_limiter.acquire(len(messages))
+    try:
+        send_log(messages)
+    except socket.error as error:
+        collect_agent.send_log(
+                syslog.LOG_NOTICE,
+                'Error code: {}, Message {}'.format(error.errno, error.strerror))
+        raise
+
+
+def stop(signum, frame):
+    sys.exit('Interrupted by signal {}, progress saved in {}'.format(signum, CHECKPOINT_FILE))
+
+
+def main(origin, jobs=None, rate=0, workers=4):
+    logstash, sock_type = get_logstash_infos()
 
     if jobs is not None:
         jobs = set(jobs)
     origin_timestamp = origin.timestamp()
 
-    with sock:
-        for file_path in LOGS_DIR.iterdir():
-            job_name, _ = filepath.stem.rsplit('_', 1)
+    log_files = []
+    for file_path in LOGS_DIR.iterdir():
+        with suppress(ValueError):
+            job_name, _ = file_path.stem.rsplit('_', 1)
             file_timestamp = file_path.lstat().st_mtime
             if (not jobs or job_name in jobs) and file_timestamp >= origin_timestamp:
-                with suppress(ValueError):
-                    send_logs(file_path, send_log)
+                log_files.append(file_path)
+
+    rate_limiter = RateLimiter(rate)
+    checkpoint = Checkpoint(CHECKPOINT_FILE, origin, jobs)
+    stopped = threading.Event()
+    try:
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            tasks = [
+                    executor.submit(
+                        send_logs, file_path, logstash, sock_type,
+                        rate_limiter, checkpoint, stopped)
+                    for file_path in log_files
+            ]
+            try:
+                for task in tasks:
+                    task.result()
+            except BaseException:
+                # Let running workers stop at their next batch
+                stopped.set()
+                for task in tasks:
+                    task.cancel()
+                raise
+    except BaseException:
+        checkpoint.save()
+        raise
+    else:
+        checkpoint.remove()
 
 
 if __name__ == '__main__':
@@ -165,6 +308,12 @@ if __name__ == '__main__':
                 '-j', '--job-name',
                 action='append',
                 help='name of a Job to send logs from (leave empty to send logs from all jobs)')
+        parser.add_argument(
+                '-r', '--rate', type=int, default=0,
+                help='maximum amount of logs sent per second (0 for no limit)')
+        parser.add_argument(
+                '-w', '--workers', type=int, default=4,
+                help='amount of log files to send in parallel')
 
         # get args
         args = parser.parse_args()
@@ -173,4 +322,5 @@ if __name__ == '__main__':
         except ValueError:
             parser.error('date and time are not in the expected ({}) format'.format(DATE_FORMAT))
         else:
-            main(date, args.job_name)
+            signal.signal(signal.SIGTERM, stop)
+            main(date, args.job_name, args.rate, args.workers)
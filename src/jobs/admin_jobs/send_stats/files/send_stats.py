@@ -37,8 +37,11 @@ __credits__ = '''Contributors:
 
 
 import os
+import gzip
 import time
+import struct
 import syslog
+import bisect
 import argparse
 from pathlib import Path
 from datetime import datetime
@@ -47,41 +50,149 @@ try:
     import simplejson as json
 except ImportError:
     import json
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 import collect_agent
 
 
 DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
 STATS_FOLDER = Path('/var/openbach_stats/')
-
-
-def forward_statistics(stats):
-    metadata = stats.pop('_metadata')
-    timestamp = metadata.pop('time')
-    suffix = metadata.pop('suffix', None)
-    collect_agent.send_stat(timestamp, suffix=suffix, metadatas=metadata, **stats)
+COMPRESSIONS = ('.gz', '.zst')
+# Entries of the index files written by rstats: latest timestamp found before an offset
+INDEX = struct.Struct('>qQ')
+BATCH_SIZE = 500
+PROGRESS_INTERVAL = 10
+
+
+class Replay:
+    """Forward statistics to rstats in batches and
+    periodically report on the progress made.
+    """
+
+    def __init__(self, batch):
+        self.batch = batch
+        self.sent = 0
+        self.started = self.reported = time.monotonic()
+
+    def forward_statistics(self, stats):
+        metadata = stats.pop('_metadata')
+        timestamp = metadata.pop('time')
+        suffix = metadata.pop('suffix', None)
+        self.batch.send_stat(timestamp, suffix=suffix, metadatas=metadata, **stats)
+        self.sent += 1
+
+        now = time.monotonic()
+        if now - self.reported >= PROGRESS_INTERVAL:
+            self.reported = now
+            self.report(now)
+
+    def report(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        elapsed = now - self.started
+        throughput = self.sent / elapsed if elapsed else 0.0
+        collect_agent.send_log(
+                syslog.LOG_INFO,
+                'Sent {} statistics in {:.1f}s ({:.0f} statistics/s)'
+                .format(self.sent, elapsed, throughput))
+        collect_agent.send_stat(
+                collect_agent.now(),
+                replayed_statistics=self.sent,
+                throughput=throughput)
+
+
+def open_statistics_file(file_path):
+    if file_path.suffix == '.gz':
+        return gzip.open(file_path.as_posix(), 'rb')
+    if file_path.suffix == '.zst':
+        if zstandard is None:
+            raise OSError('zstandard is not installed, cannot read {}'.format(file_path))
+        return zstandard.ZstdDecompressor().stream_reader(file_path.open('rb'), closefd=True)
+    return file_path.open('rb')
+
+
+def find_offset(file_path, origin):
+    """Use the index written by rstats alongside a statistics
+    file to find the offset after which statistics newer than
+    origin (in milliseconds) can be found.
+    """
+    uncompressed = file_path.with_suffix('') if file_path.suffix in COMPRESSIONS else file_path
+    try:
+        with uncompressed.with_name(uncompressed.name + '.idx').open('rb') as index:
+            content = index.read()
+    except OSError:
+        return 0
+
+    # Ignore an entry partially written
+    content = content[:len(content) - len(content) % INDEX.size]
+    latests, offsets = zip(*INDEX.iter_unpack(content)) if content else ((), ())
+    position = bisect.bisect_left(latests, origin)
+    return offsets[position - 1] if position else 0
+
+
+def read_statistics(file_path, offset=0):
+    """Iterate over the statistics stored by rstats in the given
+    file, whatever its encoding and compression, starting at the
+    given offset in the uncompressed content.
+    """
+    encoding = file_path.suffix
+    if encoding in COMPRESSIONS:
+        encoding = file_path.with_suffix('').suffix
+
+    if encoding == '.msgpack':
+        if msgpack is None:
+            raise OSError('msgpack is not installed, cannot read {}'.format(file_path))
+        with open_statistics_file(file_path) as statistics:
+            statistics.seek(offset)
+            yield from msgpack.Unpacker(statistics, raw=False)
+    elif encoding == '.stats':
+        with open_statistics_file(file_path) as statistics:
+            statistics.seek(offset)
+            for line in statistics:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    pass
+
+
+def is_statistics_file(file_path):
+    return file_path.suffix not in ('.idx', '.part')
 
 
 def main(origin, jobs=None):
     if jobs is not None:
         jobs = set(jobs)
     origin_timestamp = origin.timestamp()
-
-    for job_folder in STATS_FOLDER.iterdir():
-        if (jobs and job_folder.name not in jobs) or not job_folder.is_dir():
-            continue
-   
-        for file_path in sorted(job_folder.iterdir()):
-            file_timestamp = file_path.lstat().st_mtime
-            if file_timestamp >= origin_timestamp:
-                with file_path.open() as statistics:
-                    for line in statistics:
-                        try:
-                            statistic = json.loads(line)
-                        except ValueError:
-                            pass
-                        else:
-                            forward_statistics(statistic)
+    origin_milliseconds = int(origin_timestamp * 1000)
+
+    with collect_agent.batch(BATCH_SIZE) as batch:
+        replay = Replay(batch)
+        for job_folder in STATS_FOLDER.iterdir():
+            if (jobs and job_folder.name not in jobs) or not job_folder.is_dir():
+                continue
+
+            for file_path in sorted(filter(is_statistics_file, job_folder.iterdir())):
+                file_timestamp = file_path.lstat().st_mtime
+                if file_timestamp < origin_timestamp:
+                    continue
+
+                offset = find_offset(file_path, origin_milliseconds)
+                try:
+                    for statistic in read_statistics(file_path, offset):
+                        with suppress(KeyError, TypeError):
+                            if statistic['_metadata']['time'] < origin_milliseconds:
+                                continue
+                        replay.forward_statistics(statistic)
+                except OSError as e:
+                    collect_agent.send_log(syslog.LOG_WARNING, 'Could not read {}: {}'.format(file_path, e))
+    replay.report()
 
 
 if __name__ == "__main__":